@@ -0,0 +1,259 @@
+import datetime
+import re
+import sqlite3
+import numpy as np
+
+try:
+    from ..features import PLATFORMS
+except ImportError:  # started from inside aiml/
+    from features import PLATFORMS
+
+# Columns of every table the aiml services touch. The DDL below is plain
+# enough for both MySQL and SQLite.
+TABLES = {
+    'merchants': [
+        "merchant_id INT NOT NULL", "email VARCHAR(255) NOT NULL",
+        "is_shipway VARCHAR(1)", "is_unicommerce VARCHAR(1)", "is_convertway VARCHAR(1)",
+        "multiplier_shipway DOUBLE", "multiplier_unicommerce DOUBLE", "multiplier_convertway DOUBLE",
+        "register_shipway DATE", "register_unicommerce DATE", "register_convertway DATE",
+        "updated_on DATETIME", "PRIMARY KEY (merchant_id)", "UNIQUE (email)"
+    ],
+    'data_shipway': [
+        "merchant_id INT NOT NULL", "from_date DATE NOT NULL", "till_date DATE NOT NULL",
+        "order_count DOUBLE", "billing_amount DOUBLE", "margin_amount DOUBLE", "complaint_count DOUBLE",
+        "returned_orders DOUBLE", "undelivered_orders DOUBLE", "services_amount DOUBLE",
+        "delayed_orders DOUBLE", "average_resolution_tat DOUBLE", "wallet_share DOUBLE",
+        "PRIMARY KEY (merchant_id, from_date, till_date)"
+    ],
+    'data_unicommerce': [
+        "merchant_id INT NOT NULL", "from_date DATE NOT NULL", "till_date DATE NOT NULL",
+        "order_count DOUBLE", "billing_amount DOUBLE", "margin_amount DOUBLE",
+        "services_amount DOUBLE", "nps_score DOUBLE", "complaint_count DOUBLE",
+        "PRIMARY KEY (merchant_id, from_date, till_date)"
+    ],
+    'data_convertway': [
+        "merchant_id INT NOT NULL", "from_date DATE NOT NULL", "till_date DATE NOT NULL",
+        "order_count DOUBLE", "billing_amount DOUBLE", "margin_amount DOUBLE", "nps_score DOUBLE",
+        "PRIMARY KEY (merchant_id, from_date, till_date)"
+    ],
+    'merchants_scores': [
+        "merchant_id INT NOT NULL",
+        "loyalty_score_shipway DOUBLE", "churn_rate_shipway DOUBLE",
+        "loyalty_score_unicommerce DOUBLE", "churn_rate_unicommerce DOUBLE",
+        "loyalty_score_convertway DOUBLE", "churn_rate_convertway DOUBLE",
+        "grand_score DOUBLE", "grand_badge VARCHAR(32)", "updated_on DATETIME",
+        "sync_till_shipway DATETIME", "sync_till_unicommerce DATETIME", "sync_till_convertway DATETIME",
+        "sync_till_grand DATETIME", "PRIMARY KEY (merchant_id)"
+    ],
+    'merchants_scores_history': [
+        "merchant_id INT NOT NULL", "from_date DATE NOT NULL", "till_date DATE",
+        "loyalty_score_shipway DOUBLE", "churn_rate_shipway DOUBLE",
+        "loyalty_score_unicommerce DOUBLE", "churn_rate_unicommerce DOUBLE",
+        "loyalty_score_convertway DOUBLE", "churn_rate_convertway DOUBLE",
+        "grand_score DOUBLE", "grand_badge VARCHAR(32)", "added_on DATETIME", "updated_on DATETIME",
+        "PRIMARY KEY (merchant_id, from_date)"
+    ]
+}
+
+# Column -> (mean, spread) for the synthetic monthly rows
+METRICS = {
+    'order_count': (400, 300), 'billing_amount': (60000, 50000), 'margin_amount': (9000, 8000),
+    'complaint_count': (6, 5), 'returned_orders': (20, 15), 'undelivered_orders': (15, 12),
+    'services_amount': (3000, 2500), 'delayed_orders': (25, 20), 'average_resolution_tat': (36, 24),
+    'wallet_share': (0.4, 0.25), 'nps_score': (30, 40)
+}
+
+
+def create_tables(conn):
+    cursor = conn.cursor()
+    try:
+        for table, columns in TABLES.items():
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(f"CREATE TABLE {table} ({', '.join(columns)})")
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def _months(count, last=datetime.date(2025, 5, 1)):
+    months = []
+    year, month = last.year, last.month
+    for _ in range(count):
+        start = datetime.date(year, month, 1)
+        end = (start + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+        months.append((start, end))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months[::-1]
+
+
+def seed(conn, merchants=1000, months=6, seed=0):
+    """Create the tables and fill them with reproducible synthetic data.
+
+    Every merchant is on shipway and convertway, two thirds are on
+    unicommerce. Each platform gets ``months`` monthly rows per merchant,
+    and merchants_scores_history gets one row per month with past scores.
+    """
+    rng = np.random.default_rng(seed)
+    create_tables(conn)
+    periods = _months(months)
+    cursor = conn.cursor()
+    try:
+        merchant_rows = []
+        for merchant_id in range(1, merchants + 1):
+            registered = [datetime.date(2020, 1, 1) + datetime.timedelta(days=int(d))
+                          for d in rng.integers(0, 1800, 3)]
+            merchant_rows.append((
+                merchant_id, f"merchant{merchant_id}@example.com",
+                '1', '1' if merchant_id % 3 else '0', '1',
+                1.0, round(float(rng.uniform(0.8, 1.5)), 2), round(float(rng.uniform(0.5, 1.2)), 2),
+                *registered
+            ))
+        cursor.executemany("""
+            INSERT INTO merchants (
+                merchant_id, email, is_shipway, is_unicommerce, is_convertway,
+                multiplier_shipway, multiplier_unicommerce, multiplier_convertway,
+                register_shipway, register_unicommerce, register_convertway, updated_on
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+        """, merchant_rows)
+
+        for platform in PLATFORMS:
+            columns = [col.split()[0] for col in TABLES[f"data_{platform}"]
+                       if col.split()[0] in METRICS]
+            rows = []
+            for merchant_id in range(1, merchants + 1):
+                if platform == 'unicommerce' and not merchant_id % 3:
+                    continue
+                for from_date, till_date in periods:
+                    values = [max(0.0, round(float(rng.normal(*METRICS[col])), 2)) for col in columns]
+                    rows.append((merchant_id, from_date, till_date, *values))
+            cursor.executemany(f"""
+                INSERT INTO data_{platform} (merchant_id, from_date, till_date, {", ".join(columns)})
+                VALUES (%s, %s, %s, {", ".join(["%s"] * len(columns))})
+            """, rows)
+
+        history_rows = []
+        for merchant_id in range(1, merchants + 1):
+            for from_date, till_date in periods[:-1]:
+                scores = [round(float(v), 2) for v in rng.uniform(0, 100, 6)]
+                history_rows.append((merchant_id, from_date, till_date, *scores))
+        cursor.executemany("""
+            INSERT INTO merchants_scores_history (
+                merchant_id, from_date, till_date,
+                loyalty_score_shipway, churn_rate_shipway,
+                loyalty_score_unicommerce, churn_rate_unicommerce,
+                loyalty_score_convertway, churn_rate_convertway, added_on
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+        """, history_rows)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+# SQLite stand-in for mysql.connector. It rewrites the MySQL dialect the
+# services use, so the real query layer runs unchanged against a file.
+
+sqlite3.register_adapter(np.int64, int)
+sqlite3.register_adapter(np.float64, float)
+sqlite3.register_adapter(datetime.date, lambda d: d.isoformat())
+
+SECONDARY_KEY = re.compile(r",\s*KEY \w+ \([^)]*\)")
+UPDATE_JOIN = re.compile(r"\s*UPDATE (\w+) (\w+)\s+JOIN \((.*)\) (\w+) ON (.*?)\s+SET (.*?)\s+WHERE (.*)$", re.S)
+
+
+def translate(sql):
+    sql = sql.replace("ON DUPLICATE KEY UPDATE", "ON CONFLICT DO UPDATE SET")
+    sql = re.sub(r"VALUES\((\w+)\)", r"excluded.\1", sql)
+    sql = sql.replace("NOW() + INTERVAL %s SECOND", "DATETIME('now', '+' || %s || ' seconds')")
+    sql = sql.replace("%s", "?").replace("NOW()", "CURRENT_TIMESTAMP")
+    sql = re.sub(r"\bFOR UPDATE\b", "", sql)
+    sql = sql.replace("GREATEST(", "MAX(").replace("LEAST(", "MIN(")
+    sql = sql.replace("INSERT IGNORE", "INSERT OR IGNORE")
+    # SQLite only takes secondary indexes as separate statements
+    sql = SECONDARY_KEY.sub("", sql)
+    match = UPDATE_JOIN.match(sql)
+    if match:
+        table, alias, subquery, sub_alias, on, sets, where = match.groups()
+        sets = re.sub(rf"\b{alias}\.", "", sets)
+        sql = f"UPDATE {table} AS {alias} SET {sets} FROM ({subquery}) AS {sub_alias} WHERE {on} AND {where}"
+    return sql
+
+
+def _dict_row(cursor, row):
+    return {column[0]: row[i] for i, column in enumerate(cursor.description)}
+
+
+class SQLiteCursor:
+    def __init__(self, raw, dictionary=False):
+        self._cursor = raw.cursor()
+        if dictionary:
+            self._cursor.row_factory = _dict_row
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(translate(sql), tuple(params or ()))
+
+    def executemany(self, sql, rows):
+        self._cursor.executemany(translate(sql), [tuple(row) for row in rows])
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, path):
+        self._raw = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None,
+                                    detect_types=sqlite3.PARSE_DECLTYPES)
+        self._raw.execute("PRAGMA journal_mode=WAL")
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self._raw, dictionary)
+
+    def commit(self):
+        if self._raw.in_transaction:
+            self._raw.execute("COMMIT")
+
+    def rollback(self):
+        if self._raw.in_transaction:
+            self._raw.execute("ROLLBACK")
+
+    def close(self):
+        self._raw.close()
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        pass
+
+
+class SQLitePool:
+    def __init__(self, path, pool_size=5, **kwargs):
+        self.path = path
+        self.pool_size = pool_size
+
+    def get_connection(self):
+        return SQLiteConnection(self.path)
+
+    def _remove_connections(self):
+        pass
+
+
+def install_sqlite(path):
+    """Point mysql.connector (connect and pooling) at the SQLite file."""
+    import mysql.connector
+    from mysql.connector import pooling
+    mysql.connector.connect = lambda **kwargs: SQLiteConnection(path)
+    pooling.MySQLConnectionPool = lambda **kwargs: SQLitePool(path, **kwargs)
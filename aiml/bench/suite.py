@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import json
+import os
+import platform as host
+import random
+import subprocess
+import sys
+import time
+import warnings
+import httpx
+import mysql.connector
+import numpy as np
+from sqlalchemy import create_engine
+
+try:
+    from .. import score_api
+    from ..db import db_config
+    from ..features import PLATFORMS
+    from ..history_agg import rebuild
+    from ..leaderboard import rebuild as rebuild_leaderboard
+    from ..score_distribution import GRAND_DISTRIBUTION
+    from ..score_distribution import rebuild as rebuild_distribution
+    from ..train import MODEL_SPECS, TRAIN_CORES, train
+    from ..train_data import training_engine
+    from .fixture import install_sqlite, seed
+except ImportError:  # started from inside aiml/
+    import score_api
+    from db import db_config
+    from features import PLATFORMS
+    from history_agg import rebuild
+    from leaderboard import rebuild as rebuild_leaderboard
+    from score_distribution import GRAND_DISTRIBUTION
+    from score_distribution import rebuild as rebuild_distribution
+    from train import MODEL_SPECS, TRAIN_CORES, train
+    from train_data import training_engine
+    from bench.fixture import install_sqlite, seed
+
+# Seeding drops and recreates tables, so MySQL runs need a scratch database
+BENCH_DB_NAME = os.getenv("BENCH_DB_NAME")
+
+AIML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TRAINING_SCRIPTS = [
+    'train_shipway_model.py', 'train_unicommerce_model.py', 'train_convertway_model.py',
+    'churn_rate_model.py', 'churn_rate_unicommerse.py', 'churn_rate_converway.py'
+]
+
+
+def prepare_database(backend, workdir, merchants, months, seed_value):
+    """Seed the benchmark database and return a SQLAlchemy engine for training."""
+    if backend == "sqlite":
+        path = os.path.join(workdir, "bench.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        install_sqlite(path)
+        engine = create_engine(f"sqlite:///{path}")
+    else:
+        if not BENCH_DB_NAME or BENCH_DB_NAME == os.getenv("DB_NAME"):
+            raise SystemExit("Set BENCH_DB_NAME to a scratch database other than DB_NAME")
+        db_config['database'] = BENCH_DB_NAME
+        os.environ['DB_NAME'] = BENCH_DB_NAME
+        engine = training_engine()
+
+    conn = mysql.connector.connect(**db_config)
+    try:
+        seed(conn, merchants, months, seed_value)
+        for platform in PLATFORMS:
+            rebuild(conn, platform)
+            rebuild_leaderboard(conn, platform)
+            rebuild_distribution(conn, platform)
+        rebuild_leaderboard(conn)
+        rebuild_distribution(conn, GRAND_DISTRIBUTION)
+    finally:
+        conn.close()
+    return engine
+
+
+def time_training(engine, cores):
+    report = train(MODEL_SPECS, cores, ".", engine)
+    return {
+        "total_s": report["total_s"],
+        "models": {
+            entry["model"]: {key: entry[key] for key in ("rows", "n_jobs", "load_s", "prepare_s", "fit_s", "save_s")}
+            for entry in report["models"]
+        }
+    }
+
+
+def time_scripts():
+    # The standalone scripts connect through DB_* themselves, so MySQL only
+    timings = {}
+    env = dict(os.environ, PYTHONPATH=AIML_DIR)
+    for script in TRAINING_SCRIPTS:
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, os.path.join(AIML_DIR, script)], env=env,
+                                capture_output=True, text=True)
+        timings[script] = {"seconds": round(time.perf_counter() - start, 3), "ok": result.returncode == 0}
+    return timings
+
+
+def summarize(latencies, errors, elapsed, concurrency):
+    latencies_ms = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99]) if len(latencies_ms) else (0, 0, 0)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "concurrency": concurrency,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(float(p50), 3),
+            "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3),
+            "mean": round(float(latencies_ms.mean()), 3) if len(latencies_ms) else 0.0,
+            "max": round(float(latencies_ms.max()), 3) if len(latencies_ms) else 0.0
+        }
+    }
+
+
+def request_plan(endpoint, merchants, count, seed_value):
+    # Same merchant/platform sequence on every run with the same seed
+    rng = random.Random(seed_value)
+    plan = []
+    for _ in range(count):
+        merchant_id = rng.randint(1, merchants)
+        email = f"merchant{merchant_id}@example.com"
+        if endpoint == "multi-platform":
+            plan.append(("/loyalty-score/multi-platform", {"email": email}))
+        else:
+            platforms = [p for p in PLATFORMS if p != 'unicommerce' or merchant_id % 3]
+            plan.append(("/loyalty-score", {"email": email, "platform": rng.choice(platforms)}))
+    return plan
+
+
+async def drive(client, plan, concurrency):
+    latencies = []
+    errors = 0
+    pending = iter(plan)
+
+    async def worker():
+        nonlocal errors
+        for path, params in pending:
+            start = time.perf_counter()
+            response = await client.get(path, params=params)
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def bench_endpoints(endpoints, merchants, requests, concurrency, warmup, seed_value, url=None):
+    results = {}
+    if url:
+        client = httpx.AsyncClient(base_url=url, timeout=60)
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=score_api.app), base_url="http://bench", timeout=60)
+
+    async with client, score_api.lifespan(score_api.app):
+        for endpoint in endpoints:
+            await drive(client, request_plan(endpoint, merchants, warmup, seed_value + 1), concurrency)
+            latencies, errors, elapsed = await drive(
+                client, request_plan(endpoint, merchants, requests, seed_value), concurrency)
+            results[endpoint] = summarize(latencies, errors, elapsed, concurrency)
+            print(f"✅ {endpoint}: p50 {results[endpoint]['latency_ms']['p50']}ms, "
+                  f"p99 {results[endpoint]['latency_ms']['p99']}ms, {results[endpoint]['throughput_rps']} req/s")
+    return results
+
+
+def run(args):
+    warnings.filterwarnings("ignore")
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+
+    engine = prepare_database(args.backend, ".", args.merchants, args.months, args.seed)
+    report = {
+        "config": {
+            "backend": args.backend,
+            "merchants": args.merchants,
+            "months": args.months,
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "score_cache": args.cache
+        },
+        "environment": {
+            "python": host.python_version(),
+            "machine": host.machine(),
+            "cpu_count": os.cpu_count()
+        }
+    }
+
+    missing = [spec.output for spec in MODEL_SPECS if not os.path.exists(spec.output)]
+    if args.train or missing:
+        report["training"] = time_training(engine, args.cores)
+    if args.scripts:
+        if args.backend != "mysql":
+            raise SystemExit("--scripts needs --backend mysql; the scripts connect with pymysql")
+        report["training_scripts"] = time_scripts()
+    engine.dispose()
+
+    if not args.cache:
+        score_api.score_cache.maxsize = 0
+    report["scoring"] = asyncio.run(bench_endpoints(
+        args.endpoint or ["loyalty-score", "multi-platform"], args.merchants, args.requests,
+        args.concurrency, args.warmup, args.seed, args.url))
+    return report
+
+
+def flatten(report, prefix=""):
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = flatten(json.load(f))
+    with open(new_path) as f:
+        new = flatten(json.load(f))
+    for key in sorted(old.keys() | new.keys()):
+        before, after = old.get(key), new.get(key)
+        if before is None or after is None:
+            print(f"{key}\t{before}\t{after}")
+        elif before != after:
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+            print(f"{key}\t{before}\t{after}\t{change}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency and training benchmarks for the aiml services")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="seed a database, train if needed and load-test the API")
+    run_parser.add_argument("--backend", choices=["sqlite", "mysql"], default="sqlite",
+                            help="sqlite fixture file, or the MySQL database named by BENCH_DB_NAME")
+    run_parser.add_argument("--merchants", type=int, default=1000)
+    run_parser.add_argument("--months", type=int, default=6)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--requests", type=int, default=500, help="measured requests per endpoint")
+    run_parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per endpoint")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--endpoint", choices=["loyalty-score", "multi-platform"], action="append")
+    run_parser.add_argument("--cache", action="store_true", help="keep the score cache on (off by default)")
+    run_parser.add_argument("--train", action="store_true", help="time training even if models exist")
+    run_parser.add_argument("--scripts", action="store_true", help="also time the six standalone training scripts")
+    run_parser.add_argument("--cores", type=int, default=TRAIN_CORES)
+    run_parser.add_argument("--url", help="load-test a running server instead of the in-process app")
+    run_parser.add_argument("--workdir", default="bench_run", help="holds the fixture database and models")
+    run_parser.add_argument("--output", default="bench.json")
+
+    compare_parser = subparsers.add_parser("compare", help="show what changed between two reports")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        compare(args.old, args.new)
+    else:
+        output = os.path.abspath(args.output)
+        report = run(args)
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"✅ Benchmark report written to {output}")
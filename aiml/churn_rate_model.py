@@ -1,12 +1,13 @@
-import pandas as pd
 import joblib
-from datetime import datetime
 from sklearn.ensemble import RandomForestRegressor
 import pymysql
 from dotenv import load_dotenv
 import os
 from urllib.parse import quote_plus
 from sqlalchemy import create_engine  # ✅ UNCOMMENTED
+from features import CHURN_FEATURES, CHURN_LABEL_WEIGHTS, build_frame, churn_label, feature_matrix, label_frame
+from sketch import label_sketches, sketch_path
+from train_data import read_training_frame, report_memory
 
 # Load environment variables
 load_dotenv()
@@ -20,69 +21,29 @@ database = os.getenv("DB_NAME")
 connection_str = f"mysql+pymysql://{user}:{password}@{host}/{database}"
 engine = create_engine(connection_str)
 
-# SQL query
-query = """
-    SELECT
-        m.merchant_id,
-        m.register_shipway,
-        s.order_count,
-        s.billing_amount,
-        s.margin_amount,
-        s.complaint_count,
-        s.returned_orders,
-        s.undelivered_orders,
-        s.services_amount,
-        s.delayed_orders,
-        s.average_resolution_tat
-    FROM merchants m
-    JOIN data_shipway s ON m.merchant_id = s.merchant_id
-"""
-
-# Load data
-df = pd.read_sql(query, engine)
+# Load data; the label columns of each chunk are sketched as it streams in
+sketches = label_sketches(CHURN_LABEL_WEIGHTS['shipway'])
+df = read_training_frame(engine, 'shipway', on_chunk=lambda chunk: sketches.update(
+    label_frame(chunk.copy(), 'shipway', 'churn')))
 
 # Cleanup engine
 engine.dispose()
 
-# Convert registration date to datetime
-df['register_shipway'] = pd.to_datetime(df['register_shipway'], errors='coerce')
-
-# Feature engineering
-df['merchant_age_days'] = (pd.Timestamp.now() - df['register_shipway']).dt.days
-df['return_rate'] = df['undelivered_orders'] / df['order_count'].replace(0, 1)
-df['margin_ratio'] = df['margin_amount'] / df['billing_amount'].replace(0, 1)
+# Feature engineering (shared with the scoring API)
+df = build_frame(df, 'shipway')
 
 # Churn risk score (weighted rank-based heuristic)
-df['churn_risk'] = (
-    0.30 * df['delayed_orders'].rank(pct=True) +
-    0.25 * df['complaint_count'].rank(pct=True) +
-    0.20 * df['average_resolution_tat'].rank(pct=True) +
-    0.15 * df['returned_orders'].rank(pct=True) +
-    0.10 * df['undelivered_orders'].rank(pct=True)
-) * 100
+df['churn_risk'] = churn_label(df, 'shipway', sketches)
 
 # Feature set
-features = [
-    'delayed_orders',
-    'complaint_count',
-    'average_resolution_tat',
-    'returned_orders',
-    'undelivered_orders',
-    'merchant_age_days',
-    'order_count',
-    'return_rate',
-    'margin_ratio',
-    'billing_amount',
-    'margin_amount',
-    'services_amount'
-]
+features = CHURN_FEATURES['shipway']
 
-# Drop rows with missing data in features or label
-df.dropna(subset=features + ['churn_risk'], inplace=True)
+# Skip rows with missing data in features or label
+complete = df[features + ['churn_risk']].notna().all(axis=1)
 
 # Prepare training data
-X = df[features]
-y = df['churn_risk']
+X = feature_matrix(df, features, fill_value=None, rows=complete)
+y = df['churn_risk'][complete]
 
 # Train Random Forest Regressor
 model = RandomForestRegressor(n_estimators=500, random_state=42, n_jobs=-1)
@@ -90,4 +51,8 @@ model.fit(X, y)
 
 # Save model to disk
 joblib.dump(model, "merchant_churn_model.pkl")
+
+# Label percentile sketches, for placing new rows on the same scale
+sketches.save(sketch_path("merchant_churn_model.pkl"))
 print("Churn model trained and saved as merchant_churn_model.pkl")
+report_memory("churn_rate_model")
@@ -1,12 +1,13 @@
-import pandas as pd
 import joblib
-from datetime import datetime
 from sklearn.ensemble import RandomForestRegressor
 import pymysql
 from dotenv import load_dotenv
 import os
 from urllib.parse import quote_plus
 from sqlalchemy import create_engine  # ✅ UNCOMMENTED
+from features import CHURN_FEATURES, CHURN_LABEL_WEIGHTS, build_frame, churn_label, feature_matrix, label_frame
+from sketch import label_sketches, sketch_path
+from train_data import read_training_frame, report_memory
 
 # Load environment variables
 load_dotenv()
@@ -20,60 +21,29 @@ database = os.getenv("DB_NAME")
 connection_str = f"mysql+pymysql://{user}:{password}@{host}/{database}"
 engine = create_engine(connection_str)
 
-# SQL query
-query = """
-    SELECT
-        m.merchant_id,
-        m.register_unicommerce,
-        s.order_count,
-        s.billing_amount,
-        s.margin_amount,
-        s.nps_score,
-        s.complaint_count
-    FROM merchants m
-    JOIN data_unicommerce s ON m.merchant_id = s.merchant_id
-"""
-
-# Load data
-df = pd.read_sql(query, engine)
+# Load data; the label columns of each chunk are sketched as it streams in
+sketches = label_sketches(CHURN_LABEL_WEIGHTS['unicommerce'])
+df = read_training_frame(engine, 'unicommerce', on_chunk=lambda chunk: sketches.update(
+    label_frame(chunk.copy(), 'unicommerce', 'churn')))
 
 # Cleanup engine
 engine.dispose()
 
-# Convert registration date to datetime
-df['register_unicommerce'] = pd.to_datetime(df['register_unicommerce'], errors='coerce')
-
-# Feature engineering
-df['merchant_age_days'] = (pd.Timestamp.now() - df['register_unicommerce']).dt.days
-df['margin_ratio'] = df['margin_amount'] / df['billing_amount'].replace(0, 1)
+# Feature engineering (shared with the scoring API)
+df = build_frame(df, 'unicommerce')
 
 # Churn risk score (weighted rank-based heuristic)
-df['churn_risk'] = (
-    0.30 * df['order_count'].rank(pct=True) +
-    0.25 * df['margin_ratio'].rank(pct=True) +
-    0.20 * df['nps_score'].rank(pct=True) +
-    0.15 * df['merchant_age_days'].rank(pct=True) +
-    0.10 * df['margin_amount'].rank(pct=True)+
-    0.25 * df['complaint_count'].rank(pct=True)
-) * 100
+df['churn_risk'] = churn_label(df, 'unicommerce', sketches)
 
 # Feature set
-features = [
-    'merchant_age_days',
-    'order_count',
-    'margin_ratio',
-    'billing_amount',
-    'margin_amount',
-    'nps_score',
-    'complaint_count'
-]
+features = CHURN_FEATURES['unicommerce']
 
-# Drop rows with missing data in features or label
-df.dropna(subset=features + ['churn_risk'], inplace=True)
+# Skip rows with missing data in features or label
+complete = df[features + ['churn_risk']].notna().all(axis=1)
 
 # Prepare training data
-X = df[features]
-y = df['churn_risk']
+X = feature_matrix(df, features, fill_value=None, rows=complete)
+y = df['churn_risk'][complete]
 
 # Train Random Forest Regressor
 model = RandomForestRegressor(n_estimators=500, random_state=42, n_jobs=-1)
@@ -81,4 +51,8 @@ model.fit(X, y)
 
 # Save model to disk
 joblib.dump(model, "unicommerse_churn_model.pkl")
+
+# Label percentile sketches, for placing new rows on the same scale
+sketches.save(sketch_path("unicommerse_churn_model.pkl"))
 print("Churn model trained and saved as unicommerse_churn_model.pkl")
+report_memory("churn_rate_unicommerse")
@@ -0,0 +1,228 @@
+import argparse
+import copy
+import json
+import os
+import time
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+try:
+    from .features import PLATFORMS
+    from .forest_compile import CompiledForest, compile_model
+    from .registry import MODEL_REGISTRY_DIR, publish
+    from .sketch import sketch_path
+    from .train import _DATASETS, _SKETCHES, MODEL_SPECS, N_ESTIMATORS, TRAIN_CORES, load_datasets
+    from .train_data import training_engine
+except ImportError:  # started from inside aiml/
+    from features import PLATFORMS
+    from forest_compile import CompiledForest, compile_model
+    from registry import MODEL_REGISTRY_DIR, publish
+    from sketch import sketch_path
+    from train import _DATASETS, _SKETCHES, MODEL_SPECS, N_ESTIMATORS, TRAIN_CORES, load_datasets
+    from train_data import training_engine
+
+# Allowed holdout MAE increase over the full 500-tree forest, as a fraction
+COMPACT_ERROR_BUDGET = float(os.getenv("COMPACT_ERROR_BUDGET", 0.02))
+HOLDOUT_FRACTION = 0.2
+
+# Search grid. Tree counts are prefixes of one forest per (depth, leaf size)
+TREE_COUNTS = (10, 25, 50, 100, 200, 500)
+MAX_DEPTHS = (None, 24, 16, 12, 8)
+MIN_SAMPLES_LEAF = (1, 5, 20)
+
+# Latency probe: single-row calls like /loyalty-score, one batch like a rescore page
+SINGLE_ROW_REPEAT = 50
+BATCH_ROWS = 1000
+
+
+def split_holdout(n_rows, fraction=HOLDOUT_FRACTION, seed=0):
+    order = np.random.default_rng(seed).permutation(n_rows)
+    n_holdout = max(1, int(n_rows * fraction))
+    return order[n_holdout:], order[:n_holdout]
+
+
+def first_trees(model, n_trees):
+    # Forest made of the first n_trees estimators; with the same random_state
+    # these are the trees a fit with n_estimators=n_trees would grow
+    if n_trees >= len(model.estimators_):
+        return model
+    prefix = copy.copy(model)
+    prefix.estimators_ = model.estimators_[:n_trees]
+    prefix.n_estimators = n_trees
+    return prefix
+
+
+def errors(y_true, y_pred):
+    diff = y_pred - y_true
+    return {"mae": float(np.mean(np.abs(diff))), "rmse": float(np.sqrt(np.mean(diff ** 2)))}
+
+
+def predict_latency(forest, X):
+    # Compiled forest, as the scoring API loads it
+    rows = X[np.arange(SINGLE_ROW_REPEAT) % len(X)]
+    forest.predict(rows[:1])
+    timings = []
+    for i in range(SINGLE_ROW_REPEAT):
+        start = time.perf_counter()
+        forest.predict(rows[i:i + 1])
+        timings.append(time.perf_counter() - start)
+
+    batch = X[np.arange(BATCH_ROWS) % len(X)]
+    start = time.perf_counter()
+    forest.predict(batch)
+    return {"single_row_ms": round(float(np.median(timings)) * 1000, 3),
+            "batch_ms": round((time.perf_counter() - start) * 1000, 3)}
+
+
+def evaluate(model, X_holdout, y_holdout):
+    forest = CompiledForest.from_sklearn(model)
+    return {
+        "n_trees": forest.meta["n_trees"],
+        "n_nodes": forest.meta["n_nodes"],
+        "max_depth": forest.max_depth,
+        **{k: round(v, 4) for k, v in errors(y_holdout, forest.predict(X_holdout)).items()},
+        **predict_latency(forest, X_holdout)
+    }
+
+
+def fit_forest(X, y, random_state, n_jobs, n_estimators=N_ESTIMATORS, max_depth=None, min_samples_leaf=1):
+    model = RandomForestRegressor(n_estimators=n_estimators, max_depth=max_depth,
+                                  min_samples_leaf=min_samples_leaf, random_state=random_state, n_jobs=n_jobs)
+    return model.fit(X, y)
+
+
+def search(spec, X, y, budget=COMPACT_ERROR_BUDGET, distill=False, n_jobs=TRAIN_CORES,
+           tree_counts=TREE_COUNTS, max_depths=MAX_DEPTHS, min_samples_leaf=MIN_SAMPLES_LEAF):
+    """Grid-search smaller forests against a holdout split.
+
+    The reference is the forest the training scripts fit (N_ESTIMATORS
+    trees, unbounded depth). A candidate qualifies when its holdout MAE is
+    at most ``(1 + budget)`` times the reference's, and the one with the
+    fewest nodes wins. With ``distill`` every grid point is also fitted on
+    the reference's predictions instead of the raw labels.
+    """
+    train_rows, holdout_rows = split_holdout(len(y))
+    X_train, y_train = X[train_rows], y[train_rows]
+    X_holdout, y_holdout = X[holdout_rows], y[holdout_rows]
+
+    reference_model = fit_forest(X_train, y_train, spec.random_state, n_jobs)
+    reference = evaluate(reference_model, X_holdout, y_holdout)
+    max_mae = reference["mae"] * (1 + budget)
+
+    targets = {"labels": y_train}
+    if distill:
+        targets["distilled"] = reference_model.predict(X_train)
+
+    candidates = []
+    for target, y_fit in targets.items():
+        for max_depth in max_depths:
+            for leaf in min_samples_leaf:
+                if target == "labels" and max_depth is None and leaf == 1 and max(tree_counts) == N_ESTIMATORS:
+                    model = reference_model
+                else:
+                    model = fit_forest(X_train, y_fit, spec.random_state, n_jobs, max(tree_counts), max_depth, leaf)
+                for n_trees in sorted(tree_counts):
+                    result = evaluate(first_trees(model, n_trees), X_holdout, y_holdout)
+                    candidates.append({
+                        "target": target,
+                        "params": {"n_estimators": n_trees, "max_depth": max_depth, "min_samples_leaf": leaf},
+                        **result,
+                        "within_budget": result["mae"] <= max_mae
+                    })
+
+    eligible = [c for c in candidates if c["within_budget"]]
+    chosen = min(eligible, key=lambda c: (c["n_nodes"], c["single_row_ms"])) if eligible else None
+    return {
+        "model": spec.output,
+        "rows": {"train": int(len(train_rows)), "holdout": int(len(holdout_rows))},
+        "budget": budget,
+        "max_mae": round(max_mae, 4),
+        "reference": reference,
+        "chosen": chosen,
+        "candidates": candidates
+    }
+
+
+def refit(spec, X, y, chosen, n_jobs):
+    # The chosen settings on every row, teacher included for distilled models
+    if chosen["target"] == "distilled":
+        y = fit_forest(X, y, spec.random_state, n_jobs).predict(X)
+    return fit_forest(X, y, spec.random_state, n_jobs, **chosen["params"])
+
+
+def compact(specs, output_dir=".", budget=COMPACT_ERROR_BUDGET, distill=False, cores=TRAIN_CORES, engine=None,
+            **grid):
+    engine = engine or training_engine()
+    try:
+        load_datasets(engine, specs)
+    finally:
+        engine.dispose()
+
+    reports = []
+    for spec in specs:
+        X, y = _DATASETS.pop(spec.output)
+        sketches = _SKETCHES.pop(spec.output)
+        start = time.perf_counter()
+        report = search(spec, X, y, budget, distill, cores, **grid)
+        chosen = report["chosen"]
+        if chosen is None:
+            print(f"⚠️ {spec.output}: no candidate within {budget:.1%} of the reference MAE, nothing saved")
+        else:
+            model = refit(spec, X, y, chosen, cores)
+            model.set_params(n_jobs=spec.saved_n_jobs)
+            path = os.path.join(output_dir, spec.output)
+            joblib.dump(model, path)
+            compile_model(path, model=model)
+            sketches.save(sketch_path(path))
+            reference = report["reference"]
+            print(f"✅ {spec.output}: {chosen['params']} ({chosen['target']}), "
+                  f"{chosen['n_nodes']} nodes vs {reference['n_nodes']}, "
+                  f"MAE {chosen['mae']} vs {reference['mae']}, "
+                  f"single row {chosen['single_row_ms']}ms vs {reference['single_row_ms']}ms")
+        report["search_s"] = round(time.perf_counter() - start, 3)
+        reports.append(report)
+    return {"budget": budget, "distill": distill, "models": reports}
+
+
+def _grid_values(text, cast):
+    return tuple(None if value.strip().lower() == "none" else cast(value) for value in text.split(","))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shrink the trained forests within a holdout error budget")
+    parser.add_argument("--platform", choices=PLATFORMS, action="append",
+                        help="platform to compact (repeatable, defaults to all)")
+    parser.add_argument("--kind", choices=['loyalty', 'churn'], action="append",
+                        help="model kind to compact (repeatable, defaults to both)")
+    parser.add_argument("--budget", type=float, default=COMPACT_ERROR_BUDGET,
+                        help="allowed relative holdout MAE increase, e.g. 0.02 for 2%%")
+    parser.add_argument("--distill", action="store_true", help="also fit candidates on the full forest's predictions")
+    parser.add_argument("--trees", default=",".join(map(str, TREE_COUNTS)))
+    parser.add_argument("--depths", default=",".join(str(d) for d in MAX_DEPTHS), help="'none' for unbounded")
+    parser.add_argument("--leaves", default=",".join(map(str, MIN_SAMPLES_LEAF)))
+    parser.add_argument("--cores", type=int, default=TRAIN_CORES)
+    parser.add_argument("--output-dir", default=".", help="directory for the compacted pickles")
+    parser.add_argument("--report", default="compact_report.json")
+    parser.add_argument("--publish", action="store_true",
+                        help="publish each platform with both models compacted as a new registry version")
+    parser.add_argument("--registry", default=MODEL_REGISTRY_DIR)
+    args = parser.parse_args()
+
+    specs = [spec for spec in MODEL_SPECS
+             if spec.platform in (args.platform or PLATFORMS) and spec.kind in (args.kind or ['loyalty', 'churn'])]
+    report = compact(specs, args.output_dir, args.budget, args.distill, args.cores,
+                     tree_counts=_grid_values(args.trees, int), max_depths=_grid_values(args.depths, int),
+                     min_samples_leaf=_grid_values(args.leaves, int))
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Compaction report written to {args.report}")
+
+    if args.publish:
+        saved = {model["model"] for model in report["models"] if model["chosen"] is not None}
+        for platform in PLATFORMS:
+            outputs = {spec.kind: spec.output for spec in specs if spec.platform == platform and spec.output in saved}
+            if len(outputs) == 2:
+                manifest = publish(args.registry, platform, os.path.join(args.output_dir, outputs['loyalty']),
+                                   os.path.join(args.output_dir, outputs['churn']))
+                print(f"✅ Published {platform} models as {manifest['version']}")
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+from mysql.connector import pooling
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# DB config
+db_config = {
+    'host': os.getenv("DB_HOST"),
+    'user': os.getenv("DB_USER"),
+    'password': os.getenv("DB_PASSWORD"),
+    'database': os.getenv("DB_NAME"),
+    'ssl_disabled': True
+}
+
+# Pool settings (mysql.connector caps a pool at 32 connections)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 10))
+
+
+def table_exists(conn, table):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT 1 FROM {table} LIMIT 1")
+        cursor.fetchall()
+        return True
+    except Exception:  # whatever the driver raises for a missing table
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+
+
+def lock_merchants(conn, merchant_ids):
+    """Lock the merchants rows of ``merchant_ids`` until the caller commits.
+
+    Writers of a merchant's derived rows (scores, history, aggregates) take
+    this first, in merchant_id order. The merchants row always exists, so
+    unlike locking the derived rows, which may not be there yet, it takes
+    no gap locks for concurrent inserts to deadlock on.
+    """
+    if not merchant_ids:
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT merchant_id
+            FROM merchants
+            WHERE merchant_id IN ({", ".join(["%s"] * len(merchant_ids))})
+            ORDER BY merchant_id
+            FOR UPDATE
+        """, tuple(merchant_ids))
+        cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class DatabasePool:
+    """Bounded MySQL connection pool shared by the async request handlers.
+
+    Callers wait on a semaphore for a free slot (up to ``timeout`` seconds)
+    instead of failing straight away when every connection is checked out.
+    Connections are pinged on checkout and reconnected if the server dropped
+    them while they sat idle in the pool.
+    """
+
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, name="score_api"):
+        self.size = size
+        self.timeout = timeout
+        self.name = name
+        self._pool = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.in_use = 0
+
+    def open(self):
+        # Requests that arrive before start-up opened the pool open it from
+        # several threadpool threads at once; only the first creates it
+        if self._pool is not None:
+            return
+        with self._lock:
+            if self._pool is None:
+                pool = pooling.MySQLConnectionPool(
+                    pool_name=self.name,
+                    pool_size=self.size,
+                    pool_reset_session=True,
+                    connection_timeout=DB_CONNECT_TIMEOUT,
+                    **db_config
+                )
+                # Slots first: connection() takes an open pool to have them
+                self._slots = asyncio.Semaphore(self.size)
+                self._pool = pool
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                # No public API for draining a mysql.connector pool
+                self._pool._remove_connections()
+                self._pool = None
+                self._slots = None
+
+    def _checkout(self):
+        conn = self._pool.get_connection()
+        try:
+            conn.ping(reconnect=True, attempts=2, delay=0)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    @asynccontextmanager
+    async def connection(self):
+        if self._pool is None:
+            await run_in_threadpool(self.open)
+
+        # close() may drop the semaphore while this connection is still out
+        slots = self._slots
+        try:
+            await asyncio.wait_for(slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(f"No database connection available within {self.timeout}s")
+
+        try:
+            conn = await run_in_threadpool(self._checkout)
+            self.in_use += 1
+            try:
+                yield conn
+            finally:
+                self.in_use -= 1
+                await run_in_threadpool(conn.close)
+        finally:
+            slots.release()
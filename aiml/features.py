@@ -0,0 +1,275 @@
+import threading
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+
+PLATFORMS = ['shipway', 'unicommerce', 'convertway']
+
+# Registration date column on merchants used for merchant_age_days
+REGISTER_COLUMNS = {
+    'shipway': 'register_shipway',
+    'unicommerce': 'register_unicommerce',
+    'convertway': 'register_convertway'
+}
+
+# History aggregates joined from merchants_history_features
+HISTORY_FEATURES = ['avg_loyalty_score', 'avg_churn_rate', 'loyalty_score_delta', 'history_months']
+
+# Computed by add_derived_features
+DERIVED_FEATURES = ['merchant_age_days', 'return_rate', 'margin_ratio']
+
+# Model inputs, in the column order each model was trained on
+LOYALTY_FEATURES = {
+    'shipway': [
+        'order_count', 'billing_amount', 'margin_amount', 'complaint_count',
+        'returned_orders', 'undelivered_orders', 'services_amount',
+        'delayed_orders', 'average_resolution_tat', 'merchant_age_days',
+        'return_rate', 'margin_ratio', 'avg_loyalty_score', 'avg_churn_rate',
+        'loyalty_score_delta', 'history_months', 'wallet_share'
+    ],
+    'unicommerce': [
+        'order_count', 'billing_amount', 'margin_amount',
+        'services_amount', 'nps_score', 'complaint_count',
+        'merchant_age_days', 'margin_ratio'
+    ],
+    'convertway': [
+        'order_count', 'billing_amount', 'margin_amount',
+        'nps_score', 'merchant_age_days', 'margin_ratio'
+    ]
+}
+CHURN_FEATURES = {
+    'shipway': [
+        'delayed_orders', 'complaint_count', 'average_resolution_tat',
+        'returned_orders', 'undelivered_orders', 'merchant_age_days',
+        'order_count', 'return_rate', 'margin_ratio', 'billing_amount',
+        'margin_amount', 'services_amount'
+    ],
+    'unicommerce': [
+        'merchant_age_days', 'order_count', 'margin_ratio', 'billing_amount',
+        'margin_amount', 'nps_score', 'complaint_count'
+    ],
+    'convertway': [
+        'merchant_age_days', 'order_count', 'margin_ratio', 'billing_amount',
+        'margin_amount', 'nps_score'
+    ]
+}
+
+# Rank-weighted pseudo-label heuristics
+LOYALTY_LABEL_WEIGHTS = {
+    'shipway': [
+        ('order_count', 0.25), ('margin_amount', 0.20), ('wallet_share', 0.15),
+        ('merchant_age_days', 0.15), ('margin_ratio', 0.05), ('services_amount', 0.05),
+        ('avg_loyalty_score', 0.05), ('undelivered_orders', -0.05),
+        ('complaint_count', -0.03), ('avg_churn_rate', -0.02)
+    ],
+    'unicommerce': [
+        ('order_count', 0.25), ('margin_amount', 0.20), ('margin_ratio', 0.15),
+        ('services_amount', 0.10), ('merchant_age_days', 0.10), ('nps_score', 0.10),
+        ('complaint_count', -0.10)
+    ],
+    'convertway': [
+        ('order_count', 0.30), ('margin_amount', 0.20), ('margin_ratio', 0.15),
+        ('merchant_age_days', 0.15), ('nps_score', 0.20)
+    ]
+}
+CHURN_LABEL_WEIGHTS = {
+    'shipway': [
+        ('delayed_orders', 0.30), ('complaint_count', 0.25), ('average_resolution_tat', 0.20),
+        ('returned_orders', 0.15), ('undelivered_orders', 0.10)
+    ],
+    'unicommerce': [
+        ('order_count', 0.30), ('margin_ratio', 0.25), ('nps_score', 0.20),
+        ('merchant_age_days', 0.15), ('margin_amount', 0.10), ('complaint_count', 0.25)
+    ],
+    'convertway': [
+        ('order_count', 0.30), ('margin_ratio', 0.25), ('nps_score', 0.20),
+        ('merchant_age_days', 0.15), ('margin_amount', 0.10)
+    ]
+}
+
+LABEL_WEIGHTS = {'loyalty': LOYALTY_LABEL_WEIGHTS, 'churn': CHURN_LABEL_WEIGHTS}
+
+
+def raw_columns(platform):
+    # data_{platform} columns needed by the platform's loyalty and churn models
+    columns = []
+    for feature in LOYALTY_FEATURES[platform] + CHURN_FEATURES[platform]:
+        if feature not in DERIVED_FEATURES + HISTORY_FEATURES and feature not in columns:
+            columns.append(feature)
+    return columns
+
+
+def partition_filter(till_dates=None):
+    # Restricts a data_{platform} s query to the given monthly partitions
+    if not till_dates:
+        return ""
+    dates = ", ".join(f"'{pd.Timestamp(d).date().isoformat()}'" for d in till_dates)
+    return f"WHERE s.till_date IN ({dates})"
+
+
+def training_query(platform, till_dates=None):
+    columns = ",\n            ".join(f"s.{col}" for col in raw_columns(platform))
+    return f"""
+        SELECT
+            m.merchant_id,
+            m.{REGISTER_COLUMNS[platform]},
+            {columns}
+        FROM merchants m
+        JOIN data_{platform} s ON m.merchant_id = s.merchant_id
+        {partition_filter(till_dates)}
+    """
+
+
+def add_derived_features(df, platform, now=None):
+    now = pd.Timestamp.now() if now is None else now
+    registered = pd.to_datetime(df[REGISTER_COLUMNS[platform]], errors='coerce')
+    df['merchant_age_days'] = (now - registered).dt.days
+
+    order_count = df['order_count'].replace(0, 1)
+    if 'undelivered_orders' in df:
+        df['return_rate'] = df['undelivered_orders'] / order_count
+    df['margin_ratio'] = df['margin_amount'] / df['billing_amount'].replace(0, 1)
+    return df
+
+
+def merge_history(df, df_hist):
+    # One aggregate row per merchant, so a lookup per column is a left join
+    # that adds columns in place instead of copying the whole frame
+    if df_hist is None:
+        return df
+    df_hist = df_hist.set_index('merchant_id')
+    for col in HISTORY_FEATURES:
+        if col in df_hist:
+            df[col] = df['merchant_id'].map(df_hist[col])
+    return df
+
+
+def build_frame(df, platform, df_hist=None, now=None):
+    """Join history aggregates and add derived features.
+
+    The same function prepares the full training table and the handful of
+    latest rows scored per request, so both see identical feature values.
+    """
+    return add_derived_features(merge_history(df, df_hist), platform, now)
+
+
+def feature_matrix(df, features, fill_value=0.0, rows=None):
+    """Copy ``features`` into one preallocated float32 array.
+
+    float32 is what the forests evaluate on, so fit()/predict() need no
+    further copy. ``rows`` is an optional boolean mask applied while
+    copying, which avoids materialising a filtered frame first.
+    """
+    if rows is not None:
+        rows = np.asarray(rows, dtype=bool)
+    n_rows = len(df) if rows is None else int(np.count_nonzero(rows))
+    X = np.empty((n_rows, len(features)), dtype=np.float32)
+    for j, col in enumerate(features):
+        values = df[col].to_numpy(dtype=np.float32, na_value=np.nan)
+        X[:, j] = values if rows is None else values[rows]
+    if fill_value is not None:
+        X[np.isnan(X)] = fill_value
+    return X
+
+
+def _as_datetime(value):
+    # pd.to_datetime(errors='coerce') for a single DATE/DATETIME value
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _as_float(value):
+    return np.nan if value is None else float(value)
+
+
+def derive_row(row, platform, now=None):
+    """``add_derived_features`` for one merchant held as a dict.
+
+    ``row`` maps the platform's raw and history columns to driver values
+    (None, Decimal, date); the result maps every model input to a float,
+    NaN where pandas would have left NaN.
+    """
+    now = datetime.now() if now is None else now
+    values = {col: _as_float(value) for col, value in row.items() if col != REGISTER_COLUMNS[platform]}
+    registered = _as_datetime(row.get(REGISTER_COLUMNS[platform]))
+    values['merchant_age_days'] = float((now - registered).days) if registered is not None else np.nan
+
+    order_count = values['order_count']
+    order_count = 1.0 if order_count == 0 else order_count
+    if 'undelivered_orders' in values:
+        values['return_rate'] = values['undelivered_orders'] / order_count
+    billing_amount = values['billing_amount']
+    values['margin_ratio'] = values['margin_amount'] / (1.0 if billing_amount == 0 else billing_amount)
+    return values
+
+
+# Per-thread (1, n_features) buffers reused by row_matrix
+_row_buffers = threading.local()
+
+
+def row_matrix(values, features, fill_value=0.0):
+    """``feature_matrix`` for a single row, written into a reused buffer.
+
+    The buffer belongs to the calling thread and is shared by every
+    feature list of the same width, so it is only valid until the next
+    call on this thread; predict() right away.
+    """
+    buffers = getattr(_row_buffers, "by_width", None)
+    if buffers is None:
+        buffers = _row_buffers.by_width = {}
+    X = buffers.get(len(features))
+    if X is None:
+        X = buffers[len(features)] = np.empty((1, len(features)), dtype=np.float32)
+    row = X[0]
+    for j, col in enumerate(features):
+        value = values.get(col, np.nan)
+        row[j] = fill_value if value != value and fill_value is not None else value
+    return X
+
+
+def rank_label(df, weights, sketches=None):
+    # With quantile sketches the percentile ranks come from the sketch
+    # instead of sorting the whole column
+    if sketches is None:
+        label = sum(weight * df[col].rank(pct=True) for col, weight in weights)
+    else:
+        label = sum(weight * pd.Series(sketches[col].cdf(df[col].to_numpy(dtype=np.float64, na_value=np.nan)),
+                                       index=df.index)
+                    for col, weight in weights)
+    return label * 100
+
+
+def loyalty_label(df, platform, sketches=None):
+    return rank_label(df, LOYALTY_LABEL_WEIGHTS[platform], sketches)
+
+
+def churn_label(df, platform, sketches=None):
+    return rank_label(df, CHURN_LABEL_WEIGHTS[platform], sketches)
+
+
+def label_frame(df, platform, kind, df_hist=None):
+    """Training rows prepared for a loyalty or churn label.
+
+    Missing-value handling follows each platform's original script.
+    build_frame only adds columns, so the raw frame can be shared between
+    the two kinds unless it is filled first. Used on the full frame and on
+    each streamed chunk the label sketches are built from.
+    """
+    if kind == 'churn':
+        return build_frame(df, platform)
+    if platform == 'convertway':
+        # Not the registration date: a 0 there would be a 1970 date. Left
+        # missing, the age is filled with 0 below, as derive_row's NaN is
+        df = df.fillna({col: 0 for col in df.columns if col != REGISTER_COLUMNS[platform]})
+    df = build_frame(df, platform, df_hist)
+    if platform == 'convertway':
+        df['merchant_age_days'] = df['merchant_age_days'].fillna(0)
+    return df
@@ -0,0 +1,318 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+import numpy as np
+
+# Files making up a compiled forest directory
+ARRAYS = ['feature', 'threshold', 'left', 'right', 'missing_left', 'value', 'roots']
+
+
+def compiled_path(model_path):
+    return os.path.splitext(model_path)[0] + ".forest"
+
+
+def _source_stamp(model_path):
+    stat = os.stat(model_path)
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+class CompiledForest:
+    """Array-backed evaluator for a fitted single-output RandomForestRegressor.
+
+    All trees share flat node arrays; child indices are global and leaves
+    point at themselves, so every row/tree pair can step down one level per
+    iteration with plain fancy indexing until every pair has hit a leaf.
+    Inputs are cast to float32 and tree outputs are summed in estimator
+    order, matching what sklearn does for ``n_jobs=None``.
+    """
+
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots, meta, is_leaf=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.meta = meta
+        self.is_leaf = left == np.arange(len(left)) if is_leaf is None else is_leaf
+        self.max_depth = meta["max_depth"]
+        self.n_features_in_ = meta["n_features"]
+        self.feature_names_in_ = meta.get("feature_names")
+
+    @classmethod
+    def from_sklearn(cls, model, source=None):
+        offsets = []
+        parts = {name: [] for name in ARRAYS if name != 'roots'}
+        offset = 0
+        max_depth = 0
+
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            if tree.n_outputs != 1:
+                raise ValueError("Only single-output forests can be compiled")
+
+            nodes = np.arange(tree.node_count, dtype=np.int32) + offset
+            is_leaf = tree.children_left == -1
+            parts['feature'].append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            parts['threshold'].append(tree.threshold.astype(np.float64))
+            parts['left'].append(np.where(is_leaf, nodes, tree.children_left + offset).astype(np.int32))
+            parts['right'].append(np.where(is_leaf, nodes, tree.children_right + offset).astype(np.int32))
+            missing = getattr(tree, 'missing_go_to_left', None)
+            if missing is None:
+                missing = np.zeros(tree.node_count, dtype=np.uint8)
+            parts['missing_left'].append(np.asarray(missing, dtype=bool))
+            parts['value'].append(tree.value[:, 0, 0].astype(np.float64))
+
+            offsets.append(offset)
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        arrays = {name: np.concatenate(chunks) for name, chunks in parts.items()}
+        arrays['roots'] = np.asarray(offsets, dtype=np.int32)
+
+        feature_names = getattr(model, 'feature_names_in_', None)
+        meta = {
+            "n_trees": len(model.estimators_),
+            "n_nodes": int(offset),
+            "max_depth": int(max_depth),
+            "n_features": int(model.n_features_in_),
+            "feature_names": list(feature_names) if feature_names is not None else None,
+            "source": source
+        }
+        return cls(meta=meta, **arrays)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        np.save(os.path.join(path, "is_leaf.npy"), np.asarray(self.is_leaf))
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        # With mmap_mode='r' the node arrays are read-only views of the page
+        # cache, shared by every process that maps the same files
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAYS}
+        # Forests compiled before is_leaf was stored derive it on load
+        is_leaf_path = os.path.join(path, "is_leaf.npy")
+        if os.path.exists(is_leaf_path):
+            arrays['is_leaf'] = np.load(is_leaf_path, mmap_mode=mmap_mode)
+        return cls(meta=meta, **arrays)
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got {X.shape[1]}")
+
+        n_rows, n_trees = X.shape[0], len(self.roots)
+        flat_X = X.ravel()
+        nodes = np.tile(self.roots, n_rows)
+        row_base = np.repeat(np.arange(n_rows) * X.shape[1], n_trees)
+
+        # Step every unfinished (row, tree) pair one level down, dropping the
+        # pairs that reached a leaf so deep trees don't drag the rest along
+        has_nan = bool(np.isnan(flat_X).any())
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        while active.size:
+            current = nodes[active]
+            x = flat_X[row_base[active] + self.feature[current]]
+            go_left = x <= self.threshold[current]
+            if has_nan:
+                go_left = np.where(np.isnan(x), self.missing_left[current], go_left)
+            current = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = current
+            active = active[~self.is_leaf[current]]
+
+        leaf_values = self.value[nodes].reshape(n_rows, n_trees)
+        y = np.zeros(n_rows, dtype=np.float64)
+        for t in range(n_trees):
+            y += leaf_values[:, t]
+        y /= n_trees
+        return y
+
+
+def compile_model(model_path, out_path=None, model=None):
+    # ``model`` skips reloading a forest that was just saved to model_path
+    model = joblib.load(model_path) if model is None else model
+    forest = CompiledForest.from_sklearn(model, source=_source_stamp(model_path))
+    forest.save(out_path or compiled_path(model_path))
+    return model, forest
+
+
+def load_model(model_path, mmap_mode='r'):
+    # Prefer an up-to-date compiled forest next to the pickle
+    path = compiled_path(model_path)
+    if os.path.isdir(path):
+        forest = CompiledForest.load(path, mmap_mode=mmap_mode)
+        if forest.meta.get("source") == _source_stamp(model_path):
+            return forest
+        print(f"⚠️ {path} is stale for {model_path}, falling back to the pickle")
+    return joblib.load(model_path)
+
+
+def _sample_rows(forest, n_rows, seed=0):
+    # Draw feature values around the split thresholds so rows reach deep leaves
+    rng = np.random.default_rng(seed)
+    X = np.zeros((n_rows, forest.n_features_in_), dtype=np.float32)
+    internal = ~forest.is_leaf
+    for f in range(forest.n_features_in_):
+        thresholds = forest.threshold[internal & (forest.feature == f) & np.isfinite(forest.threshold)]
+        if len(thresholds):
+            X[:, f] = rng.choice(thresholds, n_rows) + rng.normal(0, 1, n_rows)
+    return X
+
+
+def _time_call(fn, X, repeat):
+    fn(X)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark(model_path, batch_sizes=(1, 100, 1000), repeat=20):
+    model, forest = compile_model(model_path)
+    # Threaded prediction sums trees in completion order; compare against the
+    # sequential tree order the compiled predictor reproduces
+    model.set_params(n_jobs=None)
+    report = {"model": model_path, "n_trees": forest.meta["n_trees"],
+              "max_depth": forest.max_depth, "results": []}
+
+    for n_rows in batch_sizes:
+        X = _sample_rows(forest, n_rows)
+        expected = model.predict(X)
+        actual = forest.predict(X)
+        sklearn_s = _time_call(model.predict, X, repeat)
+        compiled_s = _time_call(forest.predict, X, repeat)
+        report["results"].append({
+            "rows": n_rows,
+            "identical": bool(np.array_equal(expected, actual)),
+            "max_abs_diff": float(np.max(np.abs(expected - actual))),
+            "sklearn_ms": round(sklearn_s * 1000, 3),
+            "compiled_ms": round(compiled_s * 1000, 3),
+            "speedup": round(sklearn_s / compiled_s, 2)
+        })
+    return report
+
+
+def _memory_mb():
+    # Rss counts shared pages in full; Pss splits them between the processes mapping them
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    except OSError:
+        return {}
+    return {
+        "rss_mb": round(fields.get("Rss", 0), 1),
+        "pss_mb": round(fields.get("Pss", 0), 1),
+        "private_mb": round(fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0), 1)
+    }
+
+
+_barrier = None
+
+
+def _init_load_worker(barrier):
+    global _barrier
+    _barrier = barrier
+
+
+def _load_worker(model_paths, mode):
+    warnings.filterwarnings("ignore")
+    # Import sklearn up front in both modes so only model loading is timed
+    import sklearn.ensemble  # noqa: F401
+    baseline = _memory_mb()
+    start = time.perf_counter()
+    if mode == "pickle":
+        models = [joblib.load(path) for path in model_paths]
+    else:
+        models = [CompiledForest.load(compiled_path(path), mmap_mode='r') for path in model_paths]
+    load_s = time.perf_counter() - start
+
+    # First prediction, as the first request would make it
+    start = time.perf_counter()
+    for model in models:
+        model.predict(np.zeros((1, model.n_features_in_), dtype=np.float32))
+    first_predict_s = time.perf_counter() - start
+
+    # Measure once every worker holds its models
+    _barrier.wait()
+    memory = _memory_mb()
+    _barrier.wait()
+    return {
+        "pid": os.getpid(),
+        "load_s": round(load_s, 3),
+        "first_predict_s": round(first_predict_s, 3),
+        "baseline_rss_mb": baseline.get("rss_mb"),
+        **memory
+    }
+
+
+def load_benchmark(model_paths, workers=4):
+    """Cold-start time and per-worker memory for pickles vs mmapped forests.
+
+    Each mode starts ``workers`` fresh processes that load every model
+    at the same time, like uvicorn workers booting together.
+    """
+    for path in model_paths:
+        compile_model(path)
+
+    report = {"models": model_paths, "workers": workers, "modes": {}}
+    ctx = multiprocessing.get_context("spawn")
+    for mode in ("pickle", "mmap"):
+        barrier = ctx.Barrier(workers)
+        with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_load_worker,
+                                 initargs=(barrier,)) as pool:
+            results = list(pool.map(_load_worker, [model_paths] * workers, [mode] * workers))
+        report["modes"][mode] = {
+            "max_load_s": max(r["load_s"] for r in results),
+            "total_pss_mb": round(sum(r.get("pss_mb", 0) for r in results), 1),
+            "workers": results
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile RandomForest pickles into array-backed predictors")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = subparsers.add_parser("compile", help="write <model>.forest next to each pickle")
+    compile_parser.add_argument("models", nargs="+")
+
+    bench_parser = subparsers.add_parser("bench", help="compare sklearn and compiled prediction")
+    bench_parser.add_argument("models", nargs="+")
+    bench_parser.add_argument("--rows", default="1,100,1000", help="comma separated batch sizes")
+    bench_parser.add_argument("--repeat", type=int, default=20)
+
+    load_parser = subparsers.add_parser("load-bench", help="compare worker cold start and memory, pickle vs mmap")
+    load_parser.add_argument("models", nargs="+")
+    load_parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == "load-bench":
+        print(json.dumps(load_benchmark(args.models, args.workers), indent=2))
+        raise SystemExit
+
+    for model_path in args.models:
+        if args.command == "compile":
+            _, forest = compile_model(model_path)
+            print(f"✅ Compiled {model_path} -> {compiled_path(model_path)} "
+                  f"({forest.meta['n_trees']} trees, {forest.meta['n_nodes']} nodes)")
+        else:
+            sizes = [int(n) for n in args.rows.split(",")]
+            print(json.dumps(benchmark(model_path, sizes, args.repeat), indent=2))
@@ -0,0 +1,235 @@
+import argparse
+import mysql.connector
+import pandas as pd
+
+try:
+    from .db import db_config, lock_merchants, table_exists
+except ImportError:  # started from inside aiml/
+    from db import db_config, lock_merchants, table_exists
+
+PLATFORMS = ['shipway', 'unicommerce', 'convertway']
+
+# Running per-merchant, per-platform aggregates over merchants_scores_history.
+# Kept in step with every history upsert so scoring reads one row instead of
+# grouping the whole history table.
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS merchants_history_features (
+        merchant_id INT NOT NULL,
+        platform VARCHAR(32) NOT NULL,
+        loyalty_sum DOUBLE NOT NULL DEFAULT 0,
+        loyalty_count INT NOT NULL DEFAULT 0,
+        churn_sum DOUBLE NOT NULL DEFAULT 0,
+        churn_count INT NOT NULL DEFAULT 0,
+        loyalty_max DOUBLE NULL,
+        loyalty_min DOUBLE NULL,
+        updated_on DATETIME NULL,
+        PRIMARY KEY (merchant_id, platform)
+    )
+"""
+
+
+def history_upsert_query(platform):
+    loyalty_col = f"loyalty_score_{platform}"
+    churn_col = f"churn_rate_{platform}"
+    return f"""
+        INSERT INTO merchants_scores_history (
+            merchant_id, from_date, till_date, {loyalty_col}, {churn_col}, added_on
+        ) VALUES (%s, %s, %s, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE
+            till_date = VALUES(till_date),
+            {loyalty_col} = VALUES({loyalty_col}),
+            {churn_col} = VALUES({churn_col}),
+            updated_on = NOW()
+    """
+
+
+def read_history_features(conn, platforms, merchant_ids):
+    platform_placeholders = ", ".join(["%s"] * len(platforms))
+    placeholders = ", ".join(["%s"] * len(merchant_ids))
+    return pd.read_sql(f"""
+        SELECT
+            platform,
+            merchant_id,
+            loyalty_sum / NULLIF(loyalty_count, 0) AS avg_loyalty_score,
+            churn_sum / NULLIF(churn_count, 0) AS avg_churn_rate,
+            loyalty_max - loyalty_min AS loyalty_score_delta,
+            loyalty_count AS history_months
+        FROM merchants_history_features
+        WHERE platform IN ({platform_placeholders}) AND merchant_id IN ({placeholders})
+    """, conn, params=(*platforms, *merchant_ids))
+
+
+def read_history_row(conn, platform, merchant_id):
+    # One merchant's aggregates for the single-row scoring path, {} before its first history row
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT
+                loyalty_sum / NULLIF(loyalty_count, 0) AS avg_loyalty_score,
+                churn_sum / NULLIF(churn_count, 0) AS avg_churn_rate,
+                loyalty_max - loyalty_min AS loyalty_score_delta,
+                loyalty_count AS history_months
+            FROM merchants_history_features
+            WHERE platform = %s AND merchant_id = %s
+        """, (platform, merchant_id))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return row or {}
+
+
+def read_platform_history_features(engine, platform):
+    # Every merchant's aggregates for one platform, used to build training data.
+    # Takes a SQLAlchemy engine; imported here so serving doesn't need it.
+    from sqlalchemy import text
+    return pd.read_sql(text("""
+        SELECT
+            merchant_id,
+            loyalty_sum / NULLIF(loyalty_count, 0) AS avg_loyalty_score,
+            churn_sum / NULLIF(churn_count, 0) AS avg_churn_rate,
+            loyalty_max - loyalty_min AS loyalty_score_delta,
+            loyalty_count AS history_months
+        FROM merchants_history_features
+        WHERE platform = :platform
+    """), engine, params={"platform": platform})
+
+
+def record_history_scores(conn, platform, rows):
+    """Upsert history rows and fold the change into the aggregate store.
+
+    ``rows`` holds ``(merchant_id, from_date, till_date, score, churn_rate)``
+    tuples. Re-scoring a month that already has a value replaces it, so the
+    previous value is read first and only the difference is applied to the
+    running sums. Max/min cannot be walked back, so they are recomputed from
+    the (merchant_id-prefixed) history rows of merchants whose value changed.
+    The caller owns the transaction.
+    """
+    if not rows:
+        return
+
+    loyalty_col = f"loyalty_score_{platform}"
+    churn_col = f"churn_rate_{platform}"
+    cursor = conn.cursor()
+    try:
+        # Writers of a merchant's history queue on its merchants row, which
+        # always exists. Missing history rows are then created empty, so the
+        # locking read below only matches existing keys: it takes no gap locks
+        # for concurrent first writes of a month to deadlock on, and still
+        # reads the latest committed values rather than an older snapshot.
+        lock_merchants(conn, [row[0] for row in rows])
+        cursor.executemany("""
+            INSERT IGNORE INTO merchants_scores_history (merchant_id, from_date, till_date, added_on)
+            VALUES (%s, %s, %s, NOW())
+        """, [row[:3] for row in rows])
+        pairs = ", ".join(["(%s, %s)"] * len(rows))
+        cursor.execute(f"""
+            SELECT merchant_id, from_date, {loyalty_col}, {churn_col}
+            FROM merchants_scores_history
+            WHERE (merchant_id, from_date) IN ({pairs})
+            FOR UPDATE
+        """, tuple(v for row in rows for v in row[:2]))
+        previous = {}
+        for merchant_id, from_date, loyalty, churn in cursor.fetchall():
+            # DECIMAL columns come back as Decimal, which doesn't mix with the float scores
+            previous[(merchant_id, from_date)] = (None if loyalty is None else float(loyalty),
+                                                  None if churn is None else float(churn))
+
+        cursor.executemany(history_upsert_query(platform), rows)
+
+        deltas = []
+        changed = []
+        for merchant_id, from_date, till_date, score, churn_rate in rows:
+            old_score, old_churn = previous.get((merchant_id, from_date), (None, None))
+            deltas.append((
+                merchant_id, platform,
+                score - (old_score or 0), 0 if old_score is not None else 1,
+                churn_rate - (old_churn or 0), 0 if old_churn is not None else 1,
+                score, score
+            ))
+            if old_score is not None and old_score != score:
+                changed.append(merchant_id)
+
+        cursor.executemany("""
+            INSERT INTO merchants_history_features (
+                merchant_id, platform, loyalty_sum, loyalty_count,
+                churn_sum, churn_count, loyalty_max, loyalty_min, updated_on
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE
+                loyalty_sum = loyalty_sum + VALUES(loyalty_sum),
+                loyalty_count = loyalty_count + VALUES(loyalty_count),
+                churn_sum = churn_sum + VALUES(churn_sum),
+                churn_count = churn_count + VALUES(churn_count),
+                loyalty_max = GREATEST(COALESCE(loyalty_max, VALUES(loyalty_max)), VALUES(loyalty_max)),
+                loyalty_min = LEAST(COALESCE(loyalty_min, VALUES(loyalty_min)), VALUES(loyalty_min)),
+                updated_on = NOW()
+        """, deltas)
+
+        if changed:
+            placeholders = ", ".join(["%s"] * len(changed))
+            cursor.execute(f"""
+                UPDATE merchants_history_features f
+                JOIN (
+                    SELECT merchant_id, MAX({loyalty_col}) AS loyalty_max, MIN({loyalty_col}) AS loyalty_min
+                    FROM merchants_scores_history
+                    WHERE merchant_id IN ({placeholders})
+                    GROUP BY merchant_id
+                ) h ON h.merchant_id = f.merchant_id
+                SET f.loyalty_max = h.loyalty_max, f.loyalty_min = h.loyalty_min
+                WHERE f.platform = %s
+            """, (*changed, platform))
+    finally:
+        cursor.close()
+
+
+def rebuild(conn, platform):
+    loyalty_col = f"loyalty_score_{platform}"
+    churn_col = f"churn_rate_{platform}"
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CREATE_TABLE_QUERY)
+        cursor.execute("DELETE FROM merchants_history_features WHERE platform = %s", (platform,))
+        cursor.execute(f"""
+            INSERT INTO merchants_history_features (
+                merchant_id, platform, loyalty_sum, loyalty_count,
+                churn_sum, churn_count, loyalty_max, loyalty_min, updated_on
+            )
+            SELECT
+                merchant_id, %s,
+                COALESCE(SUM({loyalty_col}), 0), COUNT({loyalty_col}),
+                COALESCE(SUM({churn_col}), 0), COUNT({churn_col}),
+                MAX({loyalty_col}), MIN({loyalty_col}), NOW()
+            FROM merchants_scores_history
+            GROUP BY merchant_id
+            HAVING COUNT({loyalty_col}) > 0 OR COUNT({churn_col}) > 0
+        """, (platform,))
+        rebuilt = cursor.rowcount
+        conn.commit()
+        return rebuilt
+    finally:
+        cursor.close()
+
+
+def ensure_table(conn):
+    # Creates and backfills merchants_history_features on a database that doesn't have it yet
+    if table_exists(conn, "merchants_history_features"):
+        return False
+    for platform in PLATFORMS:
+        rebuild(conn, platform)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the merchants_history_features aggregate store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="backfill aggregates from merchants_scores_history")
+    rebuild_parser.add_argument("--platform", choices=PLATFORMS, action="append",
+                                help="platform to rebuild (repeatable, defaults to all)")
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**db_config)
+    try:
+        for platform in args.platform or PLATFORMS:
+            count = rebuild(conn, platform)
+            print(f"✅ Rebuilt {count} {platform} history aggregates")
+    finally:
+        conn.close()
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+import joblib
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+try:
+    from .features import CHURN_FEATURES, LOYALTY_FEATURES, PLATFORMS
+    from .forest_compile import compile_model
+    from .history_agg import read_platform_history_features
+    from .registry import MODEL_REGISTRY_DIR, publish
+    from .scoring import MODEL_FILES
+    from .sketch import ColumnSketches, sketch_path
+    from .train import (_DATASETS, _SKETCHES, MODEL_SPECS, N_ESTIMATORS, TRAIN_CORES, _fit_job, churn_dataset,
+                        load_datasets, loyalty_dataset, sketch_chunks)
+    from .train_data import read_training_frame, training_engine
+except ImportError:  # started from inside aiml/
+    from features import CHURN_FEATURES, LOYALTY_FEATURES, PLATFORMS
+    from forest_compile import compile_model
+    from history_agg import read_platform_history_features
+    from registry import MODEL_REGISTRY_DIR, publish
+    from scoring import MODEL_FILES
+    from sketch import ColumnSketches, sketch_path
+    from train import (_DATASETS, _SKETCHES, MODEL_SPECS, N_ESTIMATORS, TRAIN_CORES, _fit_job, churn_dataset,
+                       load_datasets, loyalty_dataset, sketch_chunks)
+    from train_data import read_training_frame, training_engine
+
+# Trees added per incremental run, and tree blocks (runs) kept before the
+# oldest is retired; a window of 0 keeps every block
+INCREMENTAL_TREES = int(os.getenv("INCREMENTAL_TREES", 50))
+INCREMENTAL_WINDOW = int(os.getenv("INCREMENTAL_WINDOW", 12))
+
+# Population stability index above which a feature counts as drifted
+DRIFT_THRESHOLD = float(os.getenv("DRIFT_THRESHOLD", 0.2))
+
+KIND_FEATURES = {'loyalty': LOYALTY_FEATURES, 'churn': CHURN_FEATURES}
+
+# Decile edges for the drift reference
+DRIFT_QUANTILES = np.arange(10, 100, 10)
+
+
+def state_path(model_path):
+    return os.path.splitext(model_path)[0] + ".incremental.json"
+
+
+def read_state(model_path):
+    try:
+        with open(state_path(model_path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_state(model_path, state):
+    tmp_path = f"{state_path(model_path)}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path(model_path))
+
+
+def list_partitions(engine, platform):
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"SELECT DISTINCT till_date FROM data_{platform}")).fetchall()
+    return sorted(pd.Timestamp(row[0]).date().isoformat() for row in rows if row[0] is not None)
+
+
+def _bin_shares(values, edges):
+    values = values[~np.isnan(values)]
+    counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+    return counts / max(len(values), 1)
+
+
+def drift_reference(X):
+    """Decile edges and bin shares of every feature column."""
+    reference = []
+    for column in X.T:
+        column = column.astype(np.float64)
+        edges = np.unique(np.nanpercentile(column, DRIFT_QUANTILES)) if not np.isnan(column).all() else np.array([])
+        reference.append({"edges": edges.tolist(), "shares": _bin_shares(column, edges).tolist()})
+    return reference
+
+
+def feature_drift(reference, X, features):
+    # Population stability index of the new rows against the reference bins
+    drift = {}
+    for feature, ref, column in zip(features, reference, X.T):
+        expected = np.clip(np.asarray(ref["shares"]), 1e-4, None)
+        actual = np.clip(_bin_shares(column.astype(np.float64), np.asarray(ref["edges"])), 1e-4, None)
+        drift[feature] = round(float(np.sum((actual - expected) * np.log(actual / expected))), 4)
+    return drift
+
+
+def partition_dataset(engine, spec, till_dates, base_sketches=None):
+    # New rows are streamed into the saved label sketches before they are
+    # ranked, so their labels share the scale of the rows already trained on
+    load_hist = spec.kind == 'loyalty' and spec.platform == 'shipway'
+    df_hist = read_platform_history_features(engine, spec.platform) if load_hist else None
+    sketches, on_chunk = sketch_chunks([spec], df_hist, {spec.output: base_sketches})
+    df = read_training_frame(engine, spec.platform, till_dates=till_dates, on_chunk=on_chunk)
+    sketches = sketches[spec.output]
+    if spec.kind == 'churn':
+        X, y = churn_dataset(df, spec.platform, sketches)
+    else:
+        X, y = loyalty_dataset(df, spec.platform, sketches, df_hist)
+    return X, y, sketches
+
+
+def rebuild(spec, engine, partitions, output_dir, cores):
+    load_datasets(engine, [spec])
+    X, _ = _DATASETS[spec.output]
+    try:
+        _fit_job(spec, cores, output_dir)
+    finally:
+        del _DATASETS[spec.output]
+        del _SKETCHES[spec.output]
+    return {
+        "platform": spec.platform,
+        "kind": spec.kind,
+        "features": KIND_FEATURES[spec.kind][spec.platform],
+        "partitions": partitions,
+        "blocks": [{"till_dates": partitions, "n_trees": N_ESTIMATORS, "rows": int(X.shape[0]),
+                    "trained_at": datetime.now(timezone.utc).isoformat()}],
+        "reference": drift_reference(X)
+    }
+
+
+def warm_start(model, X, y, n_trees, n_jobs):
+    """Grow ``n_trees`` more trees on (X, y) next to the existing ones."""
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + n_trees, n_jobs=n_jobs)
+    model.fit(X, y)
+    model.set_params(warm_start=False)
+    return model
+
+
+def retire_blocks(model, blocks, window):
+    # Drop the oldest blocks of trees until at most ``window`` remain
+    retired = []
+    while window and len(blocks) > window:
+        block = blocks.pop(0)
+        model.estimators_ = model.estimators_[block["n_trees"]:]
+        retired.append(block)
+    model.n_estimators = len(model.estimators_)
+    return retired
+
+
+def update_model(spec, engine, output_dir=".", cores=TRAIN_CORES, n_trees=INCREMENTAL_TREES,
+                 window=INCREMENTAL_WINDOW, drift_threshold=DRIFT_THRESHOLD, full=False):
+    """Bring one model up to date with the till_date partitions in the table.
+
+    New partitions get a block of ``n_trees`` warm-started trees, and the
+    oldest blocks are retired past ``window``. The model is rebuilt from
+    scratch on the full table instead when it has no incremental state,
+    its feature list changed, or any feature of the new rows drifts past
+    ``drift_threshold`` from the rows of the last full build.
+    """
+    start = time.perf_counter()
+    path = os.path.join(output_dir, spec.output)
+    partitions = list_partitions(engine, spec.platform)
+    state = read_state(path)
+    entry = {"model": spec.output}
+
+    reason = None
+    if full:
+        reason = "requested"
+    elif state is None or not os.path.exists(path):
+        reason = "no incremental state"
+    elif state["features"] != KIND_FEATURES[spec.kind][spec.platform]:
+        reason = "feature list changed"
+
+    if reason is None:
+        new = [d for d in partitions if d not in set(state["partitions"])]
+        entry["new_partitions"] = new
+        if not new:
+            entry.update(action="up to date", seconds=round(time.perf_counter() - start, 3))
+            return entry
+
+        saved_sketches = sketch_path(path)
+        base_sketches = ColumnSketches.load(saved_sketches) if os.path.exists(saved_sketches) else None
+        X, y, sketches = partition_dataset(engine, spec, new, base_sketches)
+        if len(X) == 0:
+            # Empty decile shares would read as drift; the partitions are
+            # looked at again on the next run, in case their rows arrive late
+            entry.update(action="skipped", reason="new partitions have no usable rows",
+                         seconds=round(time.perf_counter() - start, 3))
+            return entry
+        drift = feature_drift(state["reference"], X, state["features"])
+        drifted = {f: psi for f, psi in drift.items() if psi > drift_threshold}
+        entry["drift"] = drift
+        if drifted:
+            reason = f"drift in {', '.join(sorted(drifted))}"
+
+    if reason is not None:
+        state = rebuild(spec, engine, partitions, output_dir, cores)
+        entry.update(action="rebuild", reason=reason, n_trees=N_ESTIMATORS)
+    else:
+        model = joblib.load(path)
+        warm_start(model, X, y, n_trees, cores)
+        state["blocks"].append({"till_dates": new, "n_trees": n_trees, "rows": int(len(y)),
+                                "trained_at": datetime.now(timezone.utc).isoformat()})
+        retired = retire_blocks(model, state["blocks"], window)
+        state["partitions"] = partitions
+
+        model.set_params(n_jobs=spec.saved_n_jobs)
+        joblib.dump(model, path)
+        compile_model(path, model=model)
+        sketches.save(sketch_path(path))
+        entry.update(action="warm start", rows=int(len(y)), added_trees=n_trees,
+                     retired_trees=sum(block["n_trees"] for block in retired), n_trees=len(model.estimators_))
+
+    write_state(path, state)
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def update(specs, output_dir=".", cores=TRAIN_CORES, engine=None, **options):
+    engine = engine or training_engine()
+    try:
+        results = []
+        for spec in specs:
+            entry = update_model(spec, engine, output_dir, cores, **options)
+            detail = entry.get("reason") or f"{len(entry.get('new_partitions', []))} new partitions"
+            print(f"✅ {spec.output}: {entry['action']} ({detail}) in {entry['seconds']}s")
+            results.append(entry)
+        return results
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add trees for new till_date partitions to the trained models")
+    parser.add_argument("--platform", choices=PLATFORMS, action="append",
+                        help="platform to update (repeatable, defaults to all)")
+    parser.add_argument("--kind", choices=['loyalty', 'churn'], action="append",
+                        help="model kind to update (repeatable, defaults to both)")
+    parser.add_argument("--trees", type=int, default=INCREMENTAL_TREES, help="trees added per run")
+    parser.add_argument("--window", type=int, default=INCREMENTAL_WINDOW,
+                        help="tree blocks kept before the oldest is retired (0 keeps all)")
+    parser.add_argument("--drift-threshold", type=float, default=DRIFT_THRESHOLD,
+                        help="per-feature PSI that triggers a full rebuild")
+    parser.add_argument("--full", action="store_true", help="rebuild every model from scratch")
+    parser.add_argument("--cores", type=int, default=TRAIN_CORES)
+    parser.add_argument("--output-dir", default=".", help="directory holding the model pickles")
+    parser.add_argument("--report", default="incremental_report.json")
+    parser.add_argument("--publish", action="store_true",
+                        help="publish each platform whose models changed as a new registry version")
+    parser.add_argument("--registry", default=MODEL_REGISTRY_DIR)
+    args = parser.parse_args()
+
+    specs = [spec for spec in MODEL_SPECS
+             if spec.platform in (args.platform or PLATFORMS) and spec.kind in (args.kind or ['loyalty', 'churn'])]
+    results = update(specs, args.output_dir, args.cores, n_trees=args.trees, window=args.window,
+                     drift_threshold=args.drift_threshold, full=args.full)
+    with open(args.report, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Report written to {args.report}")
+
+    if args.publish:
+        changed = {entry["model"] for entry in results if entry["action"] not in ("up to date", "skipped")}
+        for platform, (loyalty_file, churn_file) in MODEL_FILES.items():
+            if changed & {loyalty_file, churn_file}:
+                manifest = publish(args.registry, platform, os.path.join(args.output_dir, loyalty_file),
+                                   os.path.join(args.output_dir, churn_file))
+                print(f"✅ Published {platform} models as {manifest['version']}")
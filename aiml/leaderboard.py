@@ -0,0 +1,205 @@
+import argparse
+import mysql.connector
+
+try:
+    from .db import db_config, table_exists
+    from .features import PLATFORMS
+except ImportError:  # started from inside aiml/
+    from db import db_config, table_exists
+    from features import PLATFORMS
+
+# Dashboard cohort of merchants with middling loyalty but a high churn rate
+AVERAGE_LOYALTY_RANGE = (20, 40)
+HIGH_CHURN_ABOVE = 40
+
+GRAND_BOARD = "grand"
+
+# Snapshot rows behind the admin dashboards, one per (board, merchant).
+# Kept in step with every score upsert, so a dashboard reads the top of a
+# board off the board_rank index instead of sorting merchants_scores.
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS merchants_leaderboard (
+        board VARCHAR(48) NOT NULL,
+        merchant_id INT NOT NULL,
+        rank_primary DOUBLE NOT NULL,
+        rank_secondary DOUBLE NOT NULL DEFAULT 0,
+        score DOUBLE NULL,
+        churn_rate DOUBLE NULL,
+        badge VARCHAR(32) NULL,
+        total_orders DOUBLE NULL,
+        total_billing DOUBLE NULL,
+        updated_on DATETIME NULL,
+        PRIMARY KEY (board, merchant_id),
+        KEY board_rank (board, rank_primary, rank_secondary)
+    )
+"""
+
+UPSERT_QUERY = """
+    INSERT INTO merchants_leaderboard (
+        board, merchant_id, rank_primary, rank_secondary, score, churn_rate,
+        badge, total_orders, total_billing, updated_on
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE
+        rank_primary = VALUES(rank_primary),
+        rank_secondary = VALUES(rank_secondary),
+        score = VALUES(score),
+        churn_rate = VALUES(churn_rate),
+        badge = VALUES(badge),
+        total_orders = VALUES(total_orders),
+        total_billing = VALUES(total_billing),
+        updated_on = NOW()
+"""
+
+
+def loyalty_board(platform):
+    # Every scored merchant by loyalty, then churn rate, with lifetime totals
+    return f"{platform}_loyalty"
+
+
+def at_risk_board(platform):
+    # Average-loyalty, high-churn merchants by churn rate
+    return f"{platform}_average_loyalty_high_churn"
+
+
+def is_at_risk(score, churn_rate):
+    low, high = AVERAGE_LOYALTY_RANGE
+    return low <= score <= high and churn_rate > HIGH_CHURN_ABOVE
+
+
+def update_platform_boards(conn, platform, rows):
+    """Fold freshly written platform scores into the platform's boards.
+
+    ``rows`` holds ``(merchant_id, from_date, till_date, score,
+    churn_rate)`` tuples; a merchant's last row wins, as it does in
+    merchants_scores. Only these merchants' board rows are touched:
+    upserted where they qualify, deleted from the at-risk board where
+    they no longer do. The caller owns the transaction.
+    """
+    if not rows:
+        return
+
+    latest = {row[0]: row for row in rows}
+    placeholders = ", ".join(["%s"] * len(latest))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT merchant_id, SUM(order_count), SUM(billing_amount)
+            FROM data_{platform}
+            WHERE merchant_id IN ({placeholders})
+            GROUP BY merchant_id
+        """, tuple(latest))
+        totals = {merchant_id: (orders, billing) for merchant_id, orders, billing in cursor.fetchall()}
+
+        board_rows = []
+        leaving = []
+        for merchant_id, (_, _, _, score, churn_rate) in latest.items():
+            orders, billing = totals.get(merchant_id, (None, None))
+            board_rows.append((loyalty_board(platform), merchant_id, score, churn_rate, score, churn_rate,
+                               None, orders or 0, billing or 0))
+            if is_at_risk(score, churn_rate):
+                board_rows.append((at_risk_board(platform), merchant_id, churn_rate, 0, score, churn_rate,
+                                   None, None, None))
+            else:
+                leaving.append(merchant_id)
+
+        cursor.executemany(UPSERT_QUERY, board_rows)
+        if leaving:
+            cursor.execute(f"""
+                DELETE FROM merchants_leaderboard
+                WHERE board = %s AND merchant_id IN ({", ".join(["%s"] * len(leaving))})
+            """, (at_risk_board(platform), *leaving))
+    finally:
+        cursor.close()
+
+
+def update_grand_board(conn, rows):
+    # (merchant_id, grand_score, grand_badge) rows; the caller owns the transaction
+    if not rows:
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(UPSERT_QUERY, [(GRAND_BOARD, merchant_id, score, 0, score, None, badge, None, None)
+                                          for merchant_id, score, badge in rows])
+    finally:
+        cursor.close()
+
+
+def rebuild(conn, platform=None):
+    """Backfill one platform's boards, or the grand board when ``platform`` is None."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CREATE_TABLE_QUERY)
+        if platform is None:
+            cursor.execute("DELETE FROM merchants_leaderboard WHERE board = %s", (GRAND_BOARD,))
+            cursor.execute("""
+                INSERT INTO merchants_leaderboard (
+                    board, merchant_id, rank_primary, rank_secondary, score, badge, updated_on
+                )
+                SELECT %s, merchant_id, grand_score, 0, grand_score, grand_badge, NOW()
+                FROM merchants_scores
+                WHERE grand_score IS NOT NULL
+            """, (GRAND_BOARD,))
+            rebuilt = cursor.rowcount
+        else:
+            loyalty_col = f"loyalty_score_{platform}"
+            churn_col = f"churn_rate_{platform}"
+            low, high = AVERAGE_LOYALTY_RANGE
+            cursor.execute("DELETE FROM merchants_leaderboard WHERE board IN (%s, %s)",
+                           (loyalty_board(platform), at_risk_board(platform)))
+            cursor.execute(f"""
+                INSERT INTO merchants_leaderboard (
+                    board, merchant_id, rank_primary, rank_secondary, score, churn_rate,
+                    total_orders, total_billing, updated_on
+                )
+                SELECT
+                    %s, s.merchant_id, s.{loyalty_col}, s.{churn_col}, s.{loyalty_col}, s.{churn_col},
+                    COALESCE(d.total_orders, 0), COALESCE(d.total_billing, 0), NOW()
+                FROM merchants_scores s
+                LEFT JOIN (
+                    SELECT merchant_id, SUM(order_count) AS total_orders, SUM(billing_amount) AS total_billing
+                    FROM data_{platform}
+                    GROUP BY merchant_id
+                ) d ON d.merchant_id = s.merchant_id
+                WHERE s.{loyalty_col} IS NOT NULL AND s.{churn_col} IS NOT NULL
+            """, (loyalty_board(platform),))
+            rebuilt = cursor.rowcount
+            cursor.execute(f"""
+                INSERT INTO merchants_leaderboard (
+                    board, merchant_id, rank_primary, rank_secondary, score, churn_rate, updated_on
+                )
+                SELECT %s, merchant_id, {churn_col}, 0, {loyalty_col}, {churn_col}, NOW()
+                FROM merchants_scores
+                WHERE {loyalty_col} BETWEEN %s AND %s AND {churn_col} > %s
+            """, (at_risk_board(platform), low, high, HIGH_CHURN_ABOVE))
+            rebuilt += cursor.rowcount
+        conn.commit()
+        return rebuilt
+    finally:
+        cursor.close()
+
+
+def ensure_table(conn):
+    # Creates and backfills merchants_leaderboard on a database that doesn't have it yet
+    if table_exists(conn, "merchants_leaderboard"):
+        return False
+    for platform in PLATFORMS:
+        rebuild(conn, platform)
+    rebuild(conn)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the merchants_leaderboard dashboard snapshots")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="backfill boards from merchants_scores")
+    rebuild_parser.add_argument("--platform", choices=PLATFORMS + [GRAND_BOARD], action="append",
+                                help="platform boards to rebuild, or 'grand' (repeatable, defaults to all)")
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**db_config)
+    try:
+        for platform in args.platform or PLATFORMS + [GRAND_BOARD]:
+            count = rebuild(conn, None if platform == GRAND_BOARD else platform)
+            print(f"✅ Rebuilt {count} {platform} leaderboard rows")
+    finally:
+        conn.close()
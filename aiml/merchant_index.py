@@ -0,0 +1,172 @@
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    from .features import PLATFORMS
+except ImportError:  # started from inside aiml/
+    from features import PLATFORMS
+
+# Index settings: merchants kept in memory, and seconds between updated_on polls (0 turns polling off)
+MERCHANT_INDEX_SIZE = int(os.getenv("MERCHANT_INDEX_SIZE", 200000))
+MERCHANT_INDEX_REFRESH = float(os.getenv("MERCHANT_INDEX_REFRESH", 30))
+
+
+def merchant_query(clause):
+    flags = ", ".join(f"is_{p} = '1' AS on_{p}, multiplier_{p}" for p in PLATFORMS)
+    return f"SELECT merchant_id, email, {flags}, updated_on FROM merchants {clause}"
+
+
+def merchant_entry(row):
+    # Platform flags as booleans, whatever the driver returns for the comparison
+    entry = dict(row)
+    entry.pop('updated_on', None)
+    for platform in PLATFORMS:
+        entry[f'on_{platform}'] = bool(entry[f'on_{platform}'])
+    return entry
+
+
+class MerchantIndex:
+    """Bounded in-process index of merchants by email and merchant_id.
+
+    Each entry holds the merchant_id, email, ``on_<platform>`` flags and
+    ``multiplier_<platform>`` values the scoring endpoints need. ``warm``
+    loads the most recently updated merchants in bulk, ``refresh``
+    reloads indexed merchants whose ``updated_on`` is past the newest one
+    seen, and misses fall through to one query and are remembered. Least
+    recently used entries go once ``maxsize`` is reached. Changes that
+    leave ``updated_on`` alone (or share the watermark's timestamp) need
+    ``invalidate``. Emails match case-insensitively, as they do under
+    MySQL's default collation.
+    """
+
+    def __init__(self, maxsize=MERCHANT_INDEX_SIZE):
+        self.maxsize = maxsize
+        self._by_id = OrderedDict()
+        self._by_email = {}
+        self._lock = threading.Lock()
+        self.watermark = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshed = 0
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def _put(self, entry):
+        # Caller holds the lock
+        merchant_id = entry['merchant_id']
+        old = self._by_id.pop(merchant_id, None)
+        if old is not None and old['email'].lower() != entry['email'].lower():
+            self._by_email.pop(old['email'].lower(), None)
+        self._by_id[merchant_id] = entry
+        self._by_email[entry['email'].lower()] = merchant_id
+        while len(self._by_id) > self.maxsize:
+            _, evicted = self._by_id.popitem(last=False)
+            self._by_email.pop(evicted['email'].lower(), None)
+            self.evictions += 1
+
+    def _advance(self, rows):
+        stamps = [row['updated_on'] for row in rows if row['updated_on'] is not None]
+        if stamps and (self.watermark is None or max(stamps) > self.watermark):
+            self.watermark = max(stamps)
+
+    def warm(self, conn):
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(merchant_query("ORDER BY updated_on DESC LIMIT %s"), (self.maxsize,))
+            loaded = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        with self._lock:
+            # Oldest first, so the most recently updated merchants end up least likely to be evicted
+            for row in reversed(loaded):
+                self._put(merchant_entry(row))
+            self._advance(loaded)
+        return len(loaded)
+
+    def refresh(self, conn):
+        # Only merchants already indexed are replaced; the rest load on their first lookup
+        if self.watermark is None:
+            return self.warm(conn)
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(merchant_query("WHERE updated_on > %s"), (self.watermark,))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        refreshed = 0
+        with self._lock:
+            for row in rows:
+                if row['merchant_id'] in self._by_id:
+                    self._put(merchant_entry(row))
+                    refreshed += 1
+            self._advance(rows)
+            self.refreshed += refreshed
+        return refreshed
+
+    def get_many(self, conn, key_col, keys):
+        """``{key: entry}`` for the ``keys`` (emails or merchant_ids) that exist."""
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                merchant_id = self._by_email.get(key.lower()) if key_col == 'email' else key
+                entry = self._by_id.get(merchant_id)
+                if entry is None:
+                    missing.append(key)
+                else:
+                    self._by_id.move_to_end(merchant_id)
+                    found[key] = entry
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute(merchant_query(f"WHERE {key_col} IN ({', '.join(['%s'] * len(missing))})"),
+                               tuple(missing))
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+            # Back to the caller's keys, which may differ from the stored email in case
+            requested = {str(key).lower(): key for key in missing}
+            with self._lock:
+                for row in rows:
+                    entry = merchant_entry(row)
+                    self._put(entry)
+                    found[requested.get(str(entry[key_col]).lower(), entry[key_col])] = entry
+        return found
+
+    def get(self, conn, email):
+        return self.get_many(conn, 'email', [email]).get(email)
+
+    def invalidate(self, merchant_id=None):
+        with self._lock:
+            if merchant_id is None:
+                count = len(self._by_id)
+                self._by_id.clear()
+                self._by_email.clear()
+                return count
+            entry = self._by_id.pop(merchant_id, None)
+            if entry is None:
+                return 0
+            self._by_email.pop(entry['email'].lower(), None)
+            return 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._by_id),
+                "maxsize": self.maxsize,
+                "watermark": self.watermark.isoformat() if hasattr(self.watermark, "isoformat") else self.watermark,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "refreshed": self.refreshed,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,232 @@
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Requests slower than this are logged with their stage breakdown (0 turns it off)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 0))
+
+# Upper bounds in seconds, from a cache hit to a cold multi-platform score
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_text(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, as Prometheus expects."""
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _label_text(self.labelnames, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time.
+
+    The callback returns a number, or a dict of label-value tuple -> number.
+    ``kind="counter"`` exposes totals that other objects already keep.
+    """
+
+    def __init__(self, name, help, callback, labelnames=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "aiml_stage_duration_seconds", "Time spent in each scoring stage.", ("stage", "platform")))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "aiml_request_duration_seconds", "Scoring request latency.", ("endpoint", "platform")))
+REQUESTS_TOTAL = REGISTRY.register(Counter(
+    "aiml_requests_total", "Scoring requests by response status.", ("endpoint", "platform", "status")))
+SLOW_REQUESTS_TOTAL = REGISTRY.register(Counter(
+    "aiml_slow_requests_total", "Requests slower than SLOW_REQUEST_MS.", ("endpoint",)))
+
+
+class RequestTimings:
+    """Stage durations of one request.
+
+    Lives in a context variable, so stages that run in the threadpool
+    (which copies the request's context) add to the same object.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.platform = "all"
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def breakdown_ms(self):
+        with self._lock:
+            return {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+def set_platform(platform):
+    timings = _current.get()
+    if timings is not None:
+        timings.platform = platform
+
+
+@contextmanager
+def stage(name, platform="all"):
+    # Times the block into the stage histogram and the current request's breakdown
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name, platform=platform)
+        timings = _current.get()
+        if timings is not None:
+            timings.add(name if platform == "all" else f"{platform}.{name}", elapsed)
+
+
+class TimingMiddleware:
+    """ASGI middleware timing the routes in ``paths`` end to end.
+
+    Each request gets a RequestTimings in context, its latency lands in
+    REQUEST_SECONDS and, past ``slow_ms``, a log line lists its stages.
+    """
+
+    def __init__(self, app, paths, slow_ms=SLOW_REQUEST_MS):
+        self.app = app
+        self.paths = set(paths)
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = RequestTimings(scope["path"])
+        token = _current.set(timings)
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None)
+            if endpoint in self.paths:
+                self.record(endpoint, timings, status, elapsed)
+
+    def record(self, endpoint, timings, status, elapsed):
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, platform=timings.platform)
+        REQUESTS_TOTAL.inc(endpoint=endpoint, platform=timings.platform, status=str(status))
+        if self.slow_ms and elapsed * 1000 >= self.slow_ms:
+            SLOW_REQUESTS_TOTAL.inc(endpoint=endpoint)
+            print(f"⚠️ Slow request {endpoint} platform={timings.platform} status={status} "
+                  f"{elapsed * 1000:.1f}ms stages={json.dumps(timings.breakdown_ms())}")
@@ -0,0 +1,266 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+import numpy as np
+
+try:
+    from .features import CHURN_FEATURES, LOYALTY_FEATURES, PLATFORMS
+    from .forest_compile import compile_model, load_model
+    from .scoring import MODEL_FILES
+    from .sketch import sketch_path
+except ImportError:  # started from inside aiml/
+    from features import CHURN_FEATURES, LOYALTY_FEATURES, PLATFORMS
+    from forest_compile import compile_model, load_model
+    from scoring import MODEL_FILES
+    from sketch import sketch_path
+
+# Registry layout: <dir>/<platform>/<version>/{manifest.json, model pickles,
+# compiled forests} plus <dir>/<platform>/CURRENT naming the active version
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "model_registry")
+MODEL_POLL_INTERVAL = float(os.getenv("MODEL_POLL_INTERVAL", 30))
+
+KIND_FEATURES = {'loyalty': LOYALTY_FEATURES, 'churn': CHURN_FEATURES}
+
+ModelVersion = namedtuple("ModelVersion", "version loyalty churn manifest")
+
+
+class ModelRegistryError(Exception):
+    pass
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return f"{int(stat.st_mtime)}-{stat.st_size}"
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def current_version(registry_dir, platform):
+    try:
+        with open(os.path.join(registry_dir, platform, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest(registry_dir, platform, version):
+    with open(os.path.join(registry_dir, platform, version, "manifest.json")) as f:
+        return json.load(f)
+
+
+def list_versions(registry_dir, platform):
+    path = os.path.join(registry_dir, platform)
+    if not os.path.isdir(path):
+        return []
+    return sorted(name for name in os.listdir(path)
+                  if os.path.exists(os.path.join(path, name, "manifest.json")))
+
+
+def activate(registry_dir, platform, version):
+    read_manifest(registry_dir, platform, version)
+    _write_atomic(os.path.join(registry_dir, platform, "CURRENT"), version + "\n")
+
+
+def publish(registry_dir, platform, loyalty_path, churn_path, version=None, make_current=True):
+    """Copy a platform's two pickles into a new registry version.
+
+    The version directory is written completely (pickles, compiled forests,
+    label sketches, manifest) before CURRENT is switched to it, so pollers
+    never see a half published version.
+    """
+    created = datetime.now(timezone.utc)
+    checksums = {'loyalty': file_checksum(loyalty_path), 'churn': file_checksum(churn_path)}
+    version = version or f"{created:%Y%m%d-%H%M%S}-{checksums['loyalty'][:8]}"
+    version_dir = os.path.join(registry_dir, platform, version)
+    if os.path.exists(version_dir):
+        raise ModelRegistryError(f"{platform} version {version} already exists")
+    os.makedirs(version_dir)
+
+    models = {}
+    for kind, source in (('loyalty', loyalty_path), ('churn', churn_path)):
+        target = os.path.join(version_dir, os.path.basename(source))
+        shutil.copy2(source, target)
+        _, forest = compile_model(target)
+        models[kind] = {
+            "file": os.path.basename(source),
+            "sha256": checksums[kind],
+            "features": KIND_FEATURES[kind][platform],
+            "n_trees": forest.meta["n_trees"],
+            "trained_at": datetime.fromtimestamp(os.path.getmtime(source), timezone.utc).isoformat()
+        }
+        if os.path.exists(sketch_path(source)):
+            shutil.copy2(sketch_path(source), sketch_path(target))
+            models[kind]["sketch"] = os.path.basename(sketch_path(target))
+
+    manifest = {
+        "platform": platform,
+        "version": version,
+        "published_at": created.isoformat(),
+        "models": models
+    }
+    _write_atomic(os.path.join(version_dir, "manifest.json"), json.dumps(manifest, indent=2))
+    if make_current:
+        activate(registry_dir, platform, version)
+    return manifest
+
+
+class ModelStore:
+    """Active (loyalty, churn) models per platform with hot swapping.
+
+    A platform's models load on first use from the registry's CURRENT
+    version, or from the legacy pickles in ``legacy_dir`` when the platform
+    has never been published. ``refresh`` loads and warms any newer version
+    off to the side and then replaces the platform's entry in one
+    assignment, so a request sees either the old pair or the new pair.
+    """
+
+    def __init__(self, registry_dir=MODEL_REGISTRY_DIR, legacy_dir=".", legacy_files=MODEL_FILES):
+        self.registry_dir = registry_dir
+        self.legacy_dir = legacy_dir
+        self.legacy_files = dict(legacy_files)
+        self._active = {}
+        self._rejected = {}
+        self._lock = threading.Lock()
+        self.swaps = 0
+
+    def __contains__(self, platform):
+        return platform in self.legacy_files
+
+    def __iter__(self):
+        return iter(self.legacy_files)
+
+    def _legacy_paths(self, platform):
+        return [os.path.join(self.legacy_dir, name) for name in self.legacy_files[platform]]
+
+    def available_version(self, platform):
+        version = current_version(self.registry_dir, platform)
+        if version is not None:
+            return version
+        loyalty_path, churn_path = self._legacy_paths(platform)
+        return f"legacy-{_file_stamp(loyalty_path)}/{_file_stamp(churn_path)}"
+
+    def version(self, platform):
+        # Version that scores the platform right now, without loading it
+        active = self._active.get(platform)
+        return active.version if active is not None else self.available_version(platform)
+
+    def load(self, platform, version):
+        if version.startswith("legacy-"):
+            paths = self._legacy_paths(platform)
+            manifest = None
+        else:
+            manifest = read_manifest(self.registry_dir, platform, version)
+            version_dir = os.path.join(self.registry_dir, platform, version)
+            paths = []
+            for kind in ('loyalty', 'churn'):
+                entry = manifest["models"][kind]
+                if entry["features"] != KIND_FEATURES[kind][platform]:
+                    raise ModelRegistryError(f"{platform} {version} {kind} was trained on different features")
+                path = os.path.join(version_dir, entry["file"])
+                if file_checksum(path) != entry["sha256"]:
+                    raise ModelRegistryError(f"{platform} {version} {kind} checksum mismatch")
+                paths.append(path)
+
+        models = [load_model(path) for path in paths]
+        # Warm up: fault in the arrays and run each model once
+        for model in models:
+            model.predict(np.zeros((1, model.n_features_in_), dtype=np.float32))
+        return ModelVersion(version, models[0], models[1], manifest)
+
+    def get(self, platform):
+        active = self._active.get(platform)
+        if active is None:
+            if platform not in self.legacy_files:
+                raise KeyError(platform)
+            with self._lock:
+                active = self._active.get(platform)
+                if active is None:
+                    active = self._active[platform] = self.load(platform, self.available_version(platform))
+        return active
+
+    def refresh(self):
+        """Swap in new versions for the platforms already loaded."""
+        swapped = []
+        for platform, active in list(self._active.items()):
+            try:
+                version = self.available_version(platform)
+                # Versions that failed to load are retried only after CURRENT moves on
+                if version in (active.version, self._rejected.get(platform)):
+                    continue
+                loaded = self.load(platform, version)
+            except Exception as e:
+                self._rejected[platform] = version
+                print(f"⚠️ Keeping {platform} models {active.version}: {e}")
+                continue
+            self._active[platform] = loaded
+            self.swaps += 1
+            swapped.append((platform, active.version, version))
+            print(f"✅ Swapped {platform} models {active.version} -> {version}")
+        return swapped
+
+    def status(self):
+        return {
+            "registry_dir": self.registry_dir,
+            "swaps": self.swaps,
+            "platforms": {
+                platform: {
+                    "version": self.version(platform),
+                    "loaded": platform in self._active,
+                    "rejected": self._rejected.get(platform)
+                }
+                for platform in self.legacy_files
+            }
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry")
+    parser.add_argument("--registry", default=MODEL_REGISTRY_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    publish_parser = subparsers.add_parser("publish", help="publish the trained pickles as a new version")
+    publish_parser.add_argument("--platform", choices=PLATFORMS, action="append",
+                                help="platform to publish (repeatable, defaults to all)")
+    publish_parser.add_argument("--from-dir", default=".", help="directory holding the trained pickles")
+    publish_parser.add_argument("--no-activate", action="store_true", help="publish without making it current")
+
+    list_parser = subparsers.add_parser("list", help="list versions per platform")
+
+    activate_parser = subparsers.add_parser("activate", help="make an existing version current (rollback)")
+    activate_parser.add_argument("--platform", choices=PLATFORMS, required=True)
+    activate_parser.add_argument("--version", required=True)
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        for platform in args.platform or PLATFORMS:
+            loyalty_file, churn_file = MODEL_FILES[platform]
+            manifest = publish(args.registry, platform, os.path.join(args.from_dir, loyalty_file),
+                               os.path.join(args.from_dir, churn_file), make_current=not args.no_activate)
+            print(f"✅ Published {platform} models as {manifest['version']}")
+    elif args.command == "list":
+        for platform in PLATFORMS:
+            current = current_version(args.registry, platform)
+            for version in list_versions(args.registry, platform):
+                marker = "\t(current)" if version == current else ""
+                print(f"{platform}\t{version}{marker}")
+    else:
+        activate(args.registry, args.platform, args.version)
+        print(f"✅ {args.platform} now serves {args.version}")
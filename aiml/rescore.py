@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import mysql.connector
+
+try:
+    from .db import db_config
+    from .features import PLATFORMS, build_frame
+    from .history_agg import read_history_features
+    from .registry import MODEL_REGISTRY_DIR, ModelStore
+    from .score_distribution import ScoreDistributions
+    from .scoring import (ensure_tables, load_latest_rows, predict_scores, score_rows, stored_grand_scores,
+                          write_grand_scores, write_platform_scores)
+except ImportError:  # started from inside aiml/
+    from db import db_config
+    from features import PLATFORMS, build_frame
+    from history_agg import read_history_features
+    from registry import MODEL_REGISTRY_DIR, ModelStore
+    from score_distribution import ScoreDistributions
+    from scoring import (ensure_tables, load_latest_rows, predict_scores, score_rows, stored_grand_scores,
+                         write_grand_scores, write_platform_scores)
+
+# Merchants per page; each page is scored and committed as one transaction
+RESCORE_PAGE_SIZE = int(os.getenv("RESCORE_PAGE_SIZE", 1000))
+
+# Pages between progress lines
+PROGRESS_EVERY = 10
+
+
+class Checkpoint:
+    """Last committed merchant_id per platform, persisted after every page.
+
+    The file is replaced atomically, so a crash leaves either the previous
+    or the new state behind and a resumed run continues after the last
+    committed page.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state = {}
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def get(self, platform):
+        with self._lock:
+            return dict(self.state.get(platform, {}))
+
+    def update(self, platform, **values):
+        with self._lock:
+            self.state.setdefault(platform, {}).update(values)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def merchant_pages(conn, platform, after, page_size):
+    # Keyset pagination over merchants that have data for the platform
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute(f"""
+                SELECT DISTINCT merchant_id
+                FROM data_{platform}
+                WHERE merchant_id > %s
+                ORDER BY merchant_id
+                LIMIT %s
+            """, (after, page_size))
+            merchant_ids = [row[0] for row in cursor.fetchall()]
+            if not merchant_ids:
+                return
+            yield merchant_ids
+            after = merchant_ids[-1]
+    finally:
+        cursor.close()
+
+
+def score_page(conn, platform, loyalty_model, churn_model, merchant_ids, platforms, distributions):
+    df = load_latest_rows(conn, platform, merchant_ids)
+    if df.empty:
+        return 0
+
+    df_hist = read_history_features(conn, [platform], merchant_ids)
+    merged_df = build_frame(df, platform, df_hist)
+    scores, churn_rates = predict_scores(loyalty_model, churn_model, platform, merged_df)
+    rows = score_rows(merged_df, scores, churn_rates)
+    write_platform_scores(conn, platform, rows)
+    # Grand scores, their distribution and the grand board follow the new platform scores
+    write_grand_scores(conn, stored_grand_scores(conn, platforms, [row[0] for row in rows], distributions))
+    return len(merged_df)
+
+
+def rescore_platform(platform, checkpoint, model_store, distributions, page_size=RESCORE_PAGE_SIZE):
+    state = checkpoint.get(platform)
+    if state.get("done"):
+        print(f"⏭️ {platform}: already complete in {checkpoint.path}")
+        return {"platform": platform, "merchants": 0, "seconds": 0.0, "merchants_per_s": 0.0, "skipped": True}
+
+    # One model version for the whole run
+    models = model_store.get(platform)
+    loyalty_model, churn_model = models.loyalty, models.churn
+
+    after = state.get("last_merchant_id", 0)
+    total = state.get("scored", 0)
+    merchants = 0
+    start = time.perf_counter()
+
+    conn = mysql.connector.connect(**db_config)
+    try:
+        for page, merchant_ids in enumerate(merchant_pages(conn, platform, after, page_size), start=1):
+            try:
+                # Grand badges rank against the grand scores as they stand, including earlier pages'
+                distributions.refresh(conn)
+                merchants += score_page(conn, platform, loyalty_model, churn_model, merchant_ids,
+                                        list(model_store), distributions)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            checkpoint.update(platform, last_merchant_id=merchant_ids[-1], scored=total + merchants)
+
+            if page % PROGRESS_EVERY == 0:
+                rate = merchants / (time.perf_counter() - start)
+                print(f"… {platform}: {merchants} merchants, up to id {merchant_ids[-1]} ({rate:.1f}/s)")
+    finally:
+        conn.close()
+
+    checkpoint.update(platform, done=True)
+    seconds = time.perf_counter() - start
+    rate = merchants / seconds if seconds else 0.0
+    print(f"✅ {platform}: rescored {merchants} merchants with models {models.version} "
+          f"in {seconds:.1f}s ({rate:.1f} merchants/s)")
+    return {"platform": platform, "merchants": merchants, "seconds": round(seconds, 3),
+            "merchants_per_s": round(rate, 1), "model_version": models.version, "skipped": False}
+
+
+def rescore(platforms, checkpoint, model_store, page_size=RESCORE_PAGE_SIZE, workers=None):
+    start = time.perf_counter()
+    distributions = ScoreDistributions()
+    with ThreadPoolExecutor(max_workers=workers or len(platforms)) as pool:
+        results = list(pool.map(lambda p: rescore_platform(p, checkpoint, model_store, distributions, page_size),
+                                platforms))
+
+    seconds = time.perf_counter() - start
+    merchants = sum(result["merchants"] for result in results)
+    return {
+        "merchants": merchants,
+        "seconds": round(seconds, 3),
+        "merchants_per_s": round(merchants / seconds, 1) if seconds else 0.0,
+        "platforms": results
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rescore every merchant with the saved models")
+    parser.add_argument("--platform", choices=PLATFORMS, action="append",
+                        help="platform to rescore (repeatable, defaults to all)")
+    parser.add_argument("--page-size", type=int, default=RESCORE_PAGE_SIZE,
+                        help="merchants per page and per transaction")
+    parser.add_argument("--workers", type=int, help="platforms scored in parallel (defaults to all at once)")
+    parser.add_argument("--checkpoint", default="rescore_checkpoint.json")
+    parser.add_argument("--resume", action="store_true", help="continue after the last committed page")
+    parser.add_argument("--registry", default=MODEL_REGISTRY_DIR, help="model registry directory")
+    parser.add_argument("--model-dir", default=".", help="directory holding unregistered model pickles")
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**db_config)
+    try:
+        ensure_tables(conn)
+    finally:
+        conn.close()
+
+    checkpoint = Checkpoint(args.checkpoint, resume=args.resume)
+    model_store = ModelStore(args.registry, legacy_dir=args.model_dir)
+    report = rescore(args.platform or PLATFORMS, checkpoint, model_store, args.page_size, args.workers)
+    print(f"✅ Rescored {report['merchants']} merchants in {report['seconds']}s "
+          f"({report['merchants_per_s']} merchants/s)")
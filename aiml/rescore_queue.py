@@ -0,0 +1,259 @@
+import asyncio
+import os
+import time
+
+# Change-driven rescoring: merchants per background batch, batches in
+# flight at once, and how long a change waits so bursts of updates to the
+# same merchant collapse into one rescore
+RESCORE_BATCH_SIZE = int(os.getenv("RESCORE_BATCH_SIZE", 200))
+RESCORE_CONCURRENCY = int(os.getenv("RESCORE_CONCURRENCY", 2))
+RESCORE_DEBOUNCE = float(os.getenv("RESCORE_DEBOUNCE", 1.0))
+
+# Failed batches are retried after RESCORE_RETRY_BACKOFF seconds, doubling
+# per attempt up to RESCORE_MAX_BACKOFF; merchants failing
+# RESCORE_MAX_ATTEMPTS times in a row are dropped and counted as dead letters
+RESCORE_RETRY_BACKOFF = float(os.getenv("RESCORE_RETRY_BACKOFF", 2.0))
+RESCORE_MAX_BACKOFF = float(os.getenv("RESCORE_MAX_BACKOFF", 300))
+RESCORE_MAX_ATTEMPTS = int(os.getenv("RESCORE_MAX_ATTEMPTS", 5))
+
+# Seconds between polls of data_* for new till_date partitions (0 turns it off)
+RESCORE_POLL_INTERVAL = float(os.getenv("RESCORE_POLL_INTERVAL", 0))
+
+# How long the dashboards treat a background-computed score as synced
+RESCORE_SYNC_TTL = int(os.getenv("RESCORE_SYNC_TTL", 86400))
+
+
+def latest_partition(conn, platform):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT MAX(till_date) FROM data_{platform}")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def changed_since(conn, platform, watermark):
+    # Merchants with rows in partitions newer than the watermark, and the new watermark
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT merchant_id, MAX(till_date)
+            FROM data_{platform}
+            WHERE till_date > %s
+            GROUP BY merchant_id
+        """, (watermark,))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    if not rows:
+        return [], watermark
+    return [merchant_id for merchant_id, _ in rows], max(till_date for _, till_date in rows)
+
+
+def mark_synced(conn, platform, merchant_ids, ttl=RESCORE_SYNC_TTL):
+    # Lets the dashboards serve the stored platform and grand scores until the TTL runs out
+    placeholders = ", ".join(["%s"] * len(merchant_ids))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            UPDATE merchants_scores
+            SET sync_till_{platform} = NOW() + INTERVAL %s SECOND,
+                sync_till_grand = NOW() + INTERVAL %s SECOND
+            WHERE merchant_id IN ({placeholders})
+        """, (ttl, ttl, *merchant_ids))
+    finally:
+        cursor.close()
+
+
+class RescoreQueue:
+    """Deduplicating queue of merchants whose platform data changed.
+
+    Change events are keyed by (platform, merchant_id), so repeated
+    updates before a rescore collapse into one. ``concurrency`` workers
+    each take up to ``batch_size`` merchants of one platform that have
+    waited at least ``debounce`` seconds and hand them to ``handler``,
+    an ``async (platform, merchant_ids)`` callable. A merchant that
+    changes again while its batch is running is rescored once more
+    afterwards. Failed batches wait out an exponential backoff before
+    they are retried, and merchants that fail ``max_attempts`` times in a
+    row are dropped as dead letters.
+    """
+
+    def __init__(self, handler, batch_size=RESCORE_BATCH_SIZE, concurrency=RESCORE_CONCURRENCY,
+                 debounce=RESCORE_DEBOUNCE, retry_backoff=RESCORE_RETRY_BACKOFF, max_backoff=RESCORE_MAX_BACKOFF,
+                 max_attempts=RESCORE_MAX_ATTEMPTS):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.debounce = debounce
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self._pending = {}
+        self._retries = {}
+        self._attempts = {}
+        self._in_flight = set()
+        self._wakeup = None
+        self._workers = []
+        self._stopping = False
+        self.submitted = 0
+        self.deduplicated = 0
+        self.batches = 0
+        self.rescored = 0
+        self.errors = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.last_error = None
+        self.last_batch_s = None
+
+    def __len__(self):
+        return len(self._pending) + len(self._retries)
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        # Let running batches finish; changes still waiting are dropped
+        if not self._workers:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(*self._workers)
+        self._workers = []
+        if len(self):
+            print(f"⚠️ Rescore queue stopped with {len(self)} merchants not rescored")
+
+    def submit(self, platform, merchant_ids):
+        """Queue merchants for rescoring; returns how many were not already waiting."""
+        now = time.monotonic()
+        added = 0
+        for merchant_id in merchant_ids:
+            key = (platform, merchant_id)
+            # A merchant backing off after a failure is retried on its schedule
+            if key in self._pending or key in self._retries:
+                self.deduplicated += 1
+            else:
+                self._pending[key] = now
+                added += 1
+        self.submitted += len(merchant_ids)
+        if added and self._wakeup is not None:
+            self._wakeup.set()
+        return added
+
+    def _promote_retries(self, now):
+        # Retries whose backoff ran out are ready at once, so they go to the
+        # front: _take_batch stops at the first entry that isn't ready yet
+        promoted = {key: now - self.debounce for key, retry_at in self._retries.items() if retry_at <= now}
+        if promoted:
+            for key in promoted:
+                del self._retries[key]
+            self._pending = {**promoted, **self._pending}
+
+    def _take_batch(self):
+        # Oldest ready change picks the platform; the batch fills with that platform's ready merchants
+        now = time.monotonic()
+        self._promote_retries(now)
+        ready_before = now - self.debounce
+        platform = None
+        batch = []
+        for (key_platform, merchant_id), queued_at in self._pending.items():
+            if queued_at > ready_before:
+                break
+            if (key_platform, merchant_id) in self._in_flight:
+                continue
+            if platform is None:
+                platform = key_platform
+            if key_platform == platform:
+                batch.append(merchant_id)
+                if len(batch) == self.batch_size:
+                    break
+        for merchant_id in batch:
+            del self._pending[(platform, merchant_id)]
+            self._in_flight.add((platform, merchant_id))
+        return platform, batch
+
+    def _next_wait(self):
+        # Seconds until the oldest waiting change or the next retry is ready, None when nothing waits
+        now = time.monotonic()
+        ready_at = [queued_at + self.debounce for queued_at in list(self._pending.values())[:1]]
+        if self._retries:
+            # Never 0, which would mean "wait for a wakeup" to _work
+            ready_at.append(max(min(self._retries.values()), now + 0.001))
+        return max(0.0, min(ready_at) - now) if ready_at else None
+
+    async def _work(self):
+        while not self._stopping:
+            platform, batch = self._take_batch()
+            if not batch:
+                # Sleep until the oldest change is ready, or until a submit or a
+                # finished batch (which may release merchants held back as in flight)
+                self._wakeup.clear()
+                wait = self._next_wait()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait or None)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run_batch(platform, batch)
+
+    async def _run_batch(self, platform, batch):
+        start = time.perf_counter()
+        try:
+            rescored = await self.handler(platform, batch)
+        except Exception as e:
+            self._retry(platform, batch, e)
+        else:
+            for merchant_id in batch:
+                self._attempts.pop((platform, merchant_id), None)
+            self.batches += 1
+            self.rescored += rescored
+            self.last_batch_s = time.perf_counter() - start
+        finally:
+            self._in_flight.difference_update((platform, merchant_id) for merchant_id in batch)
+            self._wakeup.set()
+
+    def _retry(self, platform, batch, error):
+        self.errors += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        now = time.monotonic()
+        retried = dead = 0
+        for merchant_id in batch:
+            key = (platform, merchant_id)
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts >= self.max_attempts:
+                self._attempts.pop(key, None)
+                self._pending.pop(key, None)
+                dead += 1
+                continue
+            self._attempts[key] = attempts
+            # A newer change queued meanwhile is retried on the same schedule
+            self._pending.pop(key, None)
+            self._retries[key] = now + min(self.max_backoff, self.retry_backoff * 2 ** (attempts - 1))
+            retried += 1
+        self.retried += retried
+        self.dead_lettered += dead
+        print(f"⚠️ Rescoring {len(batch)} {platform} merchants failed "
+              f"({retried} to retry, {dead} dropped): {error}")
+
+    def stats(self):
+        return {
+            "enabled": bool(self._workers),
+            "depth": len(self._pending),
+            "retrying": len(self._retries),
+            "in_flight": len(self._in_flight),
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "debounce_seconds": self.debounce,
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "batches": self.batches,
+            "rescored": self.rescored,
+            "errors": self.errors,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "max_attempts": self.max_attempts,
+            "last_error": self.last_error,
+            "last_batch_ms": round(self.last_batch_s * 1000, 3) if self.last_batch_s is not None else None
+        }
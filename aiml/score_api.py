@@ -1,275 +1,838 @@
 from fastapi import FastAPI, HTTPException, Query
-import joblib
-import pandas as pd
-import mysql.connector
+from fastapi.responses import JSONResponse, PlainTextResponse
+import asyncio
+from contextlib import asynccontextmanager
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
 from datetime import datetime
 import uvicorn
 import os
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# DB config
-db_config = {
-    'host': os.getenv("DB_HOST"),
-    'user': os.getenv("DB_USER"),
-    'password': os.getenv("DB_PASSWORD"),
-    'database': os.getenv("DB_NAME"),
-    'ssl_disabled': True
-}
-
-app = FastAPI(root_path="/loyalty-engine-hackathon/aiml")
-
-# Load trained models
-shipway_loyalty_model = joblib.load("shipway-model.pkl")
-unicommerce_loyalty_model = joblib.load("unicommerce-model.pkl")
-convertway_loyalty_model = joblib.load("convertway-model.pkl")
-churn_model = joblib.load("merchant_churn_model.pkl")
-
-# Feature list
-LOYALTY_FEATURES = [
-    'order_count', 'billing_amount', 'margin_amount', 'complaint_count',
-    'returned_orders', 'undelivered_orders', 'services_amount',
-    'delayed_orders', 'average_resolution_tat', 'merchant_age_days',
-    'return_rate', 'margin_ratio', 'avg_loyalty_score', 'avg_churn_rate',
-    'loyalty_score_delta', 'history_months', 'wallet_share'
-]
-CHURN_FEATURES = [
-    'delayed_orders',
-    'complaint_count',
-    'average_resolution_tat',
-    'returned_orders',
-    'undelivered_orders',
-    'merchant_age_days',
-    'order_count',
-    'return_rate',
-    'margin_ratio',
-    'billing_amount',
-    'margin_amount',
-    'services_amount'
-]
-
-# Model map
-model_map = {
-    'shipway': shipway_loyalty_model,
-    'unicommerce': unicommerce_loyalty_model,
-    'convertway': convertway_loyalty_model
-}
+
+try:
+    from .db import DatabasePool, PoolTimeoutError
+    from .features import build_frame, derive_row
+    from .history_agg import read_history_features, read_history_row, record_history_scores
+    from .leaderboard import update_grand_board, update_platform_boards
+    from .merchant_index import MERCHANT_INDEX_REFRESH, MerchantIndex
+    from .metrics import REGISTRY, Gauge, TimingMiddleware, set_platform, stage
+    from .registry import MODEL_POLL_INTERVAL, ModelStore
+    from .rescore_queue import RESCORE_POLL_INTERVAL, RescoreQueue, changed_since, latest_partition, mark_synced
+    from .score_cache import ScoreCache
+    from .score_distribution import (GRAND_DISTRIBUTION, SCORE_DISTRIBUTION_REFRESH, ScoreDistributions, grand_badge,
+                                     lock_previous_scores, record_score_changes)
+    from .singleflight import SingleFlight, SingleFlightTimeout
+    from .startup import PROFILE
+    from .scoring import (GRAND_HISTORY_PERIOD, ensure_tables, load_latest_row, load_latest_rows, predict_row,
+                          platform_weight, score_rows, stored_grand_scores, write_grand_scores,
+                          write_platform_scores)
+    from .scoring import predict_scores as score_predictions
+    from .write_behind import WRITE_BEHIND, WriteBehindQueue
+except ImportError:  # started from inside aiml/ (python score_api.py)
+    from db import DatabasePool, PoolTimeoutError
+    from features import build_frame, derive_row
+    from history_agg import read_history_features, read_history_row, record_history_scores
+    from leaderboard import update_grand_board, update_platform_boards
+    from merchant_index import MERCHANT_INDEX_REFRESH, MerchantIndex
+    from metrics import REGISTRY, Gauge, TimingMiddleware, set_platform, stage
+    from registry import MODEL_POLL_INTERVAL, ModelStore
+    from rescore_queue import RESCORE_POLL_INTERVAL, RescoreQueue, changed_since, latest_partition, mark_synced
+    from score_cache import ScoreCache
+    from score_distribution import (GRAND_DISTRIBUTION, SCORE_DISTRIBUTION_REFRESH, ScoreDistributions, grand_badge,
+                                    lock_previous_scores, record_score_changes)
+    from singleflight import SingleFlight, SingleFlightTimeout
+    from startup import PROFILE
+    from scoring import (GRAND_HISTORY_PERIOD, ensure_tables, load_latest_row, load_latest_rows, predict_row,
+                         platform_weight, score_rows, stored_grand_scores, write_grand_scores,
+                         write_platform_scores)
+    from scoring import predict_scores as score_predictions
+    from write_behind import WRITE_BEHIND, WriteBehindQueue
+
+PROFILE.mark("imported")
+
+# Connection pool kept for the lifetime of the app
+db_pool = DatabasePool()
+
+# Models per platform, loaded on first use from the model registry (or the
+# legacy pickles in the working directory) and hot-swapped when a new
+# version is published
+model_store = ModelStore()
+
+# Score and history upserts, written behind the response when WRITE_BEHIND=1
+write_queue = WriteBehindQueue(db_pool)
+
+# Email/merchant_id -> platform flags and multipliers, warmed at startup
+merchant_index = MerchantIndex()
+
+# Merchants per score bucket for each platform and the grand score, behind
+# percentile ranks and grand badges
+score_distributions = ScoreDistributions()
+
+
+async def poll_models():
+    while True:
+        await asyncio.sleep(MODEL_POLL_INTERVAL)
+        await run_in_threadpool(model_store.refresh)
+
+
+async def poll_merchants():
+    # Merchants whose updated_on moved are reloaded into the index
+    while True:
+        await asyncio.sleep(MERCHANT_INDEX_REFRESH)
+        try:
+            async with db_pool.connection() as conn:
+                await run_in_threadpool(merchant_index.refresh, conn)
+        except Exception as e:
+            print(f"⚠️ Refreshing the merchant index failed: {e}")
+
+
+async def warm_merchant_index():
+    try:
+        async with db_pool.connection() as conn:
+            count = await run_in_threadpool(merchant_index.warm, conn)
+        print(f"✅ Merchant index warmed with {count} merchants")
+        return True
+    except Exception as e:
+        # Lookups still work, they just start cold
+        print(f"⚠️ Warming the merchant index failed: {e}")
+        return False
+
+
+async def refresh_score_distributions():
+    try:
+        async with db_pool.connection() as conn:
+            await run_in_threadpool(score_distributions.refresh, conn)
+        return True
+    except Exception as e:
+        # Ranks stay as they were, or absent and with fixed badge cutoffs until the first load
+        print(f"⚠️ Loading the score distributions failed: {e}")
+        return False
+
+
+async def poll_score_distributions():
+    while True:
+        await asyncio.sleep(SCORE_DISTRIBUTION_REFRESH)
+        await refresh_score_distributions()
+
+
+async def poll_changes():
+    # Merchants in new till_date partitions of data_* are queued for rescoring
+    watermarks = {}
+    while True:
+        try:
+            async with db_pool.connection() as conn:
+                for platform in model_store:
+                    if platform not in watermarks:
+                        watermarks[platform] = await run_in_threadpool(latest_partition, conn, platform)
+                        continue
+                    merchant_ids, watermarks[platform] = await run_in_threadpool(
+                        changed_since, conn, platform, watermarks[platform])
+                    if merchant_ids:
+                        queue_rescore(platform, merchant_ids)
+        except Exception as e:
+            print(f"⚠️ Polling data_* for changes failed: {e}")
+        await asyncio.sleep(RESCORE_POLL_INTERVAL)
+
+
+async def warm_models():
+    # Loading a platform runs each model once, so the first request doesn't pay for it
+    try:
+        for platform in model_store:
+            with PROFILE.phase(f"models.{platform}"):
+                await run_in_threadpool(model_store.get, platform)
+        return True
+    except Exception as e:
+        PROFILE.set_state("failed", e)
+        print(f"⚠️ Warming the models failed: {e}")
+        return False
+
+
+async def warm_step(name, warm):
+    # One background warm-up step, listed under "warmups" by /readyz
+    PROFILE.set_warmup(name, "warming")
+    with PROFILE.phase(name):
+        done = await warm()
+    PROFILE.set_warmup(name, "done" if done else "failed")
+    return done
+
+
+async def warm_up():
+    """Load the models, merchant index and score distributions side by side.
+
+    /readyz answers 503 until all three have finished. Only the models are
+    required: without the index or the distributions requests are served
+    cold, so their failure is reported but doesn't block readiness.
+    """
+    PROFILE.set_state("warming")
+    models, _, _ = await asyncio.gather(
+        warm_step("models", warm_models),
+        warm_step("merchant_index", warm_merchant_index),
+        warm_step("score_distributions", refresh_score_distributions)
+    )
+    if models:
+        PROFILE.set_state("ready")
+        print(f"✅ Ready {PROFILE.marks['ready']}s after process start")
+
+
+async def prepare_tables():
+    # Score writes keep these tables in step, so they must exist before the first request
+    try:
+        async with db_pool.connection() as conn:
+            for table in await run_in_threadpool(ensure_tables, conn):
+                print(f"✅ Created and backfilled {table}")
+    except Exception as e:
+        print(f"⚠️ Preparing the derived score tables failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    PROFILE.set_state("loading")
+    with PROFILE.phase("db_pool"):
+        await run_in_threadpool(db_pool.open)
+    with PROFILE.phase("schema"):
+        await prepare_tables()
+    # Warm-up runs in the background; /readyz answers 503 until it is done
+    warmup = asyncio.create_task(warm_up())
+    poller = asyncio.create_task(poll_models()) if MODEL_POLL_INTERVAL > 0 else None
+    change_poller = asyncio.create_task(poll_changes()) if RESCORE_POLL_INTERVAL > 0 else None
+    merchant_poller = asyncio.create_task(poll_merchants()) if MERCHANT_INDEX_REFRESH > 0 else None
+    distribution_poller = (asyncio.create_task(poll_score_distributions())
+                           if SCORE_DISTRIBUTION_REFRESH > 0 else None)
+    if WRITE_BEHIND:
+        write_queue.start()
+    rescore_queue.start()
+    yield
+    for task in (warmup, poller, change_poller, merchant_poller, distribution_poller):
+        if task is not None:
+            task.cancel()
+    # Finish running rescores and drain queued writes while the pool is still open
+    await rescore_queue.stop()
+    await write_queue.stop()
+    await run_in_threadpool(db_pool.close)
+
+
+app = FastAPI(root_path="/loyalty-engine-hackathon/aiml", lifespan=lifespan)
+
+# Computed scores keyed by (merchant_id, platform, till_date, model version)
+score_cache = ScoreCache()
+
+# In-flight /loyalty-score and /loyalty-score/multi-platform computations, by (email, platform) and email
+score_flights = SingleFlight("/loyalty-score")
+multi_platform_flights = SingleFlight("/loyalty-score/multi-platform")
+
+# Upper bound on merchants scored by one batch request
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 5000))
+
+# Request latency and stage breakdowns for the scoring endpoints
+app.add_middleware(TimingMiddleware, paths=[
+    "/loyalty-score", "/loyalty-score/batch", "/loyalty-score/multi-platform"
+])
+
+# Pool, cache and model state, read when /metrics is scraped
+REGISTRY.register(Gauge("aiml_db_pool_size", "Connections in the pool.", lambda: db_pool.size))
+REGISTRY.register(Gauge("aiml_db_pool_in_use", "Connections checked out.", lambda: db_pool.in_use))
+REGISTRY.register(Gauge("aiml_score_cache_entries", "Entries in the score cache.", lambda: len(score_cache)))
+REGISTRY.register(Gauge("aiml_score_cache_hits_total", "Score cache hits.",
+                        lambda: score_cache.hits, kind="counter"))
+REGISTRY.register(Gauge("aiml_score_cache_misses_total", "Score cache misses.",
+                        lambda: score_cache.misses, kind="counter"))
+REGISTRY.register(Gauge("aiml_score_cache_evictions_total", "Score cache LRU evictions.",
+                        lambda: score_cache.evictions, kind="counter"))
+REGISTRY.register(Gauge("aiml_write_behind_depth", "Writes waiting for the next flush.", lambda: len(write_queue)))
+REGISTRY.register(Gauge("aiml_write_behind_coalesced_total", "Queued writes replaced by a newer value.",
+                        lambda: write_queue.coalesced, kind="counter"))
+REGISTRY.register(Gauge("aiml_write_behind_flush_errors_total", "Write-behind flushes that failed.",
+                        lambda: write_queue.errors, kind="counter"))
+REGISTRY.register(Gauge("aiml_write_behind_dead_lettered_total", "Queued writes dropped after repeated flush failures.",
+                        lambda: write_queue.dead_lettered, kind="counter"))
+REGISTRY.register(Gauge("aiml_singleflight_in_flight", "Coalescable computations running.",
+                        lambda: {(f.endpoint,): len(f) for f in (score_flights, multi_platform_flights)},
+                        labelnames=("endpoint",)))
+REGISTRY.register(Gauge("aiml_merchant_index_entries", "Merchants in the email index.", lambda: len(merchant_index)))
+REGISTRY.register(Gauge("aiml_merchant_index_hits_total", "Merchant lookups served from the index.",
+                        lambda: merchant_index.hits, kind="counter"))
+REGISTRY.register(Gauge("aiml_merchant_index_misses_total", "Merchant lookups that queried the DB.",
+                        lambda: merchant_index.misses, kind="counter"))
+REGISTRY.register(Gauge("aiml_score_distribution_merchants", "Merchants ranked in each score distribution.",
+                        lambda: {(d,): score_distributions.count(d) for d in list(model_store) + [GRAND_DISTRIBUTION]},
+                        labelnames=("distribution",)))
+REGISTRY.register(Gauge("aiml_rescore_queue_depth", "Merchants waiting for a background rescore.",
+                        lambda: len(rescore_queue)))
+REGISTRY.register(Gauge("aiml_rescore_deduplicated_total", "Change events for merchants already queued.",
+                        lambda: rescore_queue.deduplicated, kind="counter"))
+REGISTRY.register(Gauge("aiml_rescored_merchants_total", "Merchants rescored in the background.",
+                        lambda: rescore_queue.rescored, kind="counter"))
+REGISTRY.register(Gauge("aiml_rescore_errors_total", "Background rescore batches that failed.",
+                        lambda: rescore_queue.errors, kind="counter"))
+REGISTRY.register(Gauge("aiml_rescore_dead_lettered_total", "Merchants dropped after repeated rescore failures.",
+                        lambda: rescore_queue.dead_lettered, kind="counter"))
+REGISTRY.register(Gauge("aiml_model_swaps_total", "Model versions hot-swapped in.",
+                        lambda: model_store.swaps, kind="counter"))
+REGISTRY.register(Gauge("aiml_model_info", "Model version serving each platform.",
+                        lambda: {(p, model_store.version(p)): 1 for p in model_store},
+                        labelnames=("platform", "version")))
+REGISTRY.register(Gauge("aiml_ready", "1 once warm-up is done and /readyz passes.",
+                        lambda: int(PROFILE.ready)))
+REGISTRY.register(Gauge("aiml_startup_phase_seconds", "Time spent in each start-up phase.",
+                        lambda: {(name,): seconds for name, seconds in PROFILE.as_dict()["phases"].items()},
+                        labelnames=("phase",)))
+
+
+class BatchScoreRequest(BaseModel):
+    platform: str
+    emails: Optional[List[str]] = None
+    merchant_ids: Optional[List[int]] = None
+
+
+class CacheInvalidationRequest(BaseModel):
+    merchant_id: Optional[int] = None
+    platform: Optional[str] = None
+
+
+class MerchantInvalidationRequest(BaseModel):
+    merchant_id: Optional[int] = None
+
+
+class DataChangeEvent(BaseModel):
+    platform: str
+    merchant_id: Optional[int] = None
+    merchant_ids: Optional[List[int]] = None
+
+
+def grand_badge_for(grand_loyalty_score):
+    return grand_badge(score_distributions, grand_loyalty_score)
+
+
+@asynccontextmanager
+async def db_connection():
+    try:
+        async with db_pool.connection() as conn:
+            yield conn
+    except HTTPException:
+        raise
+    except PoolTimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+
+
+async def coalesce(flight, key, fn):
+    # Identical concurrent requests share one computation
+    try:
+        return await flight.run(key, fn)
+    except SingleFlightTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+
+async def run_db_handler(handler, *args):
+    # Blocking DB and model work runs in the threadpool on a pooled connection
+    async with db_connection() as conn:
+        return await run_in_threadpool(handler, conn, *args)
+
+
+def build_feature_frame(conn, platform, df, df_hist=None):
+    # Historical aggregates and derived features, shared with training
+    if df_hist is None:
+        with stage("history", platform):
+            df_hist = read_history_features(conn, [platform], df['merchant_id'].tolist())
+    with stage("features", platform):
+        return build_frame(df, platform, df_hist)
+
+
+def cache_key(merchant_id, platform, till_date, version):
+    return (merchant_id, platform, till_date, version)
+
+
+def grand_cache_key(merchant_id, till_dates, versions):
+    return (merchant_id, 'grand', tuple(sorted(till_dates.items())),
+            tuple(versions[p] for p in sorted(till_dates)))
+
+
+def predict_scores(platform, merged_df):
+    # One lookup, so both predictions come from the same model version
+    with stage("model_load", platform):
+        models = model_store.get(platform)
+    with stage("predict", platform):
+        scores, churn_rates = score_predictions(models.loyalty, models.churn, platform, merged_df)
+    return scores, churn_rates, models.version
+
+
+def score_result(email, merchant_id, platform, score, churn_rate, multiplier, model_version):
+    weighted_score = score * platform_weight(multiplier)
+    return {
+        "email": email,
+        "merchant_id": merchant_id,
+        "platform": platform,
+        "loyalty_score": round(score, 2),
+        "merchant_churn_rate": round(churn_rate, 2),
+        "weighted_score": round(weighted_score, 2),
+        "percentile": score_distributions.percentile(platform, score),
+        "model_version": model_version
+    }
+
+
+def score_frame(conn, platform, df):
+    """Score the latest rows in ``df``, serving cached scores where possible.
+
+    Only cache misses go through feature engineering, prediction and the
+    upserts. Returns ``{merchant_id: (score, churn_rate, model_version)}``.
+    """
+    scored = {}
+    missed = []
+    with stage("cache", platform):
+        version = model_store.version(platform)
+        for i, (merchant_id, till_date) in enumerate(zip(df['merchant_id'].tolist(), df['till_date'])):
+            cached = score_cache.get(cache_key(merchant_id, platform, till_date, version))
+            if cached is None:
+                missed.append(i)
+            else:
+                scored[merchant_id] = (*cached, version)
+
+    if missed:
+        merged_df = build_feature_frame(conn, platform, df.iloc[missed].reset_index(drop=True))
+
+        # One predict over the whole feature matrix per model
+        scores, churn_rates, version = predict_scores(platform, merged_df)
+        rows = score_rows(merged_df, scores, churn_rates)
+        save_scores(conn, platform, rows, version)
+
+        for merchant_id, _, _, score, churn_rate in rows:
+            scored[merchant_id] = (score, churn_rate, version)
+
+    return scored
+
+
+def save_scores(conn, platform, rows, version):
+    # Upsert (or queue) freshly computed platform scores and cache them
+    with stage("upsert", platform):
+        if not write_queue.put({platform: rows}):
+            write_platform_scores(conn, platform, rows)
+            conn.commit()
+
+    for merchant_id, _, till_date, score, churn_rate in rows:
+        score_cache.put(cache_key(merchant_id, platform, till_date, version), (score, churn_rate))
+
+
+def score_row(conn, platform, merchant_id, till_date, row):
+    """``score_frame`` for one merchant, on plain values instead of frames.
+
+    Same cache, features and upserts; the history aggregates come from a
+    single-row query and the features go straight into a reused buffer.
+    """
+    with stage("cache", platform):
+        version = model_store.version(platform)
+        cached = score_cache.get(cache_key(merchant_id, platform, till_date, version))
+    if cached is not None:
+        return (*cached, version)
+
+    with stage("history", platform):
+        row.update(read_history_row(conn, platform, merchant_id))
+    with stage("features", platform):
+        values = derive_row(row, platform)
+    with stage("model_load", platform):
+        models = model_store.get(platform)
+    with stage("predict", platform):
+        score, churn_rate = predict_row(models.loyalty, models.churn, platform, values)
+
+    save_scores(conn, platform, [(merchant_id, till_date.replace(day=1), till_date, score, churn_rate)],
+                models.version)
+    return score, churn_rate, models.version
+
+
+def score_merchant(conn, email, platform):
+    with stage("merchant_lookup", platform):
+        merchant = merchant_index.get(conn, email)
+
+    if not merchant:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+
+    merchant_id = merchant['merchant_id']
+    with stage("latest_rows", platform):
+        latest = load_latest_row(conn, platform, merchant_id)
+
+    if latest is None:
+        raise HTTPException(status_code=404, detail="No data found for platform")
+
+    score, churn_rate, version = score_row(conn, platform, merchant_id, *latest)
+    return score_result(email, merchant_id, platform, score, churn_rate, merchant[f'multiplier_{platform}'], version)
 
 
 @app.get("/loyalty-score")
-def get_loyalty_score_by_integration(
+async def get_loyalty_score_by_integration(
     email: str = Query(...),
     platform: str = Query(...)
 ):
     platform = platform.lower()
+    # Stripped once, so the flight key and the merchant lookup see the same email
+    email = email.strip()
 
-    if platform not in model_map:
+    if platform not in model_store:
         raise HTTPException(status_code=400, detail="Invalid platform.")
+    set_platform(platform)
 
-    try:
-        conn = mysql.connector.connect(**db_config)
-        cursor = conn.cursor(dictionary=True)
-
-        # Get merchant data
-        cursor.execute(f"""
-            SELECT merchant_id, is_{platform}, multiplier_{platform}
-            FROM merchants
-            WHERE email = %s
-        """, (email,))
-        merchant = cursor.fetchone()
-
-        if not merchant:
-            raise HTTPException(status_code=404, detail="Merchant not found")
-
-        # Read latest transaction data
-        df = pd.read_sql(f"""
-            SELECT s.*, m.is_{platform}
-            FROM data_{platform} s
-            JOIN merchants m ON m.merchant_id = s.merchant_id
-            WHERE m.email = %s
-            ORDER BY s.till_date DESC LIMIT 1
-        """, conn, params=(email,))
+    # Emails match case-insensitively, so differently cased requests share a flight
+    return await coalesce(score_flights, (email.lower(), platform),
+                          lambda: run_db_handler(score_merchant, email, platform))
 
-        if df.empty:
-            raise HTTPException(status_code=404, detail="No data found for platform")
-
-        # Load historical data for derived features
-        query_hist = """
-            SELECT
-                merchant_id,
-                AVG(loyalty_score_shipway) AS avg_loyalty_score,
-                AVG(churn_rate_shipway) AS avg_churn_rate,
-                MAX(loyalty_score_shipway) - MIN(loyalty_score_shipway) AS loyalty_score_delta,
-                COUNT(*) AS history_months
-            FROM merchants_scores_history
-            GROUP BY merchant_id
-        """
-        df_hist = pd.read_sql(query_hist, conn)
-        merged_df = pd.merge(df, df_hist, on="merchant_id", how="left")
-
-        # Feature engineering
-        merged_df['from_date'] = pd.to_datetime(merged_df['from_date'])
-        merged_df['merchant_age_days'] = (pd.Timestamp.now() - merged_df['from_date']).dt.days
-        merged_df['return_rate'] = merged_df['undelivered_orders'] / merged_df['order_count'].replace(0, 1)
-        merged_df['margin_ratio'] = merged_df['margin_amount'] / merged_df['billing_amount'].replace(0, 1)
-
-        raw_data = merged_df.to_dict(orient="records")
-
-        # Predictions
-        model = model_map[platform]
-        score = round(model.predict(merged_df[LOYALTY_FEATURES])[0],2)
-        churn_rate = round(churn_model.predict(merged_df[CHURN_FEATURES])[0],2)
-
-        weighted_score = score * merchant[f'multiplier_{platform}']
-
-        # Prepare insert data
-        merchant_id = merged_df.at[0, 'merchant_id']
-        till_date = pd.to_datetime(merged_df.at[0, 'till_date']).date()
-        from_date = till_date.replace(day=1)
-
-        # return {"raw_data": merchant_id}
-
-        # Column names
-        loyalty_col = f"loyalty_score_{platform}"
-        churn_col = f"churn_rate_{platform}"
-        sync_col = f"sync_till_{platform}"
-
-        # Insert/Update current score
-        upsert_query = f"""
-            INSERT INTO merchants_scores (
-                merchant_id, {loyalty_col}, {churn_col}, updated_on
-            ) VALUES (%s, %s, %s, NOW())
-            ON DUPLICATE KEY UPDATE
-                {loyalty_col} = VALUES({loyalty_col}),
-                {churn_col} = VALUES({churn_col}),
-                updated_on = NOW()
-        """
-        cursor.execute(upsert_query, (merchant_id, float(score), float(churn_rate)))
-
-        # Insert/Update history
-        history_query = f"""
-            INSERT INTO merchants_scores_history (
-                merchant_id, from_date, till_date, {loyalty_col}, {churn_col}, added_on
-            ) VALUES (%s, %s, %s, %s, %s, NOW())
-            ON DUPLICATE KEY UPDATE
-                till_date = VALUES(till_date),
-                {loyalty_col} = VALUES({loyalty_col}),
-                {churn_col} = VALUES({churn_col}),
-                updated_on = NOW()
-        """
-        cursor.execute(history_query, (merchant_id, from_date, till_date, float(score), float(churn_rate)))
 
-        conn.commit()
+def score_merchants_batch(conn, platform, key_col, keys):
+    with stage("merchant_lookup", platform):
+        # Resolve all requested merchants at once; only index misses hit the DB
+        merchants = merchant_index.get_many(conn, key_col, keys)
 
-        return {
-            "email": email,
-            "merchant_id": merchant_id,
-            "platform": platform,
-            "loyalty_score": round(float(score), 2),
-            "merchant_churn_rate": round(float(churn_rate), 2),
-            "weighted_score": round(float(weighted_score), 2)
-        }
+    merchant_ids = [row['merchant_id'] for row in merchants.values()]
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
-    finally:
-        cursor.close()
-        conn.close()
+    results = {}
+    for key in keys:
+        if key not in merchants:
+            results[key] = {key_col: key, "error": "Merchant not found"}
 
+    scored = {}
+    if merchant_ids:
+        with stage("latest_rows", platform):
+            df = load_latest_rows(conn, platform, merchant_ids)
+        if not df.empty:
+            scored = score_frame(conn, platform, df)
 
-@app.get("/loyalty-score/multi-platform")
-def get_loyalty_scores_for_all_platforms(email: str = Query(...)):
-    platforms = ['shipway', 'unicommerce', 'convertway']
-    results = []
+    for key, merchant in merchants.items():
+        merchant_id = merchant['merchant_id']
+        if merchant_id not in scored:
+            results[key] = {key_col: key, "merchant_id": merchant_id, "error": "No data found for platform"}
+            continue
 
-    try:
-        conn = mysql.connector.connect(**db_config)
-        cursor = conn.cursor(dictionary=True)
+        score, churn_rate, version = scored[merchant_id]
+        results[key] = score_result(merchant['email'], merchant_id, platform, score, churn_rate,
+                                    merchant[f'multiplier_{platform}'], version)
 
-        total_weighted_score = 0
-        platform_count = 0
-        merchant_id = ""
+    return {
+        "platform": platform,
+        "count": len(keys),
+        "results": [results[key] for key in keys]
+    }
 
-        for platform in platforms:
-            cursor.execute(f"""
-                SELECT merchant_id, multiplier_{platform}
-                FROM merchants
-                WHERE email = %s AND is_{platform} = '1'
-            """, (email,))
-            row = cursor.fetchone()
-            if row:
-                try:
-                    score_data = get_loyalty_score_by_integration(email=email, platform=platform)
-                    multiplier = row.get(f"multiplier_{platform}", 1)
-                    merchant_id = row.get("merchant_id", 0)
-                    weighted_score = score_data['loyalty_score'] * multiplier
-
-                    results.append(score_data)
-                    total_weighted_score += weighted_score
-                    platform_count += 1
-
-                except HTTPException as he:
-                    if he.status_code != 404:
-                        raise he
-
-        if not results:
-            raise HTTPException(status_code=404, detail="Merchant not found on any platform or no data.")
-
-        grand_loyalty_score = round(total_weighted_score / platform_count, 2) if platform_count > 0 else 0
-        grand_badge = None
-        if grand_loyalty_score >= 50:
-            grand_badge = 'platinum'
-        elif grand_loyalty_score >= 20:
-            grand_badge = 'gold'
-        elif grand_loyalty_score >= 10:
-            grand_badge = 'silver'
-
-        # Insert/Update current score
-        upsert_query = """
-            INSERT INTO merchants_scores (
-                merchant_id, grand_score, grand_badge, updated_on
-            ) VALUES (%s, %s, %s, NOW())
-            ON DUPLICATE KEY UPDATE
-                grand_score = VALUES(grand_score),
-                grand_badge = VALUES(grand_badge),
-                updated_on = NOW()
-        """
-        cursor.execute(upsert_query, (merchant_id, float(grand_loyalty_score), grand_badge))
-
-        till_date = "2025-05-31"
-        from_date = "2025-05-01"
-        # Insert/Update history
-        history_query = f"""
-            INSERT INTO merchants_scores_history (
-                merchant_id, from_date, till_date, grand_score, grand_badge, added_on
-            ) VALUES (%s, %s, %s, %s, %s, NOW())
-            ON DUPLICATE KEY UPDATE
-                till_date = VALUES(till_date),
-                grand_score = VALUES(grand_score),
-                grand_badge = VALUES(grand_badge),
-                updated_on = NOW()
-        """
-        cursor.execute(history_query, (merchant_id, from_date, till_date, float(grand_loyalty_score), grand_badge))
 
-        conn.commit()
+@app.post("/loyalty-score/batch")
+async def get_loyalty_scores_batch(payload: BatchScoreRequest):
+    platform = payload.platform.lower()
 
-        return {
-            "email": email,
-            "platform_scores": results,
-            "grand_loyalty_score": grand_loyalty_score,
-            "grand_badge": grand_badge
-        }
+    if platform not in model_store:
+        raise HTTPException(status_code=400, detail="Invalid platform.")
+    if bool(payload.emails) == bool(payload.merchant_ids):
+        raise HTTPException(status_code=400, detail="Provide either emails or merchant_ids.")
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
-    finally:
+    key_col = 'email' if payload.emails else 'merchant_id'
+    keys = list(dict.fromkeys(payload.emails or payload.merchant_ids))
+
+    if len(keys) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_SIZE} merchants per batch.")
+    set_platform(platform)
+
+    return await run_db_handler(score_merchants_batch, platform, key_col, keys)
+
+
+def load_all_platforms(conn, email):
+    platforms = list(model_store)
+
+    # One merchant lookup covering every platform
+    with stage("merchant_lookup"):
+        merchant = merchant_index.get(conn, email)
+
+    if not merchant:
+        raise HTTPException(status_code=404, detail="Merchant not found on any platform or no data.")
+
+    merchant_id = merchant['merchant_id']
+    till_dates = {}
+    cached = {}
+    latest = {}
+    for platform in platforms:
+        if not merchant[f'on_{platform}']:
+            continue
+        with stage("latest_rows", platform):
+            df = load_latest_rows(conn, platform, [merchant_id])
+        if df.empty:
+            continue
+
+        till_dates[platform] = df.at[0, 'till_date']
+        version = model_store.version(platform)
+        hit = score_cache.get(cache_key(merchant_id, platform, till_dates[platform], version))
+        if hit is None:
+            latest[platform] = df
+        else:
+            cached[platform] = (*hit, version)
+
+    if not till_dates:
+        raise HTTPException(status_code=404, detail="Merchant not found on any platform or no data.")
+
+    # History aggregates for every platform that needs a prediction, in one read
+    frames = {}
+    if latest:
+        with stage("history"):
+            df_hist = read_history_features(conn, list(latest), [merchant_id])
+        for platform, df in latest.items():
+            frames[platform] = build_feature_frame(conn, platform, df, df_hist[df_hist['platform'] == platform])
+
+    return merchant, till_dates, cached, frames
+
+
+def write_grand_and_platform_scores(conn, merchant_id, platform_rows, grand_loyalty_score, grand_badge):
+    # Platform scores and the grand score land in one merchants_scores upsert
+    columns = []
+    values = []
+    for platform, rows in platform_rows.items():
+        columns += [f"loyalty_score_{platform}", f"churn_rate_{platform}"]
+        values += [rows[0][3], rows[0][4]]
+    columns += ["grand_score", "grand_badge"]
+    values += [float(grand_loyalty_score), grand_badge]
+
+    with stage("upsert"):
+        previous = lock_previous_scores(conn, [*platform_rows, GRAND_DISTRIBUTION], [merchant_id])
+        cursor = conn.cursor()
         try:
+            cursor.execute(f"""
+                INSERT INTO merchants_scores (
+                    merchant_id, {", ".join(columns)}, updated_on
+                ) VALUES (%s, {", ".join(["%s"] * len(columns))}, NOW())
+                ON DUPLICATE KEY UPDATE
+                    {", ".join(f"{col} = VALUES({col})" for col in columns)},
+                    updated_on = NOW()
+            """, (merchant_id, *values))
+
+            for platform, rows in platform_rows.items():
+                record_history_scores(conn, platform, rows)
+                record_score_changes(conn, platform, previous[platform], {merchant_id: rows[0][3]})
+                update_platform_boards(conn, platform, rows)
+
+            from_date, till_date = GRAND_HISTORY_PERIOD
+            # Insert/Update history
+            history_query = f"""
+                INSERT INTO merchants_scores_history (
+                    merchant_id, from_date, till_date, grand_score, grand_badge, added_on
+                ) VALUES (%s, %s, %s, %s, %s, NOW())
+                ON DUPLICATE KEY UPDATE
+                    till_date = VALUES(till_date),
+                    grand_score = VALUES(grand_score),
+                    grand_badge = VALUES(grand_badge),
+                    updated_on = NOW()
+            """
+            cursor.execute(history_query, (merchant_id, from_date, till_date, float(grand_loyalty_score), grand_badge))
+            record_score_changes(conn, GRAND_DISTRIBUTION, previous[GRAND_DISTRIBUTION],
+                                 {merchant_id: float(grand_loyalty_score)})
+            update_grand_board(conn, [(merchant_id, float(grand_loyalty_score), grand_badge)])
+
+            # Everything above commits as one transaction
+            conn.commit()
+        finally:
             cursor.close()
-            conn.close()
-        except:
-            pass
+
+
+def write_all_platforms(conn, email, merchant, till_dates, cached, frames, predictions):
+    merchant_id = merchant['merchant_id']
+    results = []
+    platform_rows = {}
+    versions = {}
+    total_weighted_score = 0
+
+    for platform in till_dates:
+        if platform in cached:
+            score, churn_rate, version = cached[platform]
+        else:
+            scores, churn_rates, version = predictions[platform]
+            rows = score_rows(frames[platform], scores, churn_rates)
+            platform_rows[platform] = rows
+            _, _, _, score, churn_rate = rows[0]
+        versions[platform] = version
+
+        multiplier = merchant[f'multiplier_{platform}']
+        result = score_result(email, merchant_id, platform, score, churn_rate, multiplier, version)
+        results.append(result)
+        total_weighted_score += result['loyalty_score'] * platform_weight(multiplier)
+
+    grand_loyalty_score = round(total_weighted_score / len(results), 2)
+    grand_badge = grand_badge_for(grand_loyalty_score)
+
+    # Nothing to write when every platform score and the grand score were cached
+    grand_key = grand_cache_key(merchant_id, till_dates, versions)
+    if platform_rows or score_cache.get(grand_key) != (grand_loyalty_score, grand_badge):
+        with stage("upsert"):
+            queued = write_queue.put(platform_rows, (merchant_id, float(grand_loyalty_score), grand_badge))
+        if not queued:
+            write_grand_and_platform_scores(conn, merchant_id, platform_rows, grand_loyalty_score, grand_badge)
+
+        for platform, rows in platform_rows.items():
+            _, _, till_date, score, churn_rate = rows[0]
+            score_cache.put(cache_key(merchant_id, platform, till_date, versions[platform]), (score, churn_rate))
+        score_cache.put(grand_key, (grand_loyalty_score, grand_badge))
+
+    return {
+        "email": email,
+        "platform_scores": results,
+        "grand_loyalty_score": grand_loyalty_score,
+        "grand_percentile": score_distributions.percentile(GRAND_DISTRIBUTION, grand_loyalty_score),
+        "grand_badge": grand_badge
+    }
+
+
+async def score_all_platforms(email):
+    async with db_connection() as conn:
+        merchant, till_dates, cached, frames = await run_in_threadpool(load_all_platforms, conn, email)
+
+        # Evaluate the platform models concurrently
+        predictions = await asyncio.gather(*(
+            run_in_threadpool(predict_scores, platform, merged_df)
+            for platform, merged_df in frames.items()
+        ))
+
+        return await run_in_threadpool(
+            write_all_platforms, conn, email, merchant, till_dates, cached, frames, dict(zip(frames, predictions))
+        )
+
+
+@app.get("/loyalty-score/multi-platform")
+async def get_loyalty_scores_for_all_platforms(email: str = Query(...)):
+    # Stripped once, so the flight key and the merchant lookup see the same email
+    email = email.strip()
+    return await coalesce(multi_platform_flights, email.lower(), lambda: score_all_platforms(email))
+
+
+def invalidate_merchant(merchant_id, platform=None):
+    invalidated = score_cache.invalidate(merchant_id, platform)
+    if platform is not None:
+        # The grand score depends on every platform's data
+        invalidated += score_cache.invalidate(merchant_id, 'grand')
+    return invalidated
+
+
+def rescore_changed(conn, platform, merchant_ids):
+    """Rescore merchants whose platform data changed, and their grand scores.
+
+    Runs on the rescore queue's workers, off the request path. Scores are
+    written in one transaction and marked synced, so the dashboards read
+    them from merchants_scores instead of calling this API.
+    """
+    try:
+        df = load_latest_rows(conn, platform, merchant_ids)
+        if df.empty:
+            return 0
+        merged_df = build_feature_frame(conn, platform, df)
+        scores, churn_rates, version = predict_scores(platform, merged_df)
+        rows = score_rows(merged_df, scores, churn_rates)
+
+        write_platform_scores(conn, platform, rows)
+        scored = [row[0] for row in rows]
+        write_grand_scores(conn, stored_grand_scores(conn, list(model_store), scored, score_distributions))
+        mark_synced(conn, platform, scored)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    for merchant_id, _, till_date, score, churn_rate in rows:
+        score_cache.put(cache_key(merchant_id, platform, till_date, version), (score, churn_rate))
+    return len(rows)
+
+
+async def rescore_batch(platform, merchant_ids):
+    # Queued and in-flight request writes commit first, so they cannot overwrite
+    # the fresh scores; if they can't be written the batch fails and is retried
+    await write_queue.flush(raise_errors=True)
+    async with db_pool.connection() as conn:
+        return await run_in_threadpool(rescore_changed, conn, platform, merchant_ids)
+
+
+# Merchants waiting for a background rescore after their data changed
+rescore_queue = RescoreQueue(rescore_batch)
+
+
+def queue_rescore(platform, merchant_ids):
+    # Cached scores are stale from now on; the queue recomputes and stores them
+    for merchant_id in merchant_ids:
+        invalidate_merchant(merchant_id, platform)
+    return rescore_queue.submit(platform, merchant_ids)
+
+
+@app.post("/cache/invalidate")
+async def invalidate_score_cache(payload: CacheInvalidationRequest):
+    if payload.merchant_id is None:
+        return {"invalidated": score_cache.clear()}
+
+    platform = payload.platform.lower() if payload.platform else None
+    if platform is not None and platform not in model_store:
+        raise HTTPException(status_code=400, detail="Invalid platform.")
+
+    return {"invalidated": invalidate_merchant(payload.merchant_id, platform)}
+
+
+@app.post("/events/data-changed")
+async def data_changed(payload: DataChangeEvent):
+    platform = payload.platform.lower()
+    if platform not in model_store:
+        raise HTTPException(status_code=400, detail="Invalid platform.")
+    merchant_ids = list(dict.fromkeys(([payload.merchant_id] if payload.merchant_id is not None else [])
+                                      + (payload.merchant_ids or [])))
+    if not merchant_ids:
+        raise HTTPException(status_code=400, detail="Provide merchant_id or merchant_ids.")
+
+    return {"queued": queue_rescore(platform, merchant_ids), "depth": len(rescore_queue)}
+
+
+@app.post("/merchants/invalidate")
+async def invalidate_merchant_index(payload: MerchantInvalidationRequest):
+    # Hook for merchant changes that don't touch updated_on; no merchant_id drops the whole index
+    return {"invalidated": merchant_index.invalidate(payload.merchant_id)}
+
+
+@app.get("/merchant-index/stats")
+async def get_merchant_index_stats():
+    return merchant_index.stats()
+
+
+@app.get("/score-distribution/stats")
+async def get_score_distribution_stats():
+    return score_distributions.stats()
+
+
+@app.get("/rescore-queue/stats")
+async def get_rescore_queue_stats():
+    return rescore_queue.stats()
+
+
+@app.get("/cache/stats")
+async def get_score_cache_stats():
+    return score_cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Prometheus text format: stage and request histograms plus pool, cache and model state
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/write-behind/stats")
+async def get_write_behind_stats():
+    return write_queue.stats()
+
+
+@app.get("/healthz")
+async def get_health():
+    # Liveness: the process is up and serving, warm or not
+    return {"status": "ok", "state": PROFILE.state}
+
+
+@app.get("/readyz")
+async def get_readiness():
+    return JSONResponse(PROFILE.as_dict(), status_code=200 if PROFILE.ready else 503)
+
+
+@app.get("/models")
+async def get_model_versions():
+    return model_store.status()
+
+
+@app.post("/models/reload")
+async def reload_models():
+    # Check the registry now instead of waiting for the next poll
+    swapped = await run_in_threadpool(model_store.refresh)
+    return {"swapped": [{"platform": p, "from": old, "to": new} for p, old, new in swapped]}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Cache settings
+SCORE_CACHE_SIZE = int(os.getenv("SCORE_CACHE_SIZE", 50000))
+SCORE_CACHE_TTL = float(os.getenv("SCORE_CACHE_TTL", 3600))
+
+
+class ScoreCache:
+    """Thread-safe LRU cache with a TTL for computed merchant scores.
+
+    Keys start with the merchant_id so every entry of a merchant can be
+    dropped at once when its data changes.
+    """
+
+    def __init__(self, maxsize=SCORE_CACHE_SIZE, ttl=SCORE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_merchant = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        keys = self._by_merchant.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_merchant[key[0]]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._by_merchant.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, merchant_id, platform=None):
+        with self._lock:
+            keys = [key for key in self._by_merchant.get(merchant_id, ())
+                    if platform is None or key[1] == platform]
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._by_merchant.clear()
+            return count
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,307 @@
+import argparse
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+import mysql.connector
+import numpy as np
+
+try:
+    from .db import db_config, lock_merchants, table_exists
+    from .features import PLATFORMS
+except ImportError:  # started from inside aiml/
+    from db import db_config, lock_merchants, table_exists
+    from features import PLATFORMS
+
+# Scores are counted in buckets this wide (scores carry two decimals, so
+# 0.01 keeps ranks exact); changing it needs a rebuild
+SCORE_BUCKET_WIDTH = float(os.getenv("SCORE_BUCKET_WIDTH", 0.01))
+
+# Scores outside this range count towards the end buckets of the in-memory histogram
+SCORE_RANGE = (float(os.getenv("SCORE_RANGE_MIN", -100)), float(os.getenv("SCORE_RANGE_MAX", 1000)))
+
+# Seconds between reloads of changed buckets (0 turns polling off), and how
+# far back each reload looks for transactions that committed late
+SCORE_DISTRIBUTION_REFRESH = float(os.getenv("SCORE_DISTRIBUTION_REFRESH", 10))
+SCORE_DISTRIBUTION_LAG = float(os.getenv("SCORE_DISTRIBUTION_LAG", 60))
+
+GRAND_DISTRIBUTION = "grand"
+
+# Grand badges by percentile once this many merchants have a grand score
+GRAND_BADGE_MIN_MERCHANTS = int(os.getenv("GRAND_BADGE_MIN_MERCHANTS", 100))
+GRAND_BADGE_PERCENTILES = (
+    ('platinum', float(os.getenv("PLATINUM_PERCENTILE", 90))),
+    ('gold', float(os.getenv("GOLD_PERCENTILE", 70))),
+    ('silver', float(os.getenv("SILVER_PERCENTILE", 50)))
+)
+
+# Merchant counts per score bucket, one histogram per platform and one for
+# grand scores. Kept in step with every merchants_scores upsert, so ranks
+# and badges come from a few thousand bucket rows instead of a scan of
+# merchants_scores.
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS merchants_score_distribution (
+        distribution VARCHAR(32) NOT NULL,
+        bucket INT NOT NULL,
+        merchant_count INT NOT NULL DEFAULT 0,
+        updated_on DATETIME NULL,
+        PRIMARY KEY (distribution, bucket)
+    )
+"""
+
+
+def score_column(distribution):
+    return "grand_score" if distribution == GRAND_DISTRIBUTION else f"loyalty_score_{distribution}"
+
+
+def bucket_of(score, width=SCORE_BUCKET_WIDTH):
+    # float() as scores read back from DECIMAL columns are Decimals
+    return int(round(float(score) / width))
+
+
+def percentile_badge(percentile):
+    for badge, cutoff in GRAND_BADGE_PERCENTILES:
+        if percentile >= cutoff:
+            return badge
+    return None
+
+
+def grand_badge(distributions, grand_loyalty_score):
+    # By percentile among merchants' grand scores, once there are enough of them to rank against
+    if distributions.count(GRAND_DISTRIBUTION) >= GRAND_BADGE_MIN_MERCHANTS:
+        return percentile_badge(distributions.percentile(GRAND_DISTRIBUTION, grand_loyalty_score))
+    if grand_loyalty_score >= 50:
+        return 'platinum'
+    elif grand_loyalty_score >= 20:
+        return 'gold'
+    elif grand_loyalty_score >= 10:
+        return 'silver'
+    return None
+
+
+def lock_previous_scores(conn, distributions, merchant_ids):
+    """Scores about to be replaced, ``{distribution: {merchant_id: score}}``.
+
+    Read before the merchants_scores upsert and locked until the caller
+    commits, so concurrent writers of a merchant move it between buckets
+    one after the other. Writers queue on the merchants row and missing
+    score rows are created empty first, so the locking read takes no gap
+    locks for first-time writes of a merchant to deadlock on.
+    """
+    previous = {distribution: {} for distribution in distributions}
+    if not merchant_ids:
+        return previous
+    columns = ", ".join(score_column(distribution) for distribution in distributions)
+    lock_merchants(conn, merchant_ids)
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("INSERT IGNORE INTO merchants_scores (merchant_id) VALUES (%s)",
+                           [(merchant_id,) for merchant_id in merchant_ids])
+        cursor.execute(f"""
+            SELECT merchant_id, {columns}
+            FROM merchants_scores
+            WHERE merchant_id IN ({", ".join(["%s"] * len(merchant_ids))})
+            FOR UPDATE
+        """, tuple(merchant_ids))
+        for merchant_id, *scores in cursor.fetchall():
+            for distribution, score in zip(distributions, scores):
+                if score is not None:
+                    previous[distribution][merchant_id] = score
+    finally:
+        cursor.close()
+    return previous
+
+
+def record_score_changes(conn, distribution, previous, scores):
+    """Move merchants from their previous score's bucket to the new one.
+
+    ``scores`` maps merchant_id to the score just written. Only the net
+    change per bucket is applied. The caller owns the transaction.
+    """
+    deltas = Counter()
+    for merchant_id, score in scores.items():
+        old_score = previous.get(merchant_id)
+        if old_score is not None:
+            deltas[bucket_of(old_score)] -= 1
+        if score is not None:
+            deltas[bucket_of(score)] += 1
+
+    rows = [(distribution, bucket, delta) for bucket, delta in deltas.items() if delta]
+    if not rows:
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO merchants_score_distribution (distribution, bucket, merchant_count, updated_on)
+            VALUES (%s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE
+                merchant_count = merchant_count + VALUES(merchant_count),
+                updated_on = NOW()
+        """, rows)
+    finally:
+        cursor.close()
+
+
+class ScoreDistributions:
+    """In-memory copy of merchants_score_distribution for online ranking.
+
+    Each distribution is held as bucket counts over ``score_range`` plus
+    their running total, so ``percentile`` is two array reads. ``refresh``
+    reloads only the buckets updated since the last reload (less
+    ``lag``) and swaps in the rebuilt arrays; the first call, or one after
+    ``reset``, loads every bucket. Ranks use average ties, like the label
+    sketches.
+    """
+
+    def __init__(self, width=SCORE_BUCKET_WIDTH, score_range=SCORE_RANGE, lag=SCORE_DISTRIBUTION_LAG):
+        self.width = width
+        self.low = bucket_of(score_range[0], width)
+        self.size = bucket_of(score_range[1], width) - self.low + 1
+        self.lag = lag
+        self._buckets = {}
+        self._views = {}
+        self._lock = threading.Lock()
+        self.watermark = None
+        self.refreshes = 0
+
+    def refresh(self, conn):
+        if isinstance(self.watermark, datetime):
+            since = self.watermark - timedelta(seconds=self.lag)
+        else:
+            since = self.watermark
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT distribution, bucket, merchant_count, updated_on
+                FROM merchants_score_distribution
+                {"" if since is None else "WHERE updated_on >= %s"}
+            """, () if since is None else (since,))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        with self._lock:
+            touched = set()
+            if since is None:
+                # A full load replaces everything, including buckets a rebuild removed
+                touched.update(self._buckets)
+                self._buckets = {}
+            for distribution, bucket, merchant_count, updated_on in rows:
+                self._buckets.setdefault(distribution, {})[int(bucket)] = int(merchant_count)
+                touched.add(distribution)
+                if updated_on is not None and (self.watermark is None or updated_on > self.watermark):
+                    self.watermark = updated_on
+            for distribution in touched:
+                self._views[distribution] = self._build(self._buckets.get(distribution, {}))
+            self.refreshes += 1
+        return len(rows)
+
+    def reset(self):
+        # The next refresh reloads every bucket, e.g. after a rebuild
+        with self._lock:
+            self.watermark = None
+
+    def _build(self, buckets):
+        counts = np.zeros(self.size, dtype=np.int64)
+        if buckets:
+            index = np.fromiter(buckets.keys(), dtype=np.int64, count=len(buckets)) - self.low
+            values = np.fromiter(buckets.values(), dtype=np.int64, count=len(buckets))
+            # Counts that drifted below zero are ignored until the next rebuild
+            np.add.at(counts, np.clip(index, 0, self.size - 1), np.maximum(values, 0))
+        # cumulative[i] = merchants in buckets below i
+        cumulative = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(counts, out=cumulative[1:])
+        return counts, cumulative
+
+    def count(self, distribution):
+        view = self._views.get(distribution)
+        return int(view[1][-1]) if view is not None else 0
+
+    def percentile(self, distribution, score):
+        """Share of merchants at or below ``score``, 0-100; None while empty."""
+        view = self._views.get(distribution)
+        if view is None or score is None:
+            return None
+        counts, cumulative = view
+        total = cumulative[-1]
+        if total <= 0:
+            return None
+        i = min(max(bucket_of(score, self.width) - self.low, 0), self.size - 1)
+        rank = (cumulative[i] + (counts[i] + 1) / 2) / total
+        return round(min(float(rank), 1.0) * 100, 2)
+
+    def quantile(self, distribution, q):
+        # Score at the q-th share of merchants, to the bucket width
+        view = self._views.get(distribution)
+        if view is None or view[1][-1] <= 0:
+            return None
+        cumulative = view[1]
+        i = int(np.searchsorted(cumulative[1:], q * cumulative[-1], side='left'))
+        return round((min(i, self.size - 1) + self.low) * self.width, 4)
+
+    def stats(self):
+        with self._lock:
+            distributions = sorted(self._views)
+        return {
+            "bucket_width": self.width,
+            "watermark": self.watermark.isoformat() if hasattr(self.watermark, "isoformat") else self.watermark,
+            "refreshes": self.refreshes,
+            "distributions": {
+                distribution: {
+                    "merchants": self.count(distribution),
+                    "quantiles": {f"p{int(q * 100)}": self.quantile(distribution, q)
+                                  for q in (0.1, 0.25, 0.5, 0.75, 0.9, 0.99)}
+                }
+                for distribution in distributions
+            }
+        }
+
+
+def rebuild(conn, distribution):
+    """Backfill one distribution from merchants_scores."""
+    column = score_column(distribution)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CREATE_TABLE_QUERY)
+        cursor.execute("DELETE FROM merchants_score_distribution WHERE distribution = %s", (distribution,))
+        cursor.execute(f"""
+            INSERT INTO merchants_score_distribution (distribution, bucket, merchant_count, updated_on)
+            SELECT %s, bucket, COUNT(*), NOW()
+            FROM (
+                SELECT ROUND({column} / %s) AS bucket
+                FROM merchants_scores
+                WHERE {column} IS NOT NULL
+            ) b
+            GROUP BY bucket
+        """, (distribution, SCORE_BUCKET_WIDTH))
+        rebuilt = cursor.rowcount
+        conn.commit()
+        return rebuilt
+    finally:
+        cursor.close()
+
+
+def ensure_table(conn):
+    # Creates and backfills merchants_score_distribution on a database that doesn't have it yet
+    if table_exists(conn, "merchants_score_distribution"):
+        return False
+    for distribution in PLATFORMS + [GRAND_DISTRIBUTION]:
+        rebuild(conn, distribution)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the merchants_score_distribution histograms")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="backfill bucket counts from merchants_scores")
+    rebuild_parser.add_argument("--distribution", choices=PLATFORMS + [GRAND_DISTRIBUTION], action="append",
+                                help="platform or 'grand' (repeatable, defaults to all)")
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**db_config)
+    try:
+        for distribution in args.distribution or PLATFORMS + [GRAND_DISTRIBUTION]:
+            count = rebuild(conn, distribution)
+            print(f"✅ Rebuilt {count} {distribution} score buckets")
+    finally:
+        conn.close()
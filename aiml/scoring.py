@@ -0,0 +1,234 @@
+import os
+from datetime import date, datetime
+import pandas as pd
+
+try:
+    from .features import (CHURN_FEATURES, LOYALTY_FEATURES, REGISTER_COLUMNS, feature_matrix, raw_columns,
+                           row_matrix)
+    from .history_agg import ensure_table as ensure_history_table
+    from .history_agg import record_history_scores
+    from .leaderboard import ensure_table as ensure_leaderboard_table
+    from .leaderboard import update_grand_board, update_platform_boards
+    from .score_distribution import GRAND_DISTRIBUTION, grand_badge, lock_previous_scores, record_score_changes
+    from .score_distribution import ensure_table as ensure_distribution_table
+except ImportError:  # started from inside aiml/
+    from features import (CHURN_FEATURES, LOYALTY_FEATURES, REGISTER_COLUMNS, feature_matrix, raw_columns,
+                          row_matrix)
+    from history_agg import ensure_table as ensure_history_table
+    from history_agg import record_history_scores
+    from leaderboard import ensure_table as ensure_leaderboard_table
+    from leaderboard import update_grand_board, update_platform_boards
+    from score_distribution import GRAND_DISTRIBUTION, grand_badge, lock_previous_scores, record_score_changes
+    from score_distribution import ensure_table as ensure_distribution_table
+
+# (loyalty, churn) model pickles per platform
+MODEL_FILES = {
+    'shipway': ("shipway-model.pkl", "merchant_churn_model.pkl"),
+    'unicommerce': ("unicommerce-model.pkl", "unicommerse_churn_model.pkl"),
+    'convertway': ("convertway-model.pkl", "convertway_churn_model.pkl")
+}
+
+# Rows per multi-row merchants_scores upsert statement
+UPSERT_BATCH_ROWS = int(os.getenv("UPSERT_BATCH_ROWS", 500))
+
+# (from_date, till_date) of the merchants_scores_history row holding grand scores
+GRAND_HISTORY_PERIOD = ("2025-05-01", "2025-05-31")
+
+
+def ensure_tables(conn):
+    """Create and backfill the tables every score write keeps in step.
+
+    History aggregates, leaderboard boards and score distributions are
+    derived from merchants_scores(_history); on a database that has never
+    had them they are built here, before anything writes scores. Returns
+    the names of the tables it created.
+    """
+    created = []
+    for table, ensure in (("merchants_history_features", ensure_history_table),
+                          ("merchants_leaderboard", ensure_leaderboard_table),
+                          ("merchants_score_distribution", ensure_distribution_table)):
+        if ensure(conn):
+            created.append(table)
+    return created
+
+
+def score_upsert_query(platform, n_rows=1):
+    loyalty_col = f"loyalty_score_{platform}"
+    churn_col = f"churn_rate_{platform}"
+    values = ", ".join(["(%s, %s, %s, NOW())"] * n_rows)
+    return f"""
+        INSERT INTO merchants_scores (
+            merchant_id, {loyalty_col}, {churn_col}, updated_on
+        ) VALUES {values}
+        ON DUPLICATE KEY UPDATE
+            {loyalty_col} = VALUES({loyalty_col}),
+            {churn_col} = VALUES({churn_col}),
+            updated_on = NOW()
+    """
+
+
+def load_latest_rows(conn, platform, merchant_ids):
+    id_placeholders = ", ".join(["%s"] * len(merchant_ids))
+
+    # Latest transaction row per merchant
+    df = pd.read_sql(f"""
+        SELECT s.*, m.{REGISTER_COLUMNS[platform]}
+        FROM data_{platform} s
+        JOIN merchants m ON m.merchant_id = s.merchant_id
+        JOIN (
+            SELECT merchant_id, MAX(till_date) AS till_date
+            FROM data_{platform}
+            WHERE merchant_id IN ({id_placeholders})
+            GROUP BY merchant_id
+        ) latest ON latest.merchant_id = s.merchant_id AND latest.till_date = s.till_date
+    """, conn, params=tuple(merchant_ids))
+    df = df.drop_duplicates(subset='merchant_id', keep='last').reset_index(drop=True)
+    df['till_date'] = pd.to_datetime(df['till_date']).dt.date
+    return df
+
+
+def load_latest_row(conn, platform, merchant_id):
+    """One merchant's latest transaction row without going through pandas.
+
+    Returns ``(till_date, row)``, where ``row`` maps the registration
+    column and the platform's raw model inputs to driver values, or None
+    when the merchant has no rows on the platform.
+    """
+    columns = [REGISTER_COLUMNS[platform]] + raw_columns(platform)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT s.till_date, m.{columns[0]}, {", ".join(f"s.{col}" for col in columns[1:])}
+            FROM data_{platform} s
+            JOIN merchants m ON m.merchant_id = s.merchant_id
+            WHERE s.merchant_id = %s
+            ORDER BY s.till_date DESC
+            LIMIT 1
+        """, (merchant_id,))
+        found = cursor.fetchone()
+    finally:
+        cursor.close()
+    if found is None:
+        return None
+    till_date = found[0]
+    if isinstance(till_date, datetime):
+        till_date = till_date.date()
+    elif isinstance(till_date, str):
+        till_date = date.fromisoformat(till_date[:10])
+    return till_date, dict(zip(columns, found[1:]))
+
+
+def predict_row(loyalty_model, churn_model, platform, values):
+    # predict_scores for one merchant's derived feature values
+    score = loyalty_model.predict(row_matrix(values, LOYALTY_FEATURES[platform])).round(2)[0]
+    churn_rate = churn_model.predict(row_matrix(values, CHURN_FEATURES[platform])).round(2)[0]
+    return float(score), float(churn_rate)
+
+
+def predict_scores(loyalty_model, churn_model, platform, merged_df):
+    scores = loyalty_model.predict(feature_matrix(merged_df, LOYALTY_FEATURES[platform])).round(2)
+    churn_rates = churn_model.predict(feature_matrix(merged_df, CHURN_FEATURES[platform])).round(2)
+    return scores, churn_rates
+
+
+def score_rows(merged_df, scores, churn_rates):
+    # (merchant_id, from_date, till_date, score, churn_rate) per scored merchant
+    rows = []
+    for i, merchant_id in enumerate(merged_df['merchant_id'].tolist()):
+        till_date = merged_df.at[i, 'till_date']
+        rows.append((merchant_id, till_date.replace(day=1), till_date, float(scores[i]), float(churn_rates[i])))
+    return rows
+
+
+def write_platform_scores(conn, platform, rows):
+    # Multi-row upserts into merchants_scores, UPSERT_BATCH_ROWS at a time
+    latest = {row[0]: row[3] for row in rows}
+    previous = lock_previous_scores(conn, [platform], list(latest))
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(rows), UPSERT_BATCH_ROWS):
+            batch = rows[start:start + UPSERT_BATCH_ROWS]
+            params = [value for row in batch for value in (row[0], row[3], row[4])]
+            cursor.execute(score_upsert_query(platform, len(batch)), params)
+    finally:
+        cursor.close()
+
+    # History rows and their running aggregates, the score distribution, then the dashboard boards
+    record_history_scores(conn, platform, rows)
+    record_score_changes(conn, platform, previous[platform], latest)
+    update_platform_boards(conn, platform, rows)
+
+
+def platform_weight(multiplier):
+    # A missing multiplier counts as 1; a stored 0 stays 0
+    return float(multiplier if multiplier is not None else 1)
+
+
+def stored_grand_scores(conn, platforms, merchant_ids, distributions):
+    """(merchant_id, grand_score, grand_badge) rows from the stored platform scores.
+
+    Weighted as /loyalty-score/multi-platform does, with badges ranked
+    against ``distributions``. Called after the platform scores were written
+    in the same transaction; the locking read sees what other writers
+    committed since the transaction's first read.
+    """
+    if not merchant_ids:
+        return []
+    columns = ", ".join(f"m.is_{p} = '1' AS on_{p}, m.multiplier_{p}, s.loyalty_score_{p}" for p in platforms)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"""
+            SELECT m.merchant_id, {columns}
+            FROM merchants m
+            JOIN merchants_scores s ON s.merchant_id = m.merchant_id
+            WHERE m.merchant_id IN ({", ".join(["%s"] * len(merchant_ids))})
+            FOR UPDATE
+        """, tuple(merchant_ids))
+        merchants = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    rows = []
+    for merchant in merchants:
+        weighted = [round(float(merchant[f'loyalty_score_{p}']), 2) * platform_weight(merchant[f'multiplier_{p}'])
+                    for p in platforms if merchant[f'on_{p}'] and merchant[f'loyalty_score_{p}'] is not None]
+        if weighted:
+            grand_loyalty_score = round(sum(weighted) / len(weighted), 2)
+            rows.append((merchant['merchant_id'], grand_loyalty_score, grand_badge(distributions, grand_loyalty_score)))
+    return rows
+
+
+def write_grand_scores(conn, rows):
+    # (merchant_id, grand_score, grand_badge) rows into merchants_scores, its history and the grand board
+    from_date, till_date = GRAND_HISTORY_PERIOD
+    latest = {merchant_id: score for merchant_id, score, _ in rows}
+    previous = lock_previous_scores(conn, [GRAND_DISTRIBUTION], list(latest))
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(rows), UPSERT_BATCH_ROWS):
+            batch = rows[start:start + UPSERT_BATCH_ROWS]
+            cursor.execute(f"""
+                INSERT INTO merchants_scores (
+                    merchant_id, grand_score, grand_badge, updated_on
+                ) VALUES {", ".join(["(%s, %s, %s, NOW())"] * len(batch))}
+                ON DUPLICATE KEY UPDATE
+                    grand_score = VALUES(grand_score),
+                    grand_badge = VALUES(grand_badge),
+                    updated_on = NOW()
+            """, [value for row in batch for value in row])
+            cursor.execute(f"""
+                INSERT INTO merchants_scores_history (
+                    merchant_id, from_date, till_date, grand_score, grand_badge, added_on
+                ) VALUES {", ".join(["(%s, %s, %s, %s, %s, NOW())"] * len(batch))}
+                ON DUPLICATE KEY UPDATE
+                    till_date = VALUES(till_date),
+                    grand_score = VALUES(grand_score),
+                    grand_badge = VALUES(grand_badge),
+                    updated_on = NOW()
+            """, [value for merchant_id, score, badge in batch
+                  for value in (merchant_id, from_date, till_date, score, badge)])
+    finally:
+        cursor.close()
+
+    record_score_changes(conn, GRAND_DISTRIBUTION, previous[GRAND_DISTRIBUTION], latest)
+    update_grand_board(conn, rows)
@@ -0,0 +1,73 @@
+import asyncio
+import os
+
+try:
+    from .metrics import REGISTRY, Counter, stage
+except ImportError:  # started from inside aiml/
+    from metrics import REGISTRY, Counter, stage
+
+# Request coalescing: on by default; waiters give up after this many seconds
+SINGLEFLIGHT = os.getenv("SINGLEFLIGHT", "1") == "1"
+SINGLEFLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", 10))
+
+FLIGHTS_TOTAL = REGISTRY.register(Counter(
+    "aiml_singleflight_total", "Coalescable requests by whether they led, joined or timed out waiting.",
+    ("endpoint", "outcome")))
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class SingleFlight:
+    """Shares one in-flight computation among concurrent callers of a key.
+
+    The first caller of a key (the leader) starts ``fn()`` as a task;
+    callers arriving before it finishes await the same task and get the
+    same result or exception. The task is shielded, so a leader whose
+    client disconnects doesn't cancel it for the others. Waiters give up
+    with SingleFlightTimeout after ``wait_timeout`` seconds. Nothing is
+    kept once the task is done.
+    """
+
+    def __init__(self, endpoint, wait_timeout=SINGLEFLIGHT_WAIT_TIMEOUT, enabled=SINGLEFLIGHT):
+        self.endpoint = endpoint
+        self.wait_timeout = wait_timeout
+        self.enabled = enabled
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def __len__(self):
+        return len(self._flights)
+
+    def _done(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Retrieve the outcome so an unawaited failure isn't logged as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key, fn):
+        if not self.enabled:
+            return await fn()
+
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+            self.leaders += 1
+            FLIGHTS_TOTAL.inc(endpoint=self.endpoint, outcome="leader")
+            return await asyncio.shield(task)
+
+        self.coalesced += 1
+        FLIGHTS_TOTAL.inc(endpoint=self.endpoint, outcome="coalesced")
+        try:
+            with stage("coalesced_wait"):
+                return await asyncio.wait_for(asyncio.shield(task), self.wait_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            FLIGHTS_TOTAL.inc(endpoint=self.endpoint, outcome="timeout")
+            raise SingleFlightTimeout(f"Identical request still running after {self.wait_timeout}s")
@@ -0,0 +1,177 @@
+import json
+import math
+import os
+import numpy as np
+
+# Sketch accuracy: rank error is roughly 1.7 / SKETCH_K of the row count
+SKETCH_K = int(os.getenv("SKETCH_K", 256))
+
+# Rows fed to a sketch at a time, so no step sorts more than this many values
+SKETCH_CHUNK_ROWS = int(os.getenv("SKETCH_CHUNK_ROWS", 50000))
+
+# Level capacities shrink by this factor towards the lowest level
+_DECAY = 2 / 3
+
+
+class KLLSketch:
+    """Mergeable streaming quantile sketch (Karnin, Lang, Liberty).
+
+    Values live in compactors; an item at level h stands for 2**h input
+    values. When a level outgrows its capacity it is sorted and every
+    other item (random offset) moves up a level, so memory stays around
+    ``3 * k`` items whatever the stream length. Ranks follow pandas'
+    ``rank(pct=True)`` with average ties, and are exact until the first
+    compaction.
+    """
+
+    def __init__(self, k=SKETCH_K, seed=0):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+        self._sorted = None
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * _DECAY ** depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # An odd item out stays behind at this level
+                keep = items[:1] if len(items) % 2 else items[:0]
+                pairs = items[len(keep):]
+                promoted = pairs[int(self._rng.integers(2))::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+        self._sorted = None
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        for start in range(0, len(values), SKETCH_CHUNK_ROWS):
+            chunk = values[start:start + SKETCH_CHUNK_ROWS]
+            self.levels[0] = np.concatenate([self.levels[0], chunk])
+            self.n += len(chunk)
+            self._compress()
+        return self
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def _weighted(self):
+        if self._sorted is None:
+            items = np.concatenate(self.levels)
+            weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+            order = np.argsort(items, kind='stable')
+            self._sorted = (items[order], np.concatenate([[0.0], np.cumsum(weights[order])]))
+        return self._sorted
+
+    def cdf(self, values):
+        """Percentile rank in (0, 1] of each value; NaN stays NaN."""
+        values = np.asarray(values, dtype=np.float64)
+        if self.n == 0:
+            return np.full(values.shape, np.nan)
+        items, cumulative = self._weighted()
+        total = cumulative[-1]
+        below = cumulative[np.searchsorted(items, values, side='left')]
+        at_or_below = cumulative[np.searchsorted(items, values, side='right')]
+        # Average rank of the tied block, 1-based, over the stream length
+        ranks = (below + (at_or_below - below + 1) / 2) / total
+        return np.where(np.isnan(values), np.nan, np.minimum(ranks, 1.0))
+
+    def quantile(self, q):
+        items, cumulative = self._weighted()
+        if not len(items):
+            return np.nan
+        position = np.searchsorted(cumulative[1:], q * cumulative[-1], side='left')
+        return float(items[min(position, len(items) - 1)])
+
+    def to_dict(self):
+        return {"k": self.k, "n": self.n, "levels": [items.tolist() for items in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data, seed=0):
+        sketch = cls(data["k"], seed)
+        sketch.n = data["n"]
+        sketch.levels = [np.asarray(items, dtype=np.float64) for items in data["levels"]]
+        return sketch
+
+
+class ColumnSketches:
+    """One KLLSketch per column, saved as JSON next to a model pickle."""
+
+    def __init__(self, columns=(), k=SKETCH_K):
+        self.k = k
+        self.sketches = {column: KLLSketch(k, seed=i) for i, column in enumerate(columns)}
+
+    def __contains__(self, column):
+        return column in self.sketches
+
+    def __getitem__(self, column):
+        return self.sketches[column]
+
+    def update(self, df):
+        for column, sketch in self.sketches.items():
+            sketch.update(df[column].to_numpy(dtype=np.float64, na_value=np.nan))
+        return self
+
+    def merge(self, other):
+        for column, sketch in other.sketches.items():
+            if column in self.sketches:
+                self.sketches[column].merge(sketch)
+            else:
+                self.sketches[column] = KLLSketch.from_dict(sketch.to_dict())
+        return self
+
+    def percentile(self, column, value):
+        # Online lookup: where a value falls among the training rows, 0-100
+        return float(self.sketches[column].cdf([value])[0] * 100)
+
+    def to_dict(self):
+        return {"k": self.k, "columns": {column: sketch.to_dict() for column, sketch in self.sketches.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketches = cls(k=data["k"])
+        sketches.sketches = {column: KLLSketch.from_dict(sketch, seed=i)
+                             for i, (column, sketch) in enumerate(data["columns"].items())}
+        return sketches
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def sketch_path(model_path):
+    return os.path.splitext(model_path)[0] + ".sketch.json"
+
+
+def label_sketches(weights, base=None):
+    """Empty sketches of the label columns, or ``base`` extended to them.
+
+    Fed one chunk at a time with ``update`` while the training table is
+    read (``read_training_frame``'s ``on_chunk``), so label ranks never need
+    a pass over the full frame.
+    """
+    sketches = ColumnSketches([column for column, _ in weights])
+    return sketches if base is None else base.merge(sketches)
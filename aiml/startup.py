@@ -0,0 +1,188 @@
+import asyncio
+import importlib
+import json
+import os
+import threading
+import time
+from contextlib import AsyncExitStack, contextmanager
+
+# Fast start: the front app below binds before score_api (pandas, sklearn,
+# mysql.connector, the models) is imported, and answers probes meanwhile.
+# Requests that arrive before score_api is up wait this long, then get a 503
+STARTUP_REQUEST_WAIT = float(os.getenv("STARTUP_REQUEST_WAIT", 0))
+
+
+def _process_age():
+    # Seconds since the process started, so interpreter start-up counts too (Linux only)
+    try:
+        with open("/proc/self/stat") as f:
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - started_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupProfile:
+    """Where start-up time goes, from process start to ready.
+
+    ``phase`` times a named step (imports, the DB pool, each platform's
+    models), ``mark`` records when a milestone was reached, both in
+    seconds since the process started. ``state`` moves from ``starting``
+    through ``loading`` and ``warming`` to ``ready``, or to ``failed``
+    with the error kept in ``error``. ``warmups`` holds the status of each
+    background warm-up step: ``warming``, ``done`` or ``failed``.
+    """
+
+    def __init__(self):
+        self._origin = time.perf_counter() - _process_age()
+        self._lock = threading.Lock()
+        self.state = "starting"
+        self.error = None
+        self.phases = {}
+        self.marks = {}
+        self.warmups = {}
+
+    def elapsed(self):
+        return time.perf_counter() - self._origin
+
+    def mark(self, name):
+        with self._lock:
+            self.marks.setdefault(name, round(self.elapsed(), 4))
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = round(time.perf_counter() - start, 4)
+
+    def set_warmup(self, name, status):
+        with self._lock:
+            self.warmups[name] = status
+
+    def set_state(self, state, error=None):
+        with self._lock:
+            self.state = state
+            if error is not None:
+                self.error = f"{type(error).__name__}: {error}"
+        self.mark(state)
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "error": self.error,
+                "uptime_seconds": round(self.elapsed(), 4),
+                "time_to_ready_seconds": self.marks.get("ready"),
+                "marks": dict(self.marks),
+                "phases": dict(self.phases),
+                "warmups": dict(self.warmups)
+            }
+
+
+# One per process, shared by the front app and score_api
+PROFILE = StartupProfile()
+
+
+async def _send_json(send, status, body, headers=()):
+    payload = json.dumps(body).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode()),
+                    *headers]
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+class FastStartApp:
+    """ASGI app that binds at once and brings score_api up behind it.
+
+    Lifespan start-up only schedules the load: score_api is imported in a
+    thread, then its own lifespan runs (DB pool, merchant index, model
+    warmup). Until the import is done ``/healthz`` answers 200 and
+    ``/readyz`` and every other path answer 503 with the start-up profile;
+    afterwards everything, probes included, goes to score_api. Shutdown
+    runs score_api's lifespan exit.
+    """
+
+    def __init__(self, module="score_api"):
+        self.module = f"{__package__}.{module}" if __package__ else module
+        self.app = None
+        self._loaded = None
+        self._loader = None
+        self._stack = None
+
+    async def _load(self):
+        try:
+            PROFILE.set_state("loading")
+            with PROFILE.phase("import"):
+                module = await asyncio.to_thread(importlib.import_module, self.module)
+            self._stack = AsyncExitStack()
+            await self._stack.enter_async_context(module.lifespan(module.app))
+            self.app = module.app
+        except Exception as e:
+            PROFILE.set_state("failed", e)
+            print(f"⚠️ Starting {self.module} failed: {e}")
+        finally:
+            self._loaded.set()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._loaded = asyncio.Event()
+                self._loader = asyncio.create_task(self._load())
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._loader is not None:
+                    self._loader.cancel()
+                    await asyncio.gather(self._loader, return_exceptions=True)
+                if self._stack is not None:
+                    await self._stack.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        if self.app is None and STARTUP_REQUEST_WAIT > 0 and self._loaded is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._loaded.wait()), STARTUP_REQUEST_WAIT)
+            except asyncio.TimeoutError:
+                pass
+        if self.app is not None:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["type"] != "http":
+            # Websockets have no route until score_api is up
+            await send({"type": "websocket.close", "code": 1013})
+            return
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        if path == "/healthz":
+            await _send_json(send, 200, {"status": "ok", **PROFILE.as_dict()})
+        else:
+            await _send_json(send, 503, PROFILE.as_dict(), headers=[(b"retry-after", b"1")])
+
+
+app = FastStartApp()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("startup:app", host="127.0.0.1", port=int(os.getenv("PORT", 8000)))
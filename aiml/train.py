@@ -0,0 +1,218 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import joblib
+from sklearn.ensemble import RandomForestRegressor
+
+try:
+    from .features import (CHURN_FEATURES, LABEL_WEIGHTS, LOYALTY_FEATURES, PLATFORMS, churn_label, feature_matrix,
+                           label_frame, loyalty_label)
+    from .forest_compile import compile_model
+    from .history_agg import read_platform_history_features
+    from .registry import MODEL_REGISTRY_DIR, publish
+    from .sketch import label_sketches, sketch_path
+    from .train_data import peak_rss_mb, read_training_frame, training_engine
+except ImportError:  # started from inside aiml/
+    from features import (CHURN_FEATURES, LABEL_WEIGHTS, LOYALTY_FEATURES, PLATFORMS, churn_label, feature_matrix,
+                          label_frame, loyalty_label)
+    from forest_compile import compile_model
+    from history_agg import read_platform_history_features
+    from registry import MODEL_REGISTRY_DIR, publish
+    from sketch import label_sketches, sketch_path
+    from train_data import peak_rss_mb, read_training_frame, training_engine
+
+TRAIN_CORES = int(os.getenv("TRAIN_CORES", os.cpu_count() or 1))
+
+# The six models, with the settings and output names of the standalone scripts.
+# saved_n_jobs is what the pickle keeps for prediction; fitting uses the
+# share of the core budget the job is given.
+ModelSpec = namedtuple("ModelSpec", "platform kind output random_state saved_n_jobs")
+
+MODEL_SPECS = [
+    ModelSpec('shipway', 'loyalty', 'shipway-model.pkl', 5, None),
+    ModelSpec('unicommerce', 'loyalty', 'unicommerce-model.pkl', 5, None),
+    ModelSpec('convertway', 'loyalty', 'convertway-model.pkl', 5, None),
+    ModelSpec('shipway', 'churn', 'merchant_churn_model.pkl', 42, -1),
+    ModelSpec('unicommerce', 'churn', 'unicommerse_churn_model.pkl', 42, -1),
+    ModelSpec('convertway', 'churn', 'convertway_churn_model.pkl', 42, -1),
+]
+
+N_ESTIMATORS = 500
+
+# Training sets built in the parent and inherited by forked workers, so
+# the arrays are never pickled across the process boundary
+_DATASETS = {}
+
+# Label column sketches per model output, saved next to each pickle
+_SKETCHES = {}
+
+
+def sketch_chunks(specs, df_hist=None, base=None):
+    """Label sketches per model output, and the ``on_chunk`` callback feeding them.
+
+    Each chunk of the training read is prepared like the full frame and
+    added to the sketches of every spec, so labels are ranked from the
+    streaming read instead of a second pass over the finished frame.
+    ``base`` maps outputs to saved sketches to keep adding to.
+    """
+    sketches = {spec.output: label_sketches(LABEL_WEIGHTS[spec.kind][spec.platform], (base or {}).get(spec.output))
+                for spec in specs}
+
+    def on_chunk(chunk):
+        # label_frame adds columns, and the chunk is still being read into the frame
+        chunk = chunk.copy()
+        for spec in specs:
+            sketches[spec.output].update(label_frame(chunk, spec.platform, spec.kind, df_hist))
+
+    return sketches, on_chunk
+
+
+def loyalty_dataset(df, platform, sketches, df_hist=None):
+    # Labels are ranked with the sketches built while ``df`` was read
+    df = label_frame(df, platform, 'loyalty', df_hist)
+    label = loyalty_label(df, platform, sketches)
+    if platform == 'convertway':
+        label = label.fillna(0)
+    rows = label.notna() if platform == 'shipway' else None
+
+    X = feature_matrix(df, LOYALTY_FEATURES[platform], rows=rows)
+    y = (label if rows is None else label[rows]).to_numpy()
+    return X, y
+
+
+def churn_dataset(df, platform, sketches):
+    df = label_frame(df, platform, 'churn')
+    label = churn_label(df, platform, sketches)
+    features = CHURN_FEATURES[platform]
+    complete = df[features].notna().all(axis=1) & label.notna()
+    X = feature_matrix(df, features, fill_value=None, rows=complete)
+    return X, label[complete].to_numpy()
+
+
+def load_datasets(engine, specs):
+    """Pull each platform table once and build every requested training set."""
+    timings = {}
+    for platform in dict.fromkeys(spec.platform for spec in specs):
+        platform_specs = [spec for spec in specs if spec.platform == platform]
+        start = time.perf_counter()
+        df_hist = read_platform_history_features(engine, platform) if platform == 'shipway' else None
+        sketches, on_chunk = sketch_chunks(platform_specs, df_hist)
+        df = read_training_frame(engine, platform, on_chunk=on_chunk)
+        load_s = time.perf_counter() - start
+
+        for spec in platform_specs:
+            start = time.perf_counter()
+            if spec.kind == 'loyalty':
+                X, y = loyalty_dataset(df, platform, sketches[spec.output], df_hist)
+            else:
+                X, y = churn_dataset(df, platform, sketches[spec.output])
+            _DATASETS[spec.output] = (X, y)
+            _SKETCHES[spec.output] = sketches[spec.output]
+            timings[spec.output] = {"load_s": load_s, "prepare_s": time.perf_counter() - start}
+        del df
+    return timings
+
+
+def allocate_cores(specs, cores):
+    """Split the core budget between jobs, larger training sets first.
+
+    At most ``cores`` jobs run at once. Each gets an equal share, and the
+    remainder goes to the biggest sets.
+    """
+    order = sorted(specs, key=lambda spec: _DATASETS[spec.output][0].size, reverse=True)
+    workers = max(1, min(len(order), cores))
+    share, extra = divmod(max(cores, workers), workers)
+    return workers, [(spec, share + (1 if i < extra else 0)) for i, spec in enumerate(order)]
+
+
+def _fit_job(spec, n_jobs, output_dir):
+    X, y = _DATASETS[spec.output]
+    start = time.perf_counter()
+    model = RandomForestRegressor(n_estimators=N_ESTIMATORS, random_state=spec.random_state, n_jobs=n_jobs)
+    model.fit(X, y)
+    fit_s = time.perf_counter() - start
+
+    # Fitted trees don't depend on n_jobs; keep the script's prediction setting
+    model.set_params(n_jobs=spec.saved_n_jobs)
+    start = time.perf_counter()
+    path = os.path.join(output_dir, spec.output)
+    joblib.dump(model, path)
+    # Memory-mappable copy the scoring API loads instead of the pickle
+    compile_model(path, model=model)
+    _SKETCHES[spec.output].save(sketch_path(path))
+    return {"fit_s": fit_s, "save_s": time.perf_counter() - start, "worker_peak_rss_mb": peak_rss_mb()}
+
+
+def train(specs, cores=TRAIN_CORES, output_dir=".", engine=None):
+    started = time.perf_counter()
+    engine = engine or training_engine()
+    try:
+        timings = load_datasets(engine, specs)
+    finally:
+        engine.dispose()
+
+    workers, plan = allocate_cores(specs, cores)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as pool:
+        futures = {pool.submit(_fit_job, spec, n_jobs, output_dir): (spec, n_jobs) for spec, n_jobs in plan}
+        for future in as_completed(futures):
+            spec, n_jobs = futures[future]
+            X, _ = _DATASETS[spec.output]
+            entry = {
+                "model": spec.output,
+                "platform": spec.platform,
+                "kind": spec.kind,
+                "rows": int(X.shape[0]),
+                "features": int(X.shape[1]),
+                "n_jobs": n_jobs,
+                **timings[spec.output],
+                **future.result()
+            }
+            entry = {k: round(v, 3) if isinstance(v, float) else v for k, v in entry.items()}
+            results.append(entry)
+            print(f"✅ {spec.output}: {entry['rows']} rows, fit {entry['fit_s']}s on {n_jobs} cores")
+
+    _DATASETS.clear()
+    _SKETCHES.clear()
+    outputs = [spec.output for spec in MODEL_SPECS]
+    return {
+        "cores": cores,
+        "workers": workers,
+        "total_s": round(time.perf_counter() - started, 3),
+        "parent_peak_rss_mb": round(peak_rss_mb(), 1),
+        "models": sorted(results, key=lambda entry: outputs.index(entry["model"]))
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the loyalty and churn models for every platform")
+    parser.add_argument("--platform", choices=PLATFORMS, action="append",
+                        help="platform to train (repeatable, defaults to all)")
+    parser.add_argument("--kind", choices=['loyalty', 'churn'], action="append",
+                        help="model kind to train (repeatable, defaults to both)")
+    parser.add_argument("--cores", type=int, default=TRAIN_CORES, help="total CPU cores to use")
+    parser.add_argument("--output-dir", default=".", help="directory for the model pickles")
+    parser.add_argument("--report", default="train_report.json", help="where to write the timing report")
+    parser.add_argument("--publish", action="store_true",
+                        help="publish each platform with both models trained as a new registry version")
+    parser.add_argument("--registry", default=MODEL_REGISTRY_DIR)
+    args = parser.parse_args()
+
+    specs = [spec for spec in MODEL_SPECS
+             if spec.platform in (args.platform or PLATFORMS) and spec.kind in (args.kind or ['loyalty', 'churn'])]
+    report = train(specs, args.cores, args.output_dir)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Trained {len(specs)} models in {report['total_s']}s, report written to {args.report}")
+
+    if args.publish:
+        for platform in PLATFORMS:
+            outputs = {spec.kind: spec.output for spec in specs if spec.platform == platform}
+            if len(outputs) == 2:
+                manifest = publish(args.registry, platform, os.path.join(args.output_dir, outputs['loyalty']),
+                                   os.path.join(args.output_dir, outputs['churn']))
+                print(f"✅ Published {platform} models as {manifest['version']}")
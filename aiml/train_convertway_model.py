@@ -1,11 +1,12 @@
-import pandas as pd
 import joblib
-from datetime import datetime
 from sklearn.ensemble import RandomForestRegressor
 from sqlalchemy import create_engine
 import os
 from urllib.parse import quote_plus
 from dotenv import load_dotenv
+from features import LOYALTY_FEATURES, LOYALTY_LABEL_WEIGHTS, build_frame, feature_matrix, label_frame, loyalty_label
+from sketch import label_sketches, sketch_path
+from train_data import read_training_frame, report_memory
 
 # Load environment variables
 load_dotenv()
@@ -20,48 +21,30 @@ password_encoded = quote_plus(password)
 connection_str = f"mysql+pymysql://{user}:{password_encoded}@{host}/{database}"
 engine = create_engine(connection_str)
 
-# Load transactional data from Convertway
-query_txn = """
-    SELECT
-        m.merchant_id,
-        m.register_convertway,
-        s.order_count,
-        s.billing_amount,
-        s.margin_amount,
-        s.nps_score
-    FROM merchants m
-    JOIN data_convertway s ON m.merchant_id = s.merchant_id
-"""
-df_txn = pd.read_sql(query_txn, engine)
+# Load transactional data from Convertway; the label columns of each chunk
+# are sketched as it streams in
+sketches = label_sketches(LOYALTY_LABEL_WEIGHTS['convertway'])
+df_txn = read_training_frame(engine, 'convertway', on_chunk=lambda chunk: sketches.update(
+    label_frame(chunk, 'convertway', 'loyalty')))
 
-# Handle missing values early
-df_txn = df_txn.fillna(0)
+# Handle missing values early; a missing registration date stays missing, as in the scoring API
+df_txn.fillna({col: 0 for col in df_txn.columns if col != 'register_convertway'}, inplace=True)
 
-# Feature engineering
-df_txn['register_convertway'] = pd.to_datetime(df_txn['register_convertway'], errors='coerce')
-df_txn['merchant_age_days'] = (datetime.now() - df_txn['register_convertway']).dt.days.fillna(0)
-df_txn['margin_ratio'] = df_txn['margin_amount'] / df_txn['billing_amount'].replace(0, 1)
+# Feature engineering (shared with the scoring API)
+df_txn = build_frame(df_txn, 'convertway')
+df_txn['merchant_age_days'] = df_txn['merchant_age_days'].fillna(0)
 
 # Create pseudo-label (basic scoring heuristic)
-df_txn['label'] = (
-    0.30 * df_txn['order_count'].rank(pct=True) +
-    0.20 * df_txn['margin_amount'].rank(pct=True) +
-    0.15 * df_txn['margin_ratio'].rank(pct=True) +
-    0.15 * df_txn['merchant_age_days'].rank(pct=True) +
-    0.20 * df_txn['nps_score'].rank(pct=True)
-) * 100
+df_txn['label'] = loyalty_label(df_txn, 'convertway', sketches)
 
 # Ensure no NaNs in label
 df_txn['label'] = df_txn['label'].fillna(0)
 
 # Define features
-features = [
-    'order_count', 'billing_amount', 'margin_amount',
-    'nps_score', 'merchant_age_days', 'margin_ratio'
-]
+features = LOYALTY_FEATURES['convertway']
 
 # Prepare training data
-X = df_txn[features].fillna(0)
+X = feature_matrix(df_txn, features)
 y = df_txn['label']
 
 # Train model
@@ -70,4 +53,8 @@ model.fit(X, y)
 
 # Save model
 joblib.dump(model, "convertway-model.pkl")
+
+# Label percentile sketches, for placing new rows on the same scale
+sketches.save(sketch_path("convertway-model.pkl"))
 print("✅ Model trained and saved as convertway-model.pkl (aligned to data_convertway)")
+report_memory("train_convertway_model")
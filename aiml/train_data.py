@@ -0,0 +1,123 @@
+import os
+import resource
+from urllib.parse import quote_plus
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+try:
+    from .features import REGISTER_COLUMNS, partition_filter, training_query
+except ImportError:  # started from inside aiml/
+    from features import REGISTER_COLUMNS, partition_filter, training_query
+
+# Load environment variables
+load_dotenv()
+
+# Training ingestion settings
+TRAIN_LOW_MEMORY = os.getenv("TRAIN_LOW_MEMORY", "0") == "1"
+TRAIN_CHUNK_ROWS = int(os.getenv("TRAIN_CHUNK_ROWS", 50000))
+TRAIN_MEMORY_LIMIT_MB = float(os.getenv("TRAIN_MEMORY_LIMIT_MB", 0))
+
+
+class MemoryCeilingError(MemoryError):
+    pass
+
+
+def training_engine():
+    password = quote_plus(os.getenv("DB_PASSWORD", ""))
+    return create_engine(
+        f"mysql+pymysql://{os.getenv('DB_USER')}:{password}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
+    )
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def check_memory(stage, limit_mb=TRAIN_MEMORY_LIMIT_MB, extra_mb=0):
+    if limit_mb and peak_rss_mb() + extra_mb > limit_mb:
+        raise MemoryCeilingError(
+            f"{stage}: peak RSS {peak_rss_mb():.0f} MB + {extra_mb:.0f} MB needed exceeds "
+            f"TRAIN_MEMORY_LIMIT_MB={limit_mb:.0f}; lower TRAIN_CHUNK_ROWS or raise the limit"
+        )
+
+
+def downcast(df, platform):
+    # merchant_id as int32, registration date as datetime, every other
+    # column (DECIMALs arrive as objects) as float32
+    register_col = REGISTER_COLUMNS[platform]
+    for col in df.columns:
+        if col == register_col:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+        else:
+            dtype = np.int32 if col == 'merchant_id' else np.float32
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+    return df
+
+
+def _count_rows(conn, platform, till_dates=None):
+    return conn.execute(text(f"""
+        SELECT COUNT(*)
+        FROM merchants m
+        JOIN data_{platform} s ON m.merchant_id = s.merchant_id
+        {partition_filter(till_dates)}
+    """)).scalar()
+
+
+def read_training_frame(engine, platform, low_memory=TRAIN_LOW_MEMORY, chunksize=TRAIN_CHUNK_ROWS,
+                        limit_mb=TRAIN_MEMORY_LIMIT_MB, till_dates=None, on_chunk=None):
+    """Load the platform's training rows, optionally only some till_date partitions.
+
+    In low-memory mode the query is streamed with a server-side cursor and
+    each chunk is downcast and copied into column arrays allocated once from
+    a row count, so the full result never exists as float64/object data.
+
+    ``on_chunk`` is called with every chunk as it is read, e.g. to feed the
+    label sketches, and must not modify it. It makes the query stream in
+    chunks outside low-memory mode too.
+    """
+    query = training_query(platform, till_dates)
+    if not low_memory:
+        if on_chunk is None:
+            return pd.read_sql(query, engine)
+        chunks = []
+        with engine.connect().execution_options(stream_results=True) as conn:
+            for chunk in pd.read_sql(text(query), conn, chunksize=chunksize):
+                on_chunk(chunk)
+                chunks.append(chunk)
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.read_sql(query, engine)
+
+    with engine.connect().execution_options(stream_results=True) as conn:
+        capacity = _count_rows(conn, platform, till_dates)
+        columns = None
+        n_rows = 0
+
+        for chunk in pd.read_sql(text(query), conn, chunksize=chunksize):
+            chunk = downcast(chunk, platform)
+            if on_chunk is not None:
+                on_chunk(chunk)
+            if columns is None:
+                row_bytes = sum(dtype.itemsize for dtype in chunk.dtypes)
+                check_memory("allocate", limit_mb, capacity * row_bytes / 2**20)
+                columns = {col: np.empty(capacity, dtype=chunk[col].dtype) for col in chunk.columns}
+
+            # Rows inserted between the count and the read
+            if n_rows + len(chunk) > capacity:
+                capacity = max(n_rows + len(chunk), int(capacity * 1.25))
+                for col, values in columns.items():
+                    columns[col] = np.resize(values, capacity)
+
+            for col, values in columns.items():
+                values[n_rows:n_rows + len(chunk)] = chunk[col].to_numpy()
+            n_rows += len(chunk)
+            check_memory(f"chunk ending at row {n_rows}", limit_mb)
+
+    if columns is None:  # empty table
+        return pd.read_sql(query, engine)
+    return pd.DataFrame({col: values[:n_rows] for col, values in columns.items()}, copy=False)
+
+
+def report_memory(label):
+    print(f"📈 {label}: peak RSS {peak_rss_mb():.0f} MB")
@@ -1,11 +1,14 @@
 import pandas as pd
 import joblib
-from datetime import datetime
 from sklearn.ensemble import RandomForestRegressor
 from sqlalchemy import create_engine
 import os
 from urllib.parse import quote_plus
 from dotenv import load_dotenv
+from features import LOYALTY_FEATURES, LOYALTY_LABEL_WEIGHTS, build_frame, feature_matrix, label_frame, loyalty_label
+from sketch import label_sketches, sketch_path
+from train_data import read_training_frame, report_memory
+from history_agg import read_platform_history_features
 
 # Load environment variables
 load_dotenv()
@@ -19,85 +22,34 @@ password_encoded = quote_plus(password)
 connection_str = f"mysql+pymysql://{user}:{password_encoded}@{host}/{database}"
 engine = create_engine(connection_str)
 
-# Load transactional data including wallet_share
-query_txn = """
-    SELECT
-        m.merchant_id,
-        m.register_shipway,
-        s.order_count,
-        s.billing_amount,
-        s.margin_amount,
-        s.complaint_count,
-        s.returned_orders,
-        s.undelivered_orders,
-        s.services_amount,
-        s.delayed_orders,
-        s.average_resolution_tat,
-        s.wallet_share
-    FROM merchants m
-    JOIN data_shipway s ON m.merchant_id = s.merchant_id
-"""
-df_txn = pd.read_sql(query_txn, engine)
+# Load historical score aggregates (the same store the scoring API reads)
+df_hist = read_platform_history_features(engine, 'shipway')
 
-# Load historical score data
-query_hist = """
-    SELECT
-        merchant_id,
-        MAX(till_date) AS latest_date,
-        AVG(loyalty_score_shipway) AS avg_loyalty_score,
-        AVG(churn_rate_shipway) AS avg_churn_rate,
-        MAX(loyalty_score_shipway) - MIN(loyalty_score_shipway) AS loyalty_score_delta,
-        COUNT(*) AS history_months
-    FROM merchants_scores_history
-    GROUP BY merchant_id
-"""
-df_hist = pd.read_sql(query_hist, engine)
+# Load transactional data including wallet_share; the label columns of each
+# chunk are sketched as it streams in
+sketches = label_sketches(LOYALTY_LABEL_WEIGHTS['shipway'])
+df_txn = read_training_frame(engine, 'shipway', on_chunk=lambda chunk: sketches.update(
+    label_frame(chunk.copy(), 'shipway', 'loyalty', df_hist)))
 
 engine.dispose()
 
-# Merge transactional data with historical score features
-merged_df = pd.merge(df_txn, df_hist, on="merchant_id", how="left")
-
-# Feature engineering
-merged_df['register_shipway'] = pd.to_datetime(merged_df['register_shipway'])
-merged_df['merchant_age_days'] = (datetime.now() - merged_df['register_shipway']).dt.days
-merged_df['return_rate'] = merged_df['undelivered_orders'] / merged_df['order_count'].replace(0, 1)
-merged_df['margin_ratio'] = merged_df['margin_amount'] / merged_df['billing_amount'].replace(0, 1)
+# Merge historical score features and run the shared feature engineering
+merged_df = build_frame(df_txn, 'shipway', df_hist)
 
 # Create pseudo-label for loyalty score
-merged_df['label'] = (
-    0.25 * merged_df['order_count'].rank(pct=True) +
-    0.20 * merged_df['margin_amount'].rank(pct=True) +
-    0.15 * merged_df['wallet_share'].rank(pct=True) +
-    0.15 * merged_df['merchant_age_days'].rank(pct=True) +
-    0.05 * merged_df['margin_ratio'].rank(pct=True) +
-    0.05 * merged_df['services_amount'].rank(pct=True) +
-    0.05 * merged_df['avg_loyalty_score'].rank(pct=True) -
-    0.05 * merged_df['undelivered_orders'].rank(pct=True) -
-    0.03 * merged_df['complaint_count'].rank(pct=True) -
-    0.02 * merged_df['avg_churn_rate'].rank(pct=True)
-) * 100
+merged_df['label'] = loyalty_label(merged_df, 'shipway', sketches)
 
 # Define features
-features = [
-    'order_count', 'billing_amount', 'margin_amount', 'complaint_count',
-    'returned_orders', 'undelivered_orders', 'services_amount',
-    'delayed_orders', 'average_resolution_tat', 'merchant_age_days',
-    'return_rate', 'margin_ratio', 'avg_loyalty_score', 'avg_churn_rate',
-    'loyalty_score_delta', 'history_months', 'wallet_share'
-]
-
-# Fill NaNs in features with 0
-merged_df[features] = merged_df[features].fillna(0)
+features = LOYALTY_FEATURES['shipway']
 
-# Drop rows with NaN in label before training
-train_df = merged_df.dropna(subset=['label'])
+# Skip rows with NaN in label; NaNs in features are filled with 0
+labelled = merged_df['label'].notna()
 
-X = train_df[features]
-y = train_df['label']
+X = feature_matrix(merged_df, features, rows=labelled)
+y = merged_df['label'][labelled]
 
 # Optional sanity checks
-assert not X.isnull().values.any(), "NaNs detected in features"
+assert not pd.isnull(X).any(), "NaNs detected in features"
 assert not y.isnull().values.any(), "NaNs detected in label"
 
 # Train model
@@ -106,4 +58,8 @@ model.fit(X, y)
 
 # Save model
 joblib.dump(model, "shipway-model.pkl")
+
+# Label percentile sketches, for placing new rows on the same scale
+sketches.save(sketch_path("shipway-model.pkl"))
 print("✅ Model trained and saved as shipway-model.pkl with wallet_share included")
+report_memory("train_shipway_model")
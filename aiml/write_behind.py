@@ -0,0 +1,235 @@
+import asyncio
+import os
+import threading
+import time
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from .metrics import REGISTRY, Histogram
+    from .scoring import write_grand_scores, write_platform_scores
+except ImportError:  # started from inside aiml/
+    from metrics import REGISTRY, Histogram
+    from scoring import write_grand_scores, write_platform_scores
+
+# Write-behind settings: off by default, so every request commits its own writes
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_BATCH_ROWS = int(os.getenv("WRITE_BEHIND_BATCH_ROWS", 500))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", 0.5))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", 50000))
+
+# After a failed flush the next one waits WRITE_BEHIND_INTERVAL doubled per
+# consecutive failure, up to WRITE_BEHIND_MAX_BACKOFF seconds; rows that
+# fail WRITE_BEHIND_MAX_ATTEMPTS flushes are dropped and counted as dead letters
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv("WRITE_BEHIND_MAX_BACKOFF", 60))
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", 5))
+
+FLUSH_SECONDS = REGISTRY.register(Histogram(
+    "aiml_write_behind_flush_seconds", "Time to write and commit one write-behind batch."))
+
+
+def write_batch(conn, platform_rows, grand_rows):
+    # One transaction per flush; merchant_id order keeps row locks in a stable order
+    for platform, rows in platform_rows.items():
+        write_platform_scores(conn, platform, sorted(rows, key=lambda row: (row[0], row[2])))
+    if grand_rows:
+        write_grand_scores(conn, sorted(grand_rows))
+    conn.commit()
+
+
+class WriteBehindQueue:
+    """Coalescing in-process queue for score and history upserts.
+
+    Requests hand over their rows and respond straight away. Pending rows
+    are keyed per merchant (and month, for history), so a merchant scored
+    again before the next flush only keeps its latest values. A background
+    task flushes everything pending as one batched transaction once
+    ``batch_rows`` keys are waiting or ``interval`` seconds have passed,
+    and drains the queue when the app shuts down.
+
+    ``put`` refuses new keys once ``max_pending`` are waiting, and the
+    caller then writes synchronously. Merchant history aggregates read by
+    the next request can lag by up to one flush. Failed flushes back off
+    exponentially, and rows still failing after ``max_attempts`` flushes
+    are dropped.
+    """
+
+    def __init__(self, db_pool, batch_rows=WRITE_BEHIND_BATCH_ROWS, interval=WRITE_BEHIND_INTERVAL,
+                 max_pending=WRITE_BEHIND_MAX_PENDING, max_backoff=WRITE_BEHIND_MAX_BACKOFF,
+                 max_attempts=WRITE_BEHIND_MAX_ATTEMPTS):
+        self.db_pool = db_pool
+        self.batch_rows = batch_rows
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self._pending = {}
+        self._attempts = {}
+        self._failures = 0
+        self._lock = threading.Lock()
+        # One flush at a time, so a flush also waits out one already writing
+        self._flush_lock = asyncio.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self.enqueued = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.errors = 0
+        self.dead_lettered = 0
+        self.last_error = None
+        self.last_flush_s = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Flush whatever is pending, then let the flusher exit
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    def put(self, platform_rows, grand=None):
+        """Queue ``{platform: score rows}`` and an optional grand score.
+
+        Score rows are ``(merchant_id, from_date, till_date, score,
+        churn_rate)``, ``grand`` is ``(merchant_id, grand_score,
+        grand_badge)``. Returns False, queueing nothing, when the queue is
+        full or not running.
+        """
+        items = {('platform', platform, row[0], row[1]): row
+                 for platform, rows in platform_rows.items() for row in rows}
+        if grand is not None:
+            items[('grand', grand[0])] = grand
+
+        with self._lock:
+            if self._task is None or self._stopping:
+                return False
+            new_keys = sum(1 for key in items if key not in self._pending)
+            if len(self._pending) + new_keys > self.max_pending:
+                self.rejected += 1
+                return False
+            self._pending.update(items)
+            self.enqueued += len(items)
+            self.coalesced += len(items) - new_keys
+            full = len(self._pending) >= self.batch_rows
+
+        if full:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    async def _run(self):
+        while not self._stopping:
+            if self._failures:
+                # Backing off: a full queue doesn't cut the wait short, only stop() does
+                loop = asyncio.get_running_loop()
+                retry_at = loop.time() + min(self.max_backoff, self.interval * 2 ** self._failures)
+                while not self._stopping and loop.time() < retry_at:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), retry_at - loop.time())
+                    except asyncio.TimeoutError:
+                        pass
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self.flush()
+        # Final drain: whatever arrived before stop() was called
+        await self.flush()
+        if self._pending:
+            print(f"⚠️ Write-behind queue stopped with {len(self._pending)} unwritten rows")
+
+    async def flush(self, raise_errors=False):
+        """Write everything pending; returns the rows written.
+
+        Waits for a flush already in progress first, so once this returns
+        every row queued before the call is committed, or back in the
+        queue after a failure (re-raised when ``raise_errors``).
+        """
+        async with self._flush_lock:
+            return await self._flush(raise_errors)
+
+    async def _flush(self, raise_errors):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        platform_rows = {}
+        grand_rows = []
+        for key, row in batch.items():
+            if key[0] == 'grand':
+                grand_rows.append(row)
+            else:
+                platform_rows.setdefault(key[1], []).append(row)
+
+        start = time.perf_counter()
+        try:
+            async with self.db_pool.connection() as conn:
+                await run_in_threadpool(write_batch, conn, platform_rows, grand_rows)
+        except Exception as e:
+            # Put the batch back unless newer values arrived in the meantime,
+            # dropping rows that have failed max_attempts flushes
+            dead = 0
+            with self._lock:
+                for key, row in batch.items():
+                    attempts = self._attempts.get(key, 0) + 1
+                    if attempts >= self.max_attempts:
+                        self._attempts.pop(key, None)
+                        dead += 1
+                        continue
+                    self._attempts[key] = attempts
+                    self._pending.setdefault(key, row)
+                self.errors += 1
+                self.dead_lettered += dead
+                self.last_error = f"{type(e).__name__}: {e}"
+                self._failures += 1
+            print(f"⚠️ Write-behind flush of {len(batch)} rows failed ({dead} dropped): {e}")
+            if raise_errors:
+                raise
+            return 0
+
+        elapsed = time.perf_counter() - start
+        FLUSH_SECONDS.observe(elapsed)
+        with self._lock:
+            for key in batch:
+                self._attempts.pop(key, None)
+            self._failures = 0
+            self.flushes += 1
+            self.flushed_rows += len(batch)
+            self.last_flush_s = elapsed
+        return len(batch)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self._task is not None,
+                "depth": len(self._pending),
+                "batch_rows": self.batch_rows,
+                "interval_seconds": self.interval,
+                "max_pending": self.max_pending,
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "rejected": self.rejected,
+                "flushes": self.flushes,
+                "flushed_rows": self.flushed_rows,
+                "errors": self.errors,
+                "consecutive_failures": self._failures,
+                "dead_lettered": self.dead_lettered,
+                "last_error": self.last_error,
+                "last_flush_ms": round(self.last_flush_s * 1000, 3) if self.last_flush_s is not None else None
+            }
@@ -1,12 +1,13 @@
 const pool = require('./../utils/db');
+const { notifyDataChanged } = require('./../utils/aiml');
 
 const getTopGrandLoyalty = async (req, res) => {
     try {
         const [rows] = await pool.query(
-            `SELECT merchant_id, grand_score, grand_badge 
-        FROM merchants_scores 
-        WHERE grand_score IS NOT NULL 
-        ORDER BY grand_score DESC 
+            `SELECT merchant_id, score AS grand_score, badge AS grand_badge
+        FROM merchants_leaderboard
+        WHERE board = 'grand'
+        ORDER BY rank_primary DESC
         LIMIT 10`
         );
 
@@ -23,10 +24,10 @@ const getTopGrandLoyalty = async (req, res) => {
 const getShipwayHighLoyaltyChurn = async (req, res) => {
     try {
         const query = `
-      SELECT merchant_id, loyalty_score_shipway, churn_rate_shipway
-      FROM merchants_scores
-      WHERE loyalty_score_shipway IS NOT NULL AND churn_rate_shipway IS NOT NULL
-      ORDER BY loyalty_score_shipway DESC, churn_rate_shipway DESC
+      SELECT merchant_id, score AS loyalty_score_shipway, churn_rate AS churn_rate_shipway
+      FROM merchants_leaderboard
+      WHERE board = 'shipway_loyalty'
+      ORDER BY rank_primary DESC, rank_secondary DESC
       LIMIT 10;
     `;
 
@@ -48,10 +49,10 @@ const getShipwayHighLoyaltyChurn = async (req, res) => {
 const getUnicommerceHighLoyaltyChurn = async (req, res) => {
     try {
         const query = `
-      SELECT merchant_id, loyalty_score_unicommerce, churn_rate_unicommerce
-      FROM merchants_scores
-      WHERE loyalty_score_unicommerce IS NOT NULL AND churn_rate_unicommerce IS NOT NULL
-      ORDER BY loyalty_score_unicommerce DESC, churn_rate_unicommerce DESC
+      SELECT merchant_id, score AS loyalty_score_unicommerce, churn_rate AS churn_rate_unicommerce
+      FROM merchants_leaderboard
+      WHERE board = 'unicommerce_loyalty'
+      ORDER BY rank_primary DESC, rank_secondary DESC
       LIMIT 10;
     `;
 
@@ -73,10 +74,10 @@ const getUnicommerceHighLoyaltyChurn = async (req, res) => {
 const getConvertwayHighLoyaltyChurn = async (req, res) => {
     try {
         const query = `
-      SELECT merchant_id, loyalty_score_convertway, churn_rate_convertway
-      FROM merchants_scores
-      WHERE loyalty_score_convertway IS NOT NULL AND churn_rate_convertway IS NOT NULL
-      ORDER BY loyalty_score_convertway DESC, churn_rate_convertway DESC
+      SELECT merchant_id, score AS loyalty_score_convertway, churn_rate AS churn_rate_convertway
+      FROM merchants_leaderboard
+      WHERE board = 'convertway_loyalty'
+      ORDER BY rank_primary DESC, rank_secondary DESC
       LIMIT 10;
     `;
 
@@ -98,11 +99,10 @@ const getConvertwayHighLoyaltyChurn = async (req, res) => {
 const getShipwayAverageLoyaltyHighChurn = async (req, res) => {
     try {
         const [rows] = await pool.query(`
-      SELECT merchant_id, loyalty_score_shipway, churn_rate_shipway
-      FROM merchants_scores
-      WHERE loyalty_score_shipway BETWEEN 20 AND 40
-        AND churn_rate_shipway > 40
-      ORDER BY churn_rate_shipway DESC
+      SELECT merchant_id, score AS loyalty_score_shipway, churn_rate AS churn_rate_shipway
+      FROM merchants_leaderboard
+      WHERE board = 'shipway_average_loyalty_high_churn'
+      ORDER BY rank_primary DESC
       LIMIT 10
     `);
 
@@ -122,11 +122,10 @@ const getShipwayAverageLoyaltyHighChurn = async (req, res) => {
 const getConvertwayAverageLoyaltyHighChurn = async (req, res) => {
     try {
         const [rows] = await pool.query(`
-      SELECT merchant_id, loyalty_score_convertway, churn_rate_convertway
-      FROM merchants_scores
-      WHERE loyalty_score_convertway BETWEEN 20 AND 40
-        AND churn_rate_convertway > 40
-      ORDER BY churn_rate_convertway DESC
+      SELECT merchant_id, score AS loyalty_score_convertway, churn_rate AS churn_rate_convertway
+      FROM merchants_leaderboard
+      WHERE board = 'convertway_average_loyalty_high_churn'
+      ORDER BY rank_primary DESC
       LIMIT 10
     `);
 
@@ -146,11 +145,10 @@ const getConvertwayAverageLoyaltyHighChurn = async (req, res) => {
 const getUnicommerceAverageLoyaltyHighChurn = async (req, res) => {
     try {
         const [rows] = await pool.query(`
-      SELECT merchant_id, loyalty_score_unicommerce, churn_rate_unicommerce
-      FROM merchants_scores
-      WHERE loyalty_score_unicommerce BETWEEN 20 AND 40
-        AND churn_rate_unicommerce > 40
-      ORDER BY churn_rate_unicommerce DESC
+      SELECT merchant_id, score AS loyalty_score_unicommerce, churn_rate AS churn_rate_unicommerce
+      FROM merchants_leaderboard
+      WHERE board = 'unicommerce_average_loyalty_high_churn'
+      ORDER BY rank_primary DESC
       LIMIT 10
     `);
 
@@ -169,38 +167,19 @@ const getUnicommerceAverageLoyaltyHighChurn = async (req, res) => {
 
 const getTopShipwayLoyalty = async (req, res) => {
     try {
-        // Step 1: Fetch top 50 merchants by loyalty score
+        // Top merchants with their lifetime order and billing totals, kept by the scoring service
         const [rows] = await pool.query(
-            `SELECT merchant_id, loyalty_score_shipway 
-       FROM merchants_scores 
-       WHERE loyalty_score_shipway IS NOT NULL 
-       ORDER BY loyalty_score_shipway DESC 
+            `SELECT merchant_id, score AS loyalty_score_shipway,
+             COALESCE(total_orders, 0) AS total_orders, COALESCE(total_billing, 0) AS total_billing
+       FROM merchants_leaderboard
+       WHERE board = 'shipway_loyalty'
+       ORDER BY rank_primary DESC, rank_secondary DESC
        LIMIT 5`
         );
 
-        // Step 2: For each merchant, get total orders and billing amount
-        const enrichedMerchants = await Promise.all(
-            rows.map(async (merchant) => {
-                const [summary] = await pool.query(
-                    `SELECT 
-             SUM(order_count) AS total_orders, 
-             SUM(billing_amount) AS total_billing 
-           FROM data_shipway 
-           WHERE merchant_id = ?`,
-                    [merchant.merchant_id]
-                );
-
-                return {
-                    ...merchant,
-                    total_orders: summary[0].total_orders || 0,
-                    total_billing: summary[0].total_billing || 0,
-                };
-            })
-        );
-
         res.json({
             success: true,
-            data: enrichedMerchants,
+            data: rows,
         });
     } catch (err) {
         console.error('Server error:', err);
@@ -210,38 +189,19 @@ const getTopShipwayLoyalty = async (req, res) => {
 
 const getTopConvertwayLoyalty = async (req, res) => {
     try {
-        // Step 1: Fetch top 50 merchants by loyalty score
+        // Top merchants with their lifetime order and billing totals, kept by the scoring service
         const [rows] = await pool.query(
-            `SELECT merchant_id, loyalty_score_convertway
-       FROM merchants_scores 
-       WHERE loyalty_score_convertway IS NOT NULL 
-       ORDER BY loyalty_score_convertway DESC 
+            `SELECT merchant_id, score AS loyalty_score_convertway,
+             COALESCE(total_orders, 0) AS total_orders, COALESCE(total_billing, 0) AS total_billing
+       FROM merchants_leaderboard
+       WHERE board = 'convertway_loyalty'
+       ORDER BY rank_primary DESC, rank_secondary DESC
        LIMIT 5`
         );
 
-        // Step 2: For each merchant, get total orders and billing amount
-        const enrichedMerchants = await Promise.all(
-            rows.map(async (merchant) => {
-                const [summary] = await pool.query(
-                    `SELECT 
-             SUM(order_count) AS total_orders, 
-             SUM(billing_amount) AS total_billing 
-           FROM data_convertway
-           WHERE merchant_id = ?`,
-                    [merchant.merchant_id]
-                );
-
-                return {
-                    ...merchant,
-                    total_orders: summary[0].total_orders || 0,
-                    total_billing: summary[0].total_billing || 0,
-                };
-            })
-        );
-
         res.json({
             success: true,
-            data: enrichedMerchants,
+            data: rows,
         });
     } catch (err) {
         console.error('Server error:', err);
@@ -251,38 +211,19 @@ const getTopConvertwayLoyalty = async (req, res) => {
 
 const getTopUnicommerceLoyalty = async (req, res) => {
     try {
-        // Step 1: Fetch top 50 merchants by loyalty score
+        // Top merchants with their lifetime order and billing totals, kept by the scoring service
         const [rows] = await pool.query(
-            `SELECT merchant_id, loyalty_score_unicommerce 
-       FROM merchants_scores 
-       WHERE loyalty_score_unicommerce IS NOT NULL 
-       ORDER BY loyalty_score_unicommerce DESC 
+            `SELECT merchant_id, score AS loyalty_score_unicommerce,
+             COALESCE(total_orders, 0) AS total_orders, COALESCE(total_billing, 0) AS total_billing
+       FROM merchants_leaderboard
+       WHERE board = 'unicommerce_loyalty'
+       ORDER BY rank_primary DESC, rank_secondary DESC
        LIMIT 5`
         );
 
-        // Step 2: For each merchant, get total orders and billing amount
-        const enrichedMerchants = await Promise.all(
-            rows.map(async (merchant) => {
-                const [summary] = await pool.query(
-                    `SELECT 
-             SUM(order_count) AS total_orders, 
-             SUM(billing_amount) AS total_billing 
-           FROM data_unicommerce 
-           WHERE merchant_id = ?`,
-                    [merchant.merchant_id]
-                );
-
-                return {
-                    ...merchant,
-                    total_orders: summary[0].total_orders || 0,
-                    total_billing: summary[0].total_billing || 0,
-                };
-            })
-        );
-
         res.json({
             success: true,
-            data: enrichedMerchants,
+            data: rows,
         });
     } catch (err) {
         console.error('Server error:', err);
@@ -364,6 +305,7 @@ const updateShipwayMerchantStats = async (req, res) => {
 
             await pool.execute(updateQuery, [...Object.values(updatedValues), ...whereValues]);
 
+            await notifyDataChanged(merchant_id, 'shipway');
             return res.json({ success: true, message: 'Shipway data updated successfully' });
 
         } else {
@@ -377,6 +319,7 @@ const updateShipwayMerchantStats = async (req, res) => {
 
             await pool.execute(insertQuery, insertValues);
 
+            await notifyDataChanged(merchant_id, 'shipway');
             return res.json({ success: true, message: 'Shipway data inserted successfully' });
         }
 
@@ -441,6 +384,7 @@ const updateConvertwayMerchantStats = async (req, res) => {
 
             await pool.execute(updateQuery, [...Object.values(updatedValues), ...whereValues]);
 
+            await notifyDataChanged(merchant_id, 'convertway');
             return res.json({ success: true, message: 'Convertway data updated successfully' });
 
         } else {
@@ -454,6 +398,7 @@ const updateConvertwayMerchantStats = async (req, res) => {
 
             await pool.execute(insertQuery, insertValues);
 
+            await notifyDataChanged(merchant_id, 'convertway');
             return res.json({ success: true, message: 'Convertway data inserted successfully' });
         }
 
@@ -516,6 +461,7 @@ const updateUnicommerceMerchantStats = async (req, res) => {
                 [...Object.values(updated), ...whereValues]
             );
 
+            await notifyDataChanged(merchant_id, 'unicommerce');
             return res.json({ success: true, message: 'Unicommerce data updated successfully' });
 
         } else {
@@ -528,6 +474,7 @@ const updateUnicommerceMerchantStats = async (req, res) => {
                 insertValues
             );
 
+            await notifyDataChanged(merchant_id, 'unicommerce');
             return res.json({ success: true, message: 'Unicommerce data inserted successfully' });
         }
 
@@ -3,30 +3,7 @@ const pool = require('./../utils/db');
 const { Buffer } = require('buffer');
 const axios = require('axios');
 
-const os = require('os');
-
-const isLocal = () => {
-  const hostname = os.hostname().toLowerCase();
-  const localIndicators = ['localhost', 'local', '127.0.0.1'];
-
-  // Check if hostname is obviously local
-  if (localIndicators.some(local => hostname.includes(local))) return true;
-
-  // Check all network interfaces
-  const interfaces = os.networkInterfaces();
-  for (const iface of Object.values(interfaces)) {
-    for (const addr of iface || []) {
-      if (addr.family === 'IPv4' && addr.address.startsWith('127.')) return true;
-      if (addr.family === 'IPv4' && addr.address.startsWith('192.168.')) return true;
-    }
-  }
-
-  return false;
-};
-
-const AIML_API_FINAL_URL = isLocal()
-  ? process.env.AIML_API_URL
-  : process.env.AIML_API_URL_REMOTE;
+const { AIML_API_FINAL_URL } = require('./../utils/aiml');
 
 const login = async (req, res) => {
     try {
@@ -0,0 +1,43 @@
+// aiml.js
+const axios = require('axios');
+const os = require('os');
+
+const isLocal = () => {
+  const hostname = os.hostname().toLowerCase();
+  const localIndicators = ['localhost', 'local', '127.0.0.1'];
+
+  // Check if hostname is obviously local
+  if (localIndicators.some(local => hostname.includes(local))) return true;
+
+  // Check all network interfaces
+  const interfaces = os.networkInterfaces();
+  for (const iface of Object.values(interfaces)) {
+    for (const addr of iface || []) {
+      if (addr.family === 'IPv4' && addr.address.startsWith('127.')) return true;
+      if (addr.family === 'IPv4' && addr.address.startsWith('192.168.')) return true;
+    }
+  }
+
+  return false;
+};
+
+const AIML_API_FINAL_URL = isLocal()
+  ? process.env.AIML_API_URL
+  : process.env.AIML_API_URL_REMOTE;
+
+// Tell the scoring service a merchant's platform data changed. It drops the
+// cached scores and rescores the merchant in the background, so dashboards
+// keep reading precomputed scores. Failures are logged only; the data update
+// itself already succeeded.
+const notifyDataChanged = async (merchantId, platform) => {
+  try {
+    await axios.post(`${AIML_API_FINAL_URL}/events/data-changed`, {
+      merchant_id: Number(merchantId),
+      platform,
+    });
+  } catch (err) {
+    console.error(`Failed to report ${platform} data change for merchant ${merchantId}:`, err.message);
+  }
+};
+
+module.exports = { AIML_API_FINAL_URL, notifyDataChanged };